@@ -1,50 +1,67 @@
 import logging
+import os
 import re
+import contextlib
+import threading
 import time
-
-import openai
-from bs4 import BeautifulSoup
-from tqdm import tqdm
+import zlib
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from aligner import Aligner
+from backends import BackendError, OpenAIBackend
+from cuestore import BRACKETED, MUSIC_ASTERISK, MUSIC_NOTE, CueStore, cue_flags
+from journal import TranslationJournal
+from metrics import Metrics, estimate_cost
+from planner import SlicePlanner
+from ratelimiter import REQUESTS_PER_MINUTE, TOKENS_PER_MINUTE, RateLimiter
+from srtparser import format_timestamp, parse_srt, parse_timestamp
+from srtwriter import SrtWriter
+from tags import restore_tags, strip_tags, strip_with_tags, sub_with_tags
+from tokenizer import count_tokens
 
 logger = logging.getLogger()
 
 MODEL_ENGINE = "gpt-3.5-turbo-0301"
 MAX_TOKENS = 3000
+SLICE_TOKENS = 800
 
-class TqdmLoggingHandler(logging.Handler):
-    def __init__(self, level=logging.NOTSET):
-        super().__init__(level)
-
-    def emit(self, record):
-        try:
-            msg = self.format(record)
-            tqdm.write(msg)
-            self.flush()
-        except (KeyboardInterrupt, SystemExit):
-            raise
-        except:
-            self.handleError(record)
+square_brackets_regex = re.compile(r'\[.*?\]')
+# [00:00:01,000 --> 00:00:02,000] translated text
+response_regex = re.compile(r"\[(.*) -->.*\] (.*)")
+whitespace_regex = re.compile(r'\s+')
 
-logger = logging.getLogger()
-logger.setLevel(logging.DEBUG)
+class LineComparison():
+    # the original and the translated lines one after the other, formatted only when the record is written
 
-# create file handler for DEBUG level
-file_handler = logging.FileHandler('app.log', mode='w')
-file_handler.setLevel(logging.DEBUG)
-file_formatter = logging.Formatter('%(asctime)s %(levelname)s %(module)-12s %(message)s')
-file_handler.setFormatter(file_formatter)
-logger.addHandler(file_handler)
+    def __init__(self, original_lines, response_lines):
+        self.original_lines = original_lines
+        self.response_lines = response_lines
 
-logger.addHandler(TqdmLoggingHandler(level=logging.WARNING))
+    def __str__(self):
+        lines = []
+        for index, original_line in enumerate(self.original_lines):
+            lines.append(f"[{index}]")
+            lines.append(original_line)
+            if len(self.response_lines) > index:
+                lines.append(self.response_lines[index])
+        return "\n".join(lines)
 
-logger.info("spg logging started")
 
 class GptSrtTranslator():
 
     API_KEY = None
     MODEL_ENGINE = None
+    # Shared by every translator when set, otherwise translators with the same API key share a limiter
+    RATE_LIMITER = None
+    # Completion requests are sent to this TranslationBackend when set
+    BACKEND = None
+    # Translations are reused from and saved into this TranslationMemory when set
+    TRANSLATION_MEMORY = None
+    # Every request is recorded into this Metrics when set, otherwise into the one shared by the process
+    METRICS = None
+    # The original and translated text of every slice is written into this TraceWriter when set
+    TRACE_WRITER = None
 
     skip_square_brackets = True
     # [Cheering]
@@ -66,28 +83,72 @@ class GptSrtTranslator():
         Args:
             **kwargs: Keyword arguments for the SubtitleTranslator object. Optional arguments include:
                 - api_key: A string representing the OpenAI API key. Defaults to the class attribute API_KEY.
-                - slice_length: An integer representing the number of lines sent for translation in one step. Defaults to 10.
-                - relax_time: How many seconds to wait between chatgpt request. Defaults to 1.
+                - slice_tokens: Number of tokens of the subtitle lines sent for translation in one step. Defaults to 800.
+                - slice_length: Maximum number of lines sent for translation in one step. Defaults to None, only the tokens are counted.
+                - requests_per_minute: Request budget of the account. Defaults to 3500.
+                - tokens_per_minute: Token budget of the account. Defaults to 90000.
+                - rate_limiter: RateLimiter to schedule the requests. Defaults to the one shared by the API key.
+                - max_retries: How many times a failed slice is sent again. Defaults to 6.
+                - resume: Continue an interrupted translation from its checkpoint journal. Defaults to True.
+                - translation_memory: TranslationMemory with already translated subtitles. Defaults to the class attribute TRANSLATION_MEMORY.
+                - metrics: Metrics collecting the latency and token usage of every request. Defaults to the class attribute METRICS, or the one shared by the process.
+                - trace_writer: TraceWriter receiving the original and the translated text of every slice. Defaults to the class attribute TRACE_WRITER, no trace when None.
+                - concurrency: How many slices are translated in parallel. Defaults to 1.
+                - executor: ThreadPoolExecutor shared with other translators, the slices are sent by its threads. Defaults to an own executor with concurrency threads.
+                - api_base: Base url of the OpenAI compatible API. Defaults to https://api.openai.com/v1.
+                - backend: TranslationBackend sending the requests. Defaults to the class attribute BACKEND, or the OpenAIBackend shared by the API key.
                 - max_tokens: max number of tokens to use in a single go. Defaults to the class attribute MAX_TOKENS.
+                - context_lines: Number of the last subtitles of the previous slice sent along as context, they are not translated. Defaults to 0.
+                - deduplicate: Send repeated subtitles only once, the translation of the first one is copied to the others. Defaults to False.
+                - repair_context: Number of neighbouring subtitles sent with the missing ones when a slice is repaired. Defaults to 1.
+                - alignment_threshold: Slices aligned with a lower confidence are sent again, then queued for manual review. Defaults to 0.7.
+                - interactive_alignment: Ask the user to align the lines below the threshold instead. Defaults to False.
+                - output_token_ratio: Expected size of the translation compared to the original, in tokens. Defaults to 2.
                 - model_engine: which openai model language to use. Defaults to the class attribute MODEL_ENGINE.
                 - input_language: language of the original subtitle. Defaults to "english".
                 - output_language: language of the target subtitle. Defaults to "hungarian".
                 - subtitle_line_max_length: add a line break if a subtitle line is longer than max . Defaults to 50.
                 - input_file: Source of translation. Defaults to an empty string.
+                - cues: CueStore loaded by another translator of the same input file, only the translations are kept separately. Defaults to loading the input file.
                 - output_file: Target of translation. Defaults to "output.srt".
+                - progress_title: Label of the progress bar. Defaults to the episode number or the name of the input file.
+                - progress_position: Line of the progress bar when several files are translated together. Defaults to None.
+                - total_progress: tqdm progress bar of all files, advanced together with the progress bar of this file. Defaults to None.
 
         Returns:
             None.
         '''
-        openai.api_key = kwargs.get("api_key", self.API_KEY)
-
-        self.srt = {}
-        self.srt_index = {}
-        self.srt_index = {}
-
-        self.slice_length = kwargs.get("slice_length", 10)
-        self.relax_time = kwargs.get("relax_time", 0.5)
+        self.api_key = kwargs.get("api_key", self.API_KEY)
+        self.api_base = kwargs.get("api_base")
+        self.backend = kwargs.get("backend", self.BACKEND)
+        if self.backend is None:
+            self.backend = OpenAIBackend.shared(self.api_key, self.api_base)
+
+        self.cues = CueStore()
+
+        self.slice_tokens = kwargs.get("slice_tokens", SLICE_TOKENS)
+        self.slice_length = kwargs.get("slice_length")
+        self.rate_limiter = kwargs.get("rate_limiter", self.RATE_LIMITER)
+        if self.rate_limiter is None:
+            self.rate_limiter = RateLimiter.shared(str(self.api_key),
+                                                   requests_per_minute=kwargs.get("requests_per_minute", REQUESTS_PER_MINUTE),
+                                                   tokens_per_minute=kwargs.get("tokens_per_minute", TOKENS_PER_MINUTE))
+        self.max_retries = kwargs.get("max_retries", 6)
+        self.translation_memory = kwargs.get("translation_memory", self.TRANSLATION_MEMORY)
+        self.metrics = kwargs.get("metrics", self.METRICS)
+        if self.metrics is None:
+            self.metrics = Metrics.shared()
+        self.trace_writer = kwargs.get("trace_writer", self.TRACE_WRITER)
+        self.resume = kwargs.get("resume", True)
+        self.concurrency = max(1, kwargs.get("concurrency", 1))
+        self.executor = kwargs.get("executor")
         self.max_tokens = kwargs.get("max_tokens", MAX_TOKENS)
+        self.output_token_ratio = kwargs.get("output_token_ratio", 2)
+        self.alignment_threshold = kwargs.get("alignment_threshold", 0.7)
+        self.interactive_alignment = kwargs.get("interactive_alignment", False)
+        self.repair_context = kwargs.get("repair_context", 1)
+        self.context_lines = kwargs.get("context_lines", 0)
+        self.deduplicate = kwargs.get("deduplicate", False)
         self.model_engine = kwargs.get("model_engine", MODEL_ENGINE)
 
         self.input_language = kwargs.get("input_language", "english")
@@ -98,130 +159,93 @@ class GptSrtTranslator():
         self.input_file = kwargs.get("input_file", "")
         self.output_file = kwargs.get("output_file", "output.srt")
 
+        self.progress_title = kwargs.get("progress_title")
+        self.progress_position = kwargs.get("progress_position")
+        self.total_progress = kwargs.get("total_progress")
+
+        # token usage reported by the API
+        self.usage_lock = threading.Lock()
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
         logger.info("Starting translation")
         logger.info("Input srt file: %s", self.input_file)
         logger.info("Output srt file: %s", self.output_file)
 
-        if self.input_file:
+        if kwargs.get("cues") is not None:
+            self.cues = kwargs["cues"].fork()
+        elif self.input_file:
             self.load_srt()
 
-        if logger.isEnabledFor(logging.DEBUG):
-            with open('01-original.txt', mode='w', encoding="utf8") as file:
-                file.write("")
-            with open('02-translated.txt', mode='w', encoding="utf8") as file:
-                file.write("")
-
-        self.to_translate = []
         self.from_translate = []
 
+        # subtitles finished by an earlier, interrupted run
+        self.completed = set()
+        self.journal = None
+
+        # slices which could only be aligned with a low confidence
+        self.review = []
+        # start times of the subtitles in those slices, their translation is not put into the translation memory
+        self.review_starts = set()
+        # slices the last translate could not translate, they are left in the journal for the next run
+        self.failed_slices = 0
+
+        # repeated subtitles left out of the slices, by the first subtitle with the same text
+        self.copies = {}
+        self.copy_of = {}
+        self.saved_tokens = 0
+
+        # slices planned together with other translators of the same file, planned by translate when None
+        self.planned_slices = None
+        # sends the slices when set, returns a future of the translated text of a slice
+        self.dispatcher = None
+
     def load_srt(self) -> None:
         self.log("Loading srt")
-        with open(self.input_file, 'r', encoding="utf8") as f:
-            srt_text = f.read()
-            # Split the text at every integer which is followed by a timestamp
-            parts = re.split(r'(\d+)\n(\d\d:\d\d:\d\d,\d\d\d --> \d\d:\d\d:\d\d,\d\d\d)', srt_text)
-            if len(parts) <= 1:
-                logger.error("Empty srt file: %s", self.input_file)
-                return False
-
-            # Remove any empty parts
-            parts = [part for part in parts if part.strip()]
-
-            # Remove BOM
-            if parts[0] == '\ufeff':
-                del parts[0]
-
-            # Load srt into an object
-            self.srt = {}
-            index = 1
-            for i in range(0,len(parts), 3):
-                timestamp = parts[i+1].strip()
-                original = parts[i+2].strip()
-                try:
-
-                    # skip all caps subtitles
-                    if self.skip_all_caps:
-                        match = re.match(self.all_caps_regex, original.strip())
-                        if match:
-                            logger.debug("Skipping all caps: %s", original.strip())
-                            continue
 
-                    # skip subtitles in square brackets
-                    if self.skip_square_brackets:
-                        if original.strip().startswith("[") and original.strip().endswith("]"):
-                            logger.debug("Skipping lines in square brackets: %s", original.strip())
-                            continue
-
-                    # skip parts in sqauer brackets
-                    if self.skip_square_brackets and "[" in original:
-                        logger.debug("Skipping text in square brackets: %s", original.strip())
-                        original = re.sub(r'\[.*?\]', '', original)  # remove square brackets and text inside them
-                        original = re.sub(r'\s+', ' ', original)  # remove duplicate spaces
-
-                    self.srt[index] = {
-                        "index": index,
-                        "timestamp": timestamp,
-                        "original": original,
-                        "translated": ""
-                    }
-                    time_index = self.srt[index]["timestamp"].split(" --> ")[0]
-                    self.srt_index[time_index] = index
-                except KeyError:
-                    logger.error("Index not found in SRT: %s", index)
-
-                index += 1
-
-        self.log(f"Loaded {len(self.srt)} subtitles")
-
-    def get_translatable_text(self, start:int, buffer:int=5) -> str:
-        # create a simplified text structure so chatgpt will be able process it
-        total = ""
-        index = start
-        self.to_translate = []
-
-        while True:
-            if index > len(self.srt):
-                break
-
-            # Skip musical parts indicated with: *
-            if self.ignore_asterisks:
-                if self.srt[index]["original"].strip().startswith("*"):
-                    index = index + 1
+        # compile the filters once for the whole file
+        all_caps = re.compile(self.all_caps_regex)
+
+        self.cues = CueStore()
+
+        with open(self.input_file, 'r', encoding="utf8") as f:
+            for cue in parse_srt(f):
+                # formatting tags are removed once here and put back into the translation
+                # every later change of the text moves the tag positions along
+                original, markup = strip_with_tags(*strip_tags(cue.text))
+                if not original:
+                    logger.debug("Skipping empty subtitle at %s", format_timestamp(cue.start))
                     continue
-            # Skip musical parts indicated with: ♪
-            if self.ignore_note_sings:
-                if "♪" in self.srt[index]["original"]:
-                    index = index + 1
+
+                # skip all caps subtitles
+                if self.skip_all_caps and all_caps.match(original):
+                    logger.debug("Skipping all caps: %s", original)
                     continue
 
-            clean_subtitle = self.srt[index]['original'].replace('\n', ' ') + "\n"
-            total += f"[{self.srt[index]['timestamp']}] {clean_subtitle}"
-            self.to_translate.append(clean_subtitle)
+                if self.skip_square_brackets and "[" in original:
+                    # skip subtitles in square brackets
+                    if cue_flags(original) & BRACKETED:
+                        logger.debug("Skipping lines in square brackets: %s", original)
+                        continue
 
-            if index >= start + self.slice_length -1:
-                # wait for an end of a sentence
-                if total.strip()[-1] in ".?!:\"\'":
-                    # end of last line is an end of a sentence
-                    break
+                    # skip parts in square brackets
+                    logger.debug("Skipping text in square brackets: %s", original)
+                    original, markup = sub_with_tags(square_brackets_regex, '', original, markup)  # remove square brackets and text inside them
+                    original, markup = sub_with_tags(whitespace_regex, ' ', original, markup)  # remove duplicate spaces
+                    original, markup = strip_with_tags(original, markup)
 
-                if index+1 in self.srt and  self.srt[index+1]['original'][0].isupper():
-                    # next line starts with a capital letter, this line is probably and end of a sentence
-                    break
+                self.cues.append(cue.start, cue.end, original, markup)
 
-                if index  > start + self.slice_length + buffer:
-                    # checked forward until the max, stop adding extra lines
-                    break
+        if not self.cues:
+            logger.error("Empty srt file: %s", self.input_file)
+            return False
 
-            index = index + 1
-            if index not in self.srt or index > len(self.srt):
-                break
+        self.log(f"Loaded {len(self.cues)} subtitles")
 
-        # remove all html tags
-        soup = BeautifulSoup(total, "html.parser")
-        return (
-            index + 1,          # Next index to translate
-            soup.get_text()     # Translateable text
-        )
+    def subtitle_line(self, index):
+        clean_subtitle = self.cues.original(index).replace('\n', ' ') + "\n"
+        return f"[{self.cues.timestamp(index)}] {clean_subtitle}"
 
     def break_subtitle_line(self, text):
         """Breaks a subtitle line into two lines if it is longer than the specified maximum length."""
@@ -245,133 +269,449 @@ class GptSrtTranslator():
         return new_text
 
     def save_translated_text(self, text):
-        # process text received from chatgpt
+        # process text received from chatgpt, returns the indices of the translated subtitles
         self.from_translate = []
+        saved = []
 
         for line in text.split('\n'):
             # skip empty lines
             if len(line) == 0:
                 continue
 
-            pattern = r"\[(.*) -->.*\] (.*)"
-            match = re.search(pattern, line)
+            match = response_regex.search(line)
 
             if match:
                 timestamp = match.group(1)
                 translated_subtitle = match.group(2)
                 self.from_translate.append(translated_subtitle)
 
-                # break dialogs into two lines
-                if translated_subtitle.startswith("-") and translated_subtitle[2:-2].find("-") > 0:
-                    second_hyphen = translated_subtitle.find("-", translated_subtitle.find("-") + 1)
-                    new_text = translated_subtitle[:second_hyphen] + "\n-" + translated_subtitle[second_hyphen+1:]
-                    translated_subtitle = new_text
-                else:
-                    # break long text into two lines
-                    translated_subtitle = self.break_subtitle_line(translated_subtitle)
-
-                if timestamp in self.srt_index:
-                    subtitle_index = self.srt_index[timestamp]
-                    self.srt[subtitle_index]["translated"] = translated_subtitle
+                subtitle_index = self.find_subtitle(timestamp, saved)
+                if subtitle_index:
+                    self.cues.set_translated(subtitle_index, self.format_subtitle(subtitle_index, translated_subtitle))
+                    saved.append(subtitle_index)
+
+                    # the repeated subtitles get the same translation with their own formatting
+                    for copy in self.copies.get(subtitle_index, ()):
+                        self.cues.set_translated(copy, self.format_subtitle(copy, translated_subtitle))
+                        saved.append(copy)
+
+                    if self.translation_memory and self.cues.start(subtitle_index) not in self.review_starts:
+                        self.translation_memory.put(self.cues.original(subtitle_index),
+                                                    self.input_language,
+                                                    self.output_language,
+                                                    self.model_engine,
+                                                    translated_subtitle)
                 else:
                     logger.warning("Timestamp was not found when saving translated text: %s", timestamp)
 
+        return saved
+
+    def find_subtitle(self, timestamp, saved):
+        # index of the subtitle starting at the timestamp, subtitles starting at the same time are filled in order
+        start = parse_timestamp(timestamp)
+        if start is None:
+            return None
+
+        for index in self.cues.find_by_start(start):
+            if index not in saved:
+                return index
+
+        return None
+
+    def format_subtitle(self, index, translated_subtitle):
+        # line breaks of the translation and the formatting tags of the original subtitle
+        return restore_tags(self.format_translation(translated_subtitle), self.cues.markup(index),
+                            len(self.cues.original(index)))
+
+    def format_translation(self, translated_subtitle):
+        # break dialogs into two lines
+        if translated_subtitle.startswith("-") and translated_subtitle[2:-2].find("-") > 0:
+            second_hyphen = translated_subtitle.find("-", translated_subtitle.find("-") + 1)
+            return translated_subtitle[:second_hyphen] + "\n-" + translated_subtitle[second_hyphen+1:]
+
+        # break long text into two lines
+        return self.break_subtitle_line(translated_subtitle)
+
+    def load_from_translation_memory(self, index):
+        translated_subtitle = self.translation_memory.get(self.cues.original(index),
+                                                          self.input_language,
+                                                          self.output_language,
+                                                          self.model_engine)
+        if translated_subtitle is None:
+            return False
+
+        logger.debug("Found in translation memory: %s", translated_subtitle)
+        self.cues.set_translated(index, self.format_subtitle(index, translated_subtitle))
+        return True
+
+    def in_translation_memory(self, index):
+        # read only lookup of the dry run, the subtitle is not filled and the memory is not changed
+        return self.translation_memory.contains(self.cues.original(index),
+                                                self.input_language,
+                                                self.output_language,
+                                                self.model_engine)
+
+    def is_translatable(self, index, music, dry_run=False):
+        # Skip subtitles finished by an earlier run
+        if index in self.completed:
+            return False
+        # Skip musical parts indicated with: * or ♪
+        if self.cues.flags(index) & music:
+            return False
+        # Skip subtitles which were translated before
+        if self.translation_memory and (self.in_translation_memory(index) if dry_run else self.load_from_translation_memory(index)):
+            return False
+        return True
+
+    def translatable_indices(self, dry_run=False):
+        # the first subtitle to plan from and the subtitles to send
+        music = (MUSIC_ASTERISK if self.ignore_asterisks else 0) | (MUSIC_NOTE if self.ignore_note_sings else 0)
+
+        # resume from the first subtitle which was not finished by an earlier run
+        first = 1
+        while first in self.completed:
+            first += 1
+
+        translatable = [index for index in range(first, len(self.cues) + 1) if self.is_translatable(index, music, dry_run)]
+        if self.deduplicate:
+            translatable = self.deduplicate_indices(translatable)
+        return first, translatable
+
+    def deduplicate_indices(self, translatable):
+        # keep the first subtitle of every text, it is translated in its own context and copied to the later ones
+        self.copies = {}
+        self.copy_of = {}
+        self.saved_tokens = 0
+
+        first_of_text = {}
+        unique = []
+        for index in translatable:
+            text = whitespace_regex.sub(" ", self.cues.original(index)).strip()
+            if text in first_of_text:
+                self.copies[first_of_text[text]].append(index)
+                self.copy_of[index] = first_of_text[text]
+                self.saved_tokens += count_tokens(self.subtitle_line(index), self.model_engine)
+            else:
+                first_of_text[text] = index
+                self.copies[index] = []
+                unique.append(index)
+
+        self.copies = {index: copies for index, copies in self.copies.items() if copies}
+        return unique
+
+    def saved_token_share(self, slices):
+        # share of the subtitle tokens which were not sent thanks to the deduplication
+        sent = sum(current_slice.tokens for current_slice in slices)
+        return self.saved_tokens / max(1, sent + self.saved_tokens)
+
+    def plan_slices(self, first, translatable):
+        planner = SlicePlanner(self.cues, self.slice_tokens, self.slice_length, model_engine=self.model_engine,
+                               context_lines=self.context_lines)
+        return planner.plan(translatable, self.subtitle_line, first)
+
+    def get_slices(self):
+        # plan every slice of the file before anything is sent, slices are translated independently
+        return self.plan_slices(*self.translatable_indices())
+
+    def load_journal(self, restore=True):
+        # the journal of an earlier, interrupted run of the same translation
+        # without restore only the finished subtitles are read, the translations are not put into the cues
+        self.journal = TranslationJournal(self.output_file + ".journal.jsonl",
+                                          input_file=self.input_file,
+                                          subtitles=len(self.cues),
+                                          input_language=self.input_language,
+                                          output_language=self.output_language,
+                                          model_engine=self.model_engine)
+        if self.resume:
+            self.completed, translations = self.journal.load()
+            # the copies of repeated subtitles are journaled with the slice of their first occurrence, they are finished too
+            self.completed.update(translations)
+            for index, translated_subtitle in (translations.items() if restore else ()):
+                self.cues.set_translated(index, translated_subtitle)
+
+    def dry_run(self):
+        '''
+        Plans the translation without sending anything, returns the number of requests and the estimated tokens.
+
+        The dry run has no side effects: the journal and the translation memory are only read, the
+        subtitles are not filled from them.
+        '''
+        self.load_journal(restore=False)
+        return self.estimate(self.plan_slices(*self.translatable_indices(dry_run=True)))
+
+    def estimate(self, slices, languages=None):
+        # the requests are built and counted exactly like chat_gpt_translate, or a shared request of several languages, does
+        prompt_tokens = 0
+        completion_tokens = 0
+        reserved_tokens = 0
+        for current_slice in slices:
+            request = self.build_request(current_slice.text, current_slice.context, languages)
+            tokens = self.request_tokens(request)
+            prompt_tokens += tokens
+            completion_tokens += min(request["max_tokens"],
+                                     int(current_slice.tokens * self.output_token_ratio * (len(languages) if languages else 1)))
+            reserved_tokens += tokens + request["max_tokens"]
+
+        return {
+            "file": self.input_file,
+            "languages": languages or [self.output_language],
+            "subtitles": len(self.cues),
+            "finished": len(self.completed),
+            "to_translate": sum(len(current_slice.indices) for current_slice in slices),
+            "deduplicated": len(self.copy_of),
+            "saved_tokens": self.saved_tokens,
+            "requests": len(slices),
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "reserved_tokens": reserved_tokens,
+            "cost": estimate_cost(self.model_engine, prompt_tokens, completion_tokens),
+        }
+
     def translate(self):
         # translate the subtitle, show a progress bar during translation
         # create title for progress bas, find episode number in string
         match = re.search(r's\d+e\d+', self.input_file, re.IGNORECASE)
-        if match:
+        if self.progress_title:
+            title = self.progress_title
+        elif match:
             title = match.group()
+        elif self.input_file:
+            title = os.path.splitext(os.path.basename(self.input_file))[0][:20]
         else:
             title = "video"
 
         self.log("Starting translation")
 
-        index = 1
-        progress_subtitle = tqdm(total=len(self.srt), bar_format='{l_bar}{bar:40}{r_bar}', desc=title.ljust(10))
+        self.load_journal()
+        if self.completed:
+            self.log(f"Resuming translation, {len(self.completed)} subtitles were finished earlier")
+        self.journal.open(resume=bool(self.completed))
 
-        while index < len(self.srt):
-            logger.info("Slice: %d, %d pieces, total %d", index, self.slice_length, len(self.srt))
+        finished_earlier = set(self.completed)
+        slices = self.planned_slices if self.planned_slices is not None else self.get_slices()
+        logger.info("%d slices, %d subtitles, %d parallel requests", len(slices), len(self.cues), self.concurrency)
+        if self.copy_of:
+            self.log(f"{len(self.copy_of)} repeated subtitles are copied, "
+                     f"{self.saved_token_share(slices):.1%} of the subtitle tokens saved")
 
-            index, text_to_translate = self.get_translatable_text(index)
+        from tqdm import tqdm
 
-            if len(text_to_translate) < 10:
-                # No more lines
-                progress_subtitle.update(progress_subtitle.total-progress_subtitle.n)
-                break
+        progress_subtitle = tqdm(total=len(self.cues), bar_format='{l_bar}{bar:40}{r_bar}', desc=title.ljust(10),
+                                 position=self.progress_position)
+        self.update_progress(progress_subtitle, len(finished_earlier))
 
-            if logger.isEnabledFor(logging.DEBUG):
-                with open('01-original.txt', mode='a', encoding="utf8") as file:
-                    new_string = ''
-                    for line in text_to_translate.split('\n'):
-                        if ']' in line:
-                            idx = line.index(']') + 1
-                            line = line[:idx].strip() + '\n' + line[idx:].strip()
-                        new_string += line + '\n'
+        # slices may finish in any order, results are merged back in the original order
+        results = {}
+        next_slice = 0
+        failed_slices = 0
 
-                    file.write(new_string.strip()+"\n")
-                    file.write("-"*40 + "\n")
-
-            translated_text = None
-            error_found = None
-
-            relax_delay = 10
+        if self.executor is not None:
+            executor_context = contextlib.nullcontext(self.executor)
+        else:
+            executor_context = ThreadPoolExecutor(max_workers=self.concurrency)
+
+        with SrtWriter(self.output_file) as writer, executor_context as executor:
+            futures = {
+                self.submit_slice(executor, slice_number, current_slice): slice_number
+                for slice_number, current_slice in enumerate(slices)
+            }
+
+            try:
+                for future in as_completed(futures):
+                    slice_number = futures[future]
+                    results[slice_number] = future.result()
+
+                    start, end = slices[slice_number].start, slices[slice_number].end
+                    skipped = sum(1 for index in range(start, end) if index in finished_earlier)
+                    self.update_progress(progress_subtitle, end - start - skipped)
+
+                    while next_slice in results:
+                        if not self.merge_slice(slices[next_slice], results.pop(next_slice)):
+                            failed_slices += 1
+
+                        # every subtitle before the end of the merged slice is final
+                        self.write_srt(writer, slices[next_slice].end)
+                        next_slice += 1
+            except BaseException:
+                # stop sending the remaining slices, the merged ones are kept in the journal
+                for future in futures:
+                    future.cancel()
+                if self.executor is None:
+                    executor.shutdown(wait=False, cancel_futures=True)
+                raise
+
+            self.write_srt(writer, len(self.cues) + 1)
+
+        self.failed_slices = failed_slices
+        if failed_slices:
+            # a new run will send only the failed slices again
+            self.log(f"{failed_slices} slice(s) could not be translated, run again to retry them")
+            self.journal.close()
+        else:
+            # every slice was translated, nothing to resume anymore
+            self.journal.remove()
 
-            while (error_found or translated_text is None) and relax_delay <= 640:
+        self.update_progress(progress_subtitle, progress_subtitle.total - progress_subtitle.n)
 
-                translated_text = self.chat_gpt_translate(text_to_translate)
-                error_found = False
-                if translated_text is None:
-                    logger.error("Error during translation, wating for %d sec to overcome rate limitation...", relax_delay)
-                    error_found = True
-                elif translated_text.count("\n") < 2:
-                    # too few lines were returned
-                    logger.error("Short string was returned, wating for %d sec to overcome rate limitation...", relax_delay)
-                    error_found = True
+        self.log("Translation completed")
+        self.write_review()
+        if self.translation_memory:
+            self.log(self.translation_memory.stats())
+        progress_subtitle.close()
 
-                if error_found:
-                    time.sleep(relax_delay)
-                    logger.error("Trying again...")
-                    relax_delay += relax_delay
-                else:
-                    self.save_translated_text(translated_text)
+    def submit_slice(self, executor, slice_number, current_slice):
+        if self.dispatcher is not None:
+            return self.dispatcher.submit(self, executor, slice_number, current_slice)
+        return executor.submit(self.translate_slice, current_slice)
+
+    def update_progress(self, progress, count):
+        count = min(count, progress.total - progress.n)
+        progress.update(count)
+        if self.total_progress is not None:
+            self.total_progress.update(count)
+
+    def translate_slice(self, current_slice):
+        # send a slice for translation, the rate limiter delays the retries after errors
+        text_to_translate, indices = current_slice.text, current_slice.indices
+
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                logger.error("Trying again (%d/%d)...", attempt, self.max_retries)
+
+            # misaligned translations are only accepted when there are no more retries
+            try:
+                translated_text = self.chat_gpt_translate(text_to_translate,
+                                                          accept_misaligned=attempt == self.max_retries,
+                                                          attempt=attempt,
+                                                          context=current_slice.context)
+            except BackendError as e:
+                # the same request would fail again, the other slices go on
+                logger.error("Slice is not sent again: %s", e)
+                return None
+
+            if translated_text is None:
+                logger.error("No usable translation was returned")
+                continue
 
-                    if logger.isEnabledFor(logging.DEBUG):
-                        with open('02-translated.txt', mode='a', encoding="utf8") as file:
-                            new_string = ''
-                            for line in translated_text.split('\n'):
-                                if ']' in line:
-                                    idx = line.index(']') + 1
-                                    line = line[:idx].strip() + '\n' + line[idx:].strip()
-                                new_string += line + '\n'
+            damaged = self.find_damaged(indices, translated_text)
+            if len(damaged) == len(indices):
+                # none of the lines came back
+                logger.error("Short string was returned")
+                continue
 
-                            file.write(new_string.strip()+"\n")
-                            file.write("-"*40 + "\n")
+            if damaged:
+                translated_text = self.repair_slice(translated_text, damaged)
+            return translated_text
 
+        return None
 
-            progress_subtitle.update(index-progress_subtitle.n)
+    def response_timestamps(self, text):
+        # start times of the translated lines in a response, in milliseconds
+        starts = Counter()
+        for line in text.split('\n'):
+            match = response_regex.search(line)
+            if match and match.group(2).strip():
+                start = parse_timestamp(match.group(1))
+                if start is not None:
+                    starts[start] += 1
+        return starts
 
-            self.save_srt()
+    def find_damaged(self, indices, text):
+        '''Returns the subtitles of a slice which are missing or duplicated in the translation.'''
+        expected = Counter(self.cues.start(index) for index in indices)
+        returned = self.response_timestamps(text)
 
-        self.log("Translation completed")
-        progress_subtitle.close()
+        return [index for index in indices if returned[self.cues.start(index)] != expected[self.cues.start(index)]]
 
-    def save_srt(self):
-        srt_content = ""
+    def repair_slice(self, translated_text, damaged):
+        # translate only the damaged subtitles again, with a few neighbours as context
+        logger.warning("Repairing %d missing or duplicated line(s)", len(damaged))
 
-        for index, subtitle in self.srt.items():
-            srt_content += f"{index}\n"
-            srt_content += f"{subtitle['timestamp']}\n"
-            srt_content += f"{subtitle['translated']}\n"
-            srt_content += "\n"
+        context = set()
+        for index in damaged:
+            context.update(range(index - self.repair_context, index + self.repair_context + 1))
+        indices = sorted(index for index in context if index in self.cues and index not in self.completed)
 
-        with open(self.output_file, 'w', encoding="utf8") as file:
-            file.write(srt_content)
+        try:
+            repaired_text = self.chat_gpt_translate("".join(self.subtitle_line(index) for index in indices), purpose="repair")
+        except BackendError as e:
+            logger.error("Repair request failed: %s", e)
+            repaired_text = None
+        if repaired_text is None:
+            logger.error("Repair failed, keeping the original translation")
+            return translated_text
+
+        # replace the lines of the damaged subtitles, the context lines are dropped
+        damaged_starts = {self.cues.start(index) for index in damaged}
+        repaired_starts = set(self.response_timestamps(repaired_text)) & damaged_starts
+
+        def belongs_to(line, starts):
+            match = response_regex.search(line)
+            return match and parse_timestamp(match.group(1)) in starts
+
+        lines = [line for line in translated_text.split('\n') if not belongs_to(line, repaired_starts)]
+        lines += [line for line in repaired_text.split('\n') if belongs_to(line, repaired_starts)]
+
+        if len(repaired_starts) < len(damaged_starts):
+            logger.warning("%d line(s) are still missing after the repair", len(damaged_starts) - len(repaired_starts))
+
+        return '\n'.join(lines)
+
+    def merge_slice(self, current_slice, translated_text):
+        # save the result of a slice into the subtitle, returns False if the slice failed
+        start, end = current_slice.start, current_slice.end
+        self.dump_debug('01-original.txt', current_slice.text)
+
+        if translated_text is None:
+            logger.error("Slice could not be translated: %d - %d", start, end - 1)
+            return False
+
+        saved = self.save_translated_text(translated_text)
+        self.dump_debug('02-translated.txt', translated_text)
+
+        # a repeated subtitle is finished only when the translation of its first occurrence arrived
+        indices = [index for index in range(start, end)
+                   if index in self.cues and (index not in self.copy_of or self.cues.translated(index))]
+        self.completed.update(indices)
+        if self.journal:
+            # subtitles filled from the translation memory are journaled too, a resumed run does not look them up again
+            translations = {index: self.cues.translated(index) for index in indices + saved if self.cues.translated(index)}
+            self.journal.record(indices, translations)
+        return True
+
+    def write_review(self):
+        # list the slices aligned with a low confidence next to the output file for manual checking
+        if not self.review:
+            return
+
+        file_name = self.output_file + ".review.txt"
+        with open(file_name, mode='w', encoding="utf8") as file:
+            for confidence, original_lines, aligned_lines in self.review:
+                file.write(f"Confidence: {confidence:.2f}\n")
+                for original, aligned in zip([line for line in original_lines if line.strip()], aligned_lines):
+                    file.write(f"{original}\n    {aligned}\n")
+                file.write("-"*40 + "\n")
+
+        self.log(f"{len(self.review)} slice(s) need manual review: {file_name}")
+
+    def dump_debug(self, file_name, text):
+        # the trace writer formats and writes the text in the background
+        if self.trace_writer is not None:
+            self.trace_writer.write(file_name, text)
+
+    def write_srt(self, writer, end):
+        # append the subtitles before end which were not written yet
+        for index in range(writer.count + 1, min(end, len(self.cues) + 1)):
+            writer.write(index, self.cues.timestamp(index), self.cues.translated(index))
+        writer.flush()
 
-    def chat_gpt_translate(self, text) -> str:
-        original_line_count = text.strip().count('\n')+1
-        self.log(f"Sent {original_line_count} lines")
+    def save_srt(self):
+        with SrtWriter(self.output_file) as writer:
+            self.write_srt(writer, len(self.cues) + 1)
 
+    def system_prompt(self, languages=None) -> str:
+        # the same for every request of the run, so the provider can cache it as a prefix
+        # with several languages every language gets its own section in the answer
         prompt='''You are a program responsible for translating subtitles.
 Your task is to output the specified target language based on the input text.
 Please do not create the following subtitles on your own.
@@ -381,57 +721,180 @@ Please always keep the timestamp at the beginning of the lines intact and
 always put the translated text into the line matching the original timestamp.
 If you need to merge the subtitles with the following line, simply repeat the translation.
 Be concise.\n'''
+        if self.context_lines:
+            prompt += "Lines starting with > end the previous part of the subtitle, they are only context, do not translate them.\n"
         prompt += f"Original language: {self.input_language}\n"
-        prompt += f"Target language: {self.output_language}\n"
-        prompt += f"{text}"
+        if languages and len(languages) > 1:
+            prompt += "Translate every line into each target language. Start the translation of each language with a line\n"
+            prompt += "containing ### and the name of the language, then repeat all the lines in that language.\n"
+            prompt += f"Target languages: {', '.join(languages)}"
+        else:
+            prompt += f"Target language: {self.output_language}"
+        return prompt
+
+    def user_prompt(self, text, context="") -> str:
+        # the variable part of the request, the context lines come before the lines to translate
+        return context + text
+
+    def request_tokens(self, request) -> int:
+        return sum(count_tokens(message["content"], self.model_engine) for message in request["messages"])
+
+    def estimate_max_tokens(self, text, languages=1) -> int:
+        # room for the translation, the timestamps are repeated in the answer
+        estimate = int(count_tokens(text, self.model_engine) * self.output_token_ratio * languages) + 100
+        return min(self.max_tokens, estimate)
+
+    def build_request(self, text, context="", languages=None) -> dict:
+        # parameters of a chat completion request translating the text, into several languages when given
+        return {
+            "messages": [
+                {"role": "system", "content": self.system_prompt(languages)},
+                {"role": "user", "content": self.user_prompt(text, context)}
+            ],
+            "model": self.model_engine,
+            "max_tokens": self.estimate_max_tokens(text, len(languages) if languages else 1),
+            "temperature": 0.5,
+            "top_p": 1,
+            "frequency_penalty": 0,
+            "presence_penalty": 0,
+        }
+
+    def new_record(self, text, attempt=0, purpose="slice", languages=1) -> dict:
+        # metrics record of a request, filled while the request is sent and processed
+        return {
+            "file": self.input_file,
+            "purpose": purpose,
+            "lines": text.strip().count('\n')+1,
+            "languages": languages,
+            "attempt": attempt,
+            "queue_wait": 0.0,
+            "latency": None,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "aligned_lines": 0,
+            "alignment_confidence": None,
+            "cost": 0.0,
+            "prefix_id": None,
+            "prefix_tokens": 0,
+            "cached_tokens": 0,
+            "status": "ok",
+        }
+
+    def complete(self, request, record) -> str:
+        '''
+        Sends a request through the rate limiter, returns the answer or None, failed requests are recorded in the metrics.
 
-        logger.debug("Sent %d lines for translation", original_line_count)
+        Errors which a retry can not fix, like an invalid request or key, are raised as BackendError.
+        '''
+        system, prompt = request["messages"][0]["content"], request["messages"][-1]["content"]
+        prefix_tokens = count_tokens(system, self.model_engine)
+        record["prefix_id"] = f"{zlib.crc32(system.encode('utf8')):08x}"
+        record["prefix_tokens"] = prefix_tokens
+
+        logger.debug("Sent %d lines for translation", record["lines"])
         logger.debug("Prompt:\n\n%s\n", prompt)
 
+        # Reserve the prompt and the longest possible answer, the unused part is given back
+        reserved_tokens = prefix_tokens + count_tokens(prompt, self.model_engine) + request["max_tokens"]
+        record["queue_wait"] = round(self.rate_limiter.acquire(reserved_tokens), 3)
+
         # Generate a response
+        sent = time.monotonic()
         try:
-            completion = openai.ChatCompletion.create(
-                messages=[
-                    {"role": "user", "content": prompt}
-                ],
-                model=self.model_engine,
-                max_tokens=self.max_tokens,
-                temperature=0.5,
-                top_p=1,
-                frequency_penalty=0,
-                presence_penalty=0,
-                timeout=60
-            )
-        except Exception as e:
+            completion = self.backend.complete(request)
+        except BackendError as e:
             logger.error("Unsuccesful OpenAI operation, see debug log")
             logger.debug("Unsuccesful OpenAI operation. Error: %s", e)
+            # only the errors of an overloaded account or server hold back the other requests
+            if e.retryable:
+                self.rate_limiter.penalize(e.retry_after)
+            record["latency"] = round(time.monotonic() - sent, 3)
+            record["status"] = f"http_{e.status}" if e.status else "error"
+            self.metrics.record(record)
+            if not e.retryable:
+                raise
+            return None
+        record["latency"] = round(time.monotonic() - sent, 3)
+
+        self.rate_limiter.success()
+        if completion.usage:
+            self.rate_limiter.adjust(reserved_tokens, completion.usage["total_tokens"])
+            self.record_usage(completion.usage)
+            record["prompt_tokens"] = completion.usage["prompt_tokens"]
+            record["completion_tokens"] = completion.usage["completion_tokens"]
+            record["cost"] = round(estimate_cost(self.model_engine, record["prompt_tokens"], record["completion_tokens"]), 6)
+            # prompt tokens served from the prefix cache of the provider
+            record["cached_tokens"] = (completion.usage.get("prompt_tokens_details") or {}).get("cached_tokens", 0)
+
+        return completion.content
+
+    def chat_gpt_translate(self, text, accept_misaligned=True, attempt=0, purpose="slice", context="") -> str:
+        record = self.new_record(text, attempt, purpose)
+        self.log(f"Sent {record['lines']} lines")
+
+        response = self.complete(self.build_request(text, context), record)
+        if response is None:
             return None
 
-        response = completion.choices[0]["message"]["content"].strip()
+        translated_text = self.process_response(text, response, accept_misaligned, record)
+        if translated_text is None:
+            record["status"] = "misaligned"
+        self.metrics.record(record)
+        return translated_text
+
+    def record_usage(self, usage):
+        with self.usage_lock:
+            self.requests += 1
+            self.prompt_tokens += usage["prompt_tokens"]
+            self.completion_tokens += usage["completion_tokens"]
+
+    def process_response(self, text, response, accept_misaligned=True, record=None) -> str:
+        # compare the translation with the original text, realign the lines if some are missing
+        # returns None if the lines can not be aligned reliably and misaligned translations are not accepted
+        # the number of realigned lines and the confidence are saved into the metrics record when given
+        original_line_count = text.strip().count('\n')+1
+        response = response.strip()
         response_line_count = response.count('\n')+1
-        logger.debug("Returned %d lines", response.count('\n')+1)
+        logger.debug("Returned %d lines", response_line_count)
         logger.debug("Translation:\n\n%s\n\n", response)
 
+        original_lines = text.split('\n')
+        response_lines = response.split('\n')
+
         if response_line_count < original_line_count:
             logger.warning("Missing %d line(s)", original_line_count - response_line_count)
-            original_lines = text.split('\n')
-            response_lines = response.split('\n')
 
             aligner = Aligner(original_lines, response_lines)
-            response_lines = aligner.align()
+            aligned_lines, confidence = aligner.auto_align()
+            logger.info("Lines aligned automatically, confidence: %.2f", confidence)
+            if record is not None:
+                record["aligned_lines"] = original_line_count - response_line_count
+                record["alignment_confidence"] = round(confidence, 3)
+
+            if confidence < self.alignment_threshold:
+                if self.interactive_alignment:
+                    aligned_lines = aligner.align()
+                elif not accept_misaligned:
+                    logger.warning("Alignment confidence %.2f is below %.2f", confidence, self.alignment_threshold)
+                    return None
+                else:
+                    logger.warning("Alignment confidence %.2f is below %.2f, queued for review",
+                                   confidence, self.alignment_threshold)
+                    self.review.append((confidence, original_lines, aligned_lines))
+                    self.review_starts.update(self.response_timestamps(text))
+
+            response_lines = aligned_lines
             response = "\n".join(response_lines)
         elif response_line_count > original_line_count:
             logger.info("Extra %d line(s)", response_line_count - original_line_count)
 
-        for index, _ in enumerate(original_lines):
-            logger.debug("[%d]", index)
-            logger.debug("%s", original_lines[index])
-            if len(response_lines) > index:
-                logger.debug("%s", response_lines[index])
-
-        time.sleep(self.relax_time)
+        if logger.isEnabledFor(logging.DEBUG):
+            # one record for the whole slice, the lines are joined by the log writer thread
+            logger.debug("%s", LineComparison(original_lines, response_lines))
 
         return response
 
     def log(self, message):
+        from tqdm import tqdm
+
         tqdm.write(message)
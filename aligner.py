@@ -1,20 +1,32 @@
-from prettytable import PrettyTable
+import re
+
+# [00:00:01,000 --> 00:00:02,000] text of the subtitle
+line_regex = re.compile(r"^\s*\[\s*([^\]]*?)\s*-->[^\]]*\]\s?(.*)$")
+
+# penalties of the automatic alignment
+EXTRA_LINE_PENALTY = 0.3
+WRONG_TIMESTAMP_PENALTY = 1.0
 
 class Aligner():
 
     def __init__(self, original, toalign) -> None:
         self.original = original
         self.toalign = toalign
-        self.table = PrettyTable()
-
-        self.table.field_names = ["Orginal", "Index", "Translated"]
-        self.table.align["Orginal"] = "l"
-        self.table.align["Translated"] = "l"
-        self.table.max_width["Orginal"] = 60
-        self.table.max_width["Translated"] = 60
+        # created by print_table, only the interactive alignment shows the table
+        self.table = None
 
 
     def print_table(self):
+        if self.table is None:
+            from prettytable import PrettyTable
+
+            self.table = PrettyTable()
+            self.table.field_names = ["Orginal", "Index", "Translated"]
+            self.table.align["Orginal"] = "l"
+            self.table.align["Translated"] = "l"
+            self.table.max_width["Orginal"] = 60
+            self.table.max_width["Translated"] = 60
+
         self.table.clear_rows()
         for index, value in enumerate(self.original):
             original_text = value
@@ -47,3 +59,129 @@ class Aligner():
                 break
 
         return self.toalign
+
+    @staticmethod
+    def split_line(line):
+        # returns the start timestamp and the text of a line, the timestamp is None if missing
+        match = line_regex.match(line)
+        if match:
+            return match.group(1), match.group(2).strip()
+        return None, line.strip()
+
+    @staticmethod
+    def ending(text):
+        text = text.rstrip("\"\' ")
+        return text[-1] if text and text[-1] in ".?!,:;" else ""
+
+    def similarity(self, original, translated, ratio):
+        # compares the length and the punctuation of a line and its translation, between 0 and 1
+        expected = len(original) * ratio
+        length = 1 - min(1, abs(len(translated) - expected) / max(expected, len(translated), 1))
+
+        punctuation = (
+            (self.ending(original) == self.ending(translated)) +
+            (("?" in original) == ("?" in translated)) +
+            (original.startswith("-") == translated.startswith("-"))
+        ) / 3
+
+        return 0.6 * length + 0.4 * punctuation
+
+    def auto_align(self):
+        '''
+        Maps the translated lines to the original lines without user input.
+
+        Timestamps repeated in the translation anchor the lines, the rest is aligned with dynamic
+        programming over the length ratio and the punctuation of the lines. Returns the aligned lines,
+        one for every original line with an empty string where the translation is missing, and a
+        confidence score between 0 and 1.
+
+        Only the uncertain placements are scored: a line anchored by its timestamp is certain, and so
+        is a missing line between anchored lines, or next to one at the start or the end of the slice.
+        Without uncertain placements the confidence is 1.
+        '''
+        original_lines = [line for line in self.original if line.strip()]
+        original = [self.split_line(line) for line in original_lines]
+        response = [self.split_line(line) for line in self.toalign if line.strip()]
+        original_timestamps = {timestamp for timestamp, _ in original if timestamp}
+
+        n, m = len(original), len(response)
+        if n == 0:
+            return [], 1.0
+
+        ratio = (sum(len(text) for _, text in response) + 1) / (sum(len(text) for _, text in original) + 1)
+
+        def pair_score(i, j):
+            # score of the pair used by the alignment and its confidence
+            original_timestamp, original_text = original[i]
+            response_timestamp, response_text = response[j]
+            if response_timestamp and response_timestamp == original_timestamp:
+                return 2.0, 1.0
+            confidence = self.similarity(original_text, response_text, ratio)
+            if response_timestamp in original_timestamps:
+                return confidence - WRONG_TIMESTAMP_PENALTY, 0.0
+            return confidence, confidence
+
+        # score[i][j]: best alignment of the first i original and the first j translated lines
+        unset = float("-inf")
+        score = [[unset] * (m + 1) for _ in range(n + 1)]
+        step = [[None] * (m + 1) for _ in range(n + 1)]
+        score[0][0] = 0.0
+
+        for i in range(n + 1):
+            for j in range(m + 1):
+                current = score[i][j]
+                if current == unset:
+                    continue
+
+                candidates = []
+                if i < n and j < m:
+                    candidates.append((i + 1, j + 1, current + pair_score(i, j)[0], "match"))
+                if i < n:
+                    # translation of the original line is missing
+                    candidates.append((i + 1, j, current, "missing"))
+                if j < m:
+                    # extra translated line
+                    candidates.append((i, j + 1, current - EXTRA_LINE_PENALTY, "extra"))
+
+                for next_i, next_j, value, move in candidates:
+                    if value > score[next_i][next_j]:
+                        score[next_i][next_j] = value
+                        step[next_i][next_j] = move
+
+        aligned = [""] * n
+        # confidence of every original line, None for the anchored ones and the missing ones
+        confidences = [None] * n
+        anchored = [False] * n
+        i, j = n, m
+        while i > 0 or j > 0:
+            move = step[i][j]
+            if move == "match":
+                i, j = i - 1, j - 1
+                timestamp = original_lines[i][:original_lines[i].index("]") + 1] if original[i][0] else ""
+                aligned[i] = f"{timestamp} {response[j][1]}".strip()
+                if response[j][0] and response[j][0] == original[i][0]:
+                    anchored[i] = True
+                else:
+                    confidences[i] = pair_score(i, j)[1]
+            elif move == "missing":
+                i -= 1
+            else:
+                j -= 1
+
+        uncertain = []
+        for i in range(n):
+            if anchored[i]:
+                continue
+            if confidences[i] is not None:
+                uncertain.append(confidences[i])
+                continue
+            # a missing line is certain if the placed lines around it are anchored
+            before = next((k for k in range(i - 1, -1, -1) if aligned[k]), None)
+            after = next((k for k in range(i + 1, n) if aligned[k]), None)
+            placed = [k for k in (before, after) if k is not None]
+            if not placed or not all(anchored[k] for k in placed):
+                uncertain.append(0.0)
+
+        if not uncertain:
+            return aligned, 1.0
+        return aligned, sum(uncertain) / len(uncertain)
@@ -0,0 +1,207 @@
+import http.client
+import json
+import logging
+import queue
+import random
+import threading
+import time
+import urllib.parse
+from typing import NamedTuple
+
+logger = logging.getLogger()
+
+API_BASE = "https://api.openai.com/v1"
+
+
+class BackendError(Exception):
+    '''A failed completion request, retry_after is the waiting time suggested by the server in seconds.'''
+
+    def __init__(self, message:str, status:int=None, retry_after:float=None) -> None:
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+    @property
+    def retryable(self) -> bool:
+        # rate limits, timeouts, server and connection errors pass, other client errors would fail again
+        return self.status is None or self.status in (408, 409, 429) or self.status >= 500
+
+
+class Completion(NamedTuple):
+    content: str
+    usage: dict
+
+
+class TranslationBackend():
+    '''
+    Interface of the completion providers.
+
+    A request is the dictionary built by GptSrtTranslator.build_request. complete is called from the
+    worker threads of the translator, every failure is raised as a BackendError. translate_batch runs
+    several requests concurrently with asyncio.
+    '''
+
+    def complete(self, request:dict) -> Completion:
+        raise NotImplementedError
+
+    async def complete_async(self, request:dict) -> Completion:
+        import asyncio
+
+        return await asyncio.to_thread(self.complete, request)
+
+    async def translate_batch(self, requests:list) -> list:
+        '''Returns a Completion or a BackendError for every request, in the order of the requests.'''
+        import asyncio
+
+        results = await asyncio.gather(*(self.complete_async(request) for request in requests), return_exceptions=True)
+        # unexpected failures are reported like the failed requests, one request does not cancel the others
+        return [BackendError(str(result)) if isinstance(result, Exception) and not isinstance(result, BackendError) else result
+                for result in results]
+
+    def close(self) -> None:
+        pass
+
+
+class ConnectionPool():
+    '''Keep-alive HTTP connections to a single host, shared by the threads of the process.'''
+
+    def __init__(self, base_url:str, size:int=16, timeout:float=60) -> None:
+        url = urllib.parse.urlsplit(base_url)
+        self.connection_class = http.client.HTTPSConnection if url.scheme == "https" else http.client.HTTPConnection
+        self.host = url.hostname
+        self.port = url.port
+        self.path = url.path.rstrip("/")
+        self.size = size
+        self.timeout = timeout
+        self.idle = queue.LifoQueue()
+
+    def connect(self) -> http.client.HTTPConnection:
+        return self.connection_class(self.host, self.port, timeout=self.timeout)
+
+    def release(self, connection:http.client.HTTPConnection) -> None:
+        if self.idle.qsize() < self.size:
+            self.idle.put(connection)
+        else:
+            connection.close()
+
+    def request(self, method:str, path:str, body:bytes=None, headers:dict=None) -> tuple:
+        '''Sends a request, returns the status, the headers and the body of the response.'''
+        try:
+            connection, reused = self.idle.get_nowait(), True
+        except queue.Empty:
+            connection, reused = self.connect(), False
+
+        while True:
+            try:
+                connection.request(method, self.path + path, body=body, headers=headers or {})
+                response = connection.getresponse()
+                data = response.read()
+                break
+            except (http.client.HTTPException, OSError):
+                connection.close()
+                if not reused:
+                    raise
+                # the server closed the idle connection, try once more on a new one
+                connection, reused = self.connect(), False
+
+        if response.will_close:
+            connection.close()
+        else:
+            self.release(connection)
+
+        return response.status, response.headers, data
+
+    def close(self) -> None:
+        while not self.idle.empty():
+            self.idle.get_nowait().close()
+
+
+class OpenAIBackend(TranslationBackend):
+    '''Chat completions of the OpenAI API or a compatible server, over pooled keep-alive connections.'''
+
+    _shared = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, api_key:str, api_base:str=None, pool_size:int=16, timeout:float=60) -> None:
+        self.api_key = api_key
+        self.pool = ConnectionPool(api_base or API_BASE, size=pool_size, timeout=timeout)
+
+    @classmethod
+    def shared(cls, api_key:str, api_base:str=None) -> "OpenAIBackend":
+        '''Returns the backend of the account, it is created on first use and shared in the process.'''
+        key = (api_key, api_base or API_BASE)
+        with cls._shared_lock:
+            if key not in cls._shared:
+                cls._shared[key] = cls(api_key, api_base)
+            return cls._shared[key]
+
+    def complete(self, request:dict) -> Completion:
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json",
+        }
+
+        try:
+            status, response_headers, data = self.pool.request("POST", "/chat/completions",
+                                                               json.dumps(request).encode("utf8"), headers)
+        except (http.client.HTTPException, OSError) as e:
+            raise BackendError(f"Connection error: {e}") from e
+
+        if status != 200:
+            retry_after = response_headers.get("retry-after")
+            try:
+                retry_after = float(retry_after)
+            except (TypeError, ValueError):
+                retry_after = None
+            raise BackendError(f"HTTP {status}: {data[:500].decode('utf8', 'replace')}", status, retry_after)
+
+        # proxies may answer 200 with an error page, such answers are retried like server errors
+        try:
+            result = json.loads(data)
+            content = result["choices"][0]["message"]["content"]
+        except (ValueError, KeyError, IndexError, TypeError) as e:
+            raise BackendError(f"Invalid response: {data[:500].decode('utf8', 'replace')}") from e
+        if not isinstance(content, str):
+            raise BackendError(f"Empty response, finish reason: {result['choices'][0].get('finish_reason')}")
+
+        return Completion(content, result.get("usage"))
+
+    def close(self) -> None:
+        self.pool.close()
+
+
+class StubBackend(TranslationBackend):
+    '''
+    Deterministic local backend for offline load tests.
+
+    Every subtitle is echoed back with the target language in front of it after the given latency.
+    A seeded share of the requests fails with a rate limit error.
+    '''
+
+    def __init__(self, latency:float=0.0, error_rate:float=0.0, retry_after:float=None, seed:int=0) -> None:
+        self.latency = latency
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+
+        self.lock = threading.Lock()
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.errors = 0
+
+    def complete(self, request:dict) -> Completion:
+        with self.lock:
+            self.requests += 1
+            failed = self.random.random() < self.error_rate
+            if failed:
+                self.errors += 1
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        if failed:
+            raise BackendError("HTTP 429: stub rate limit", 429, self.retry_after)
+
+        from fakeopenai import fake_completion
+
+        result = fake_completion(request)
+        return Completion(result["choices"][0]["message"]["content"], result["usage"])
@@ -0,0 +1,180 @@
+import json
+import logging
+import time
+import urllib.request
+import uuid
+
+logger = logging.getLogger()
+
+API_BASE = "https://api.openai.com/v1"
+
+
+class BatchTranslator():
+    '''
+    Translates srt files with the OpenAI Batch API.
+
+    Every slice of every file is written into one JSONL request file, which is uploaded and submitted
+    as a single batch. When the batch is completed the responses are mapped back to their slices by
+    their custom ids and the translated srt files are saved.
+    '''
+
+    COMPLETION_WINDOW = "24h"
+    ENDPOINT = "/v1/chat/completions"
+
+    def __init__(self, translators:list, **kwargs) -> None:
+        '''
+        Args:
+            translators: GptSrtTranslator objects with their srt files loaded.
+            **kwargs: Optional arguments:
+                - api_key: OpenAI API key. Defaults to the API key of the first translator.
+                - api_base: Base url of the OpenAI compatible API. Defaults to the one of the first translator or https://api.openai.com/v1.
+                - poll_interval: Seconds between two status checks of the batch. Defaults to 60.
+                - requests_file: The JSONL request file to write. Defaults to "batch_requests.jsonl".
+        '''
+        self.translators = translators
+        self.api_key = kwargs.get("api_key", translators[0].api_key if translators else None)
+        self.api_base = (kwargs.get("api_base") or (translators and translators[0].api_base) or API_BASE).rstrip("/")
+        self.poll_interval = kwargs.get("poll_interval", 60)
+        self.requests_file = kwargs.get("requests_file", "batch_requests.jsonl")
+
+        # custom id -> (translator, slice)
+        self.slices = {}
+
+    def build_requests(self) -> list:
+        requests = []
+        self.slices = {}
+
+        for file_number, translator in enumerate(self.translators):
+            for slice_number, current_slice in enumerate(translator.get_slices()):
+                custom_id = f"{file_number}-{slice_number}"
+                self.slices[custom_id] = (translator, current_slice)
+                requests.append({
+                    "custom_id": custom_id,
+                    "method": "POST",
+                    "url": self.ENDPOINT,
+                    "body": translator.build_request(current_slice.text, current_slice.context)
+                })
+
+        return requests
+
+    def write_requests(self, requests:list) -> None:
+        with open(self.requests_file, 'w', encoding="utf8") as file:
+            for request in requests:
+                file.write(json.dumps(request, ensure_ascii=False) + "\n")
+
+    def call(self, method:str, path:str, data:bytes=None, content_type:str="application/json") -> bytes:
+        request = urllib.request.Request(self.api_base + path, data=data, method=method)
+        request.add_header("Authorization", f"Bearer {self.api_key}")
+        if data is not None:
+            request.add_header("Content-Type", content_type)
+
+        with urllib.request.urlopen(request, timeout=300) as response:
+            return response.read()
+
+    def call_json(self, method:str, path:str, body:dict=None) -> dict:
+        data = json.dumps(body).encode("utf8") if body is not None else None
+        return json.loads(self.call(method, path, data))
+
+    def upload(self) -> str:
+        # multipart upload of the request file, returns the file id
+        boundary = uuid.uuid4().hex
+        with open(self.requests_file, 'rb') as file:
+            content = file.read()
+
+        data = (
+            f'--{boundary}\r\nContent-Disposition: form-data; name="purpose"\r\n\r\nbatch\r\n'
+            f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{self.requests_file}"\r\n'
+            f'Content-Type: application/jsonl\r\n\r\n'
+        ).encode("utf8") + content + f"\r\n--{boundary}--\r\n".encode("utf8")
+
+        result = json.loads(self.call("POST", "/files", data, f"multipart/form-data; boundary={boundary}"))
+        return result["id"]
+
+    def submit(self, file_id:str) -> str:
+        batch = self.call_json("POST", "/batches", {
+            "input_file_id": file_id,
+            "endpoint": self.ENDPOINT,
+            "completion_window": self.COMPLETION_WINDOW
+        })
+        return batch["id"]
+
+    def wait(self, batch_id:str) -> dict:
+        while True:
+            batch = self.call_json("GET", f"/batches/{batch_id}")
+            counts = batch.get("request_counts") or {}
+            logger.info("Batch %s: %s, %s/%s requests completed",
+                        batch_id, batch["status"], counts.get("completed", 0), counts.get("total", 0))
+
+            if batch["status"] in ("completed", "failed", "expired", "cancelled"):
+                return batch
+
+            time.sleep(self.poll_interval)
+
+    def apply_results(self, content:str) -> int:
+        '''Saves the translations of the batch output into the translators, returns the number of failed slices.'''
+        failed = 0
+        done = set()
+
+        for line in content.splitlines():
+            if not line.strip():
+                continue
+
+            result = json.loads(line)
+            custom_id = result["custom_id"]
+            if custom_id not in self.slices:
+                logger.warning("Unknown custom id in batch output: %s", custom_id)
+                continue
+
+            translator, current_slice = self.slices[custom_id]
+            response = result.get("response") or {}
+            if result.get("error") or response.get("status_code") != 200:
+                logger.error("Batch request %s failed: %s", custom_id, result.get("error") or response.get("body"))
+                failed += 1
+                continue
+
+            text = response["body"]["choices"][0]["message"]["content"]
+            if response["body"].get("usage"):
+                translator.record_usage(response["body"]["usage"])
+            translator.merge_slice(current_slice, translator.process_response(current_slice.text, text))
+            done.add(custom_id)
+
+        missing = len(self.slices) - len(done) - failed
+        if missing:
+            logger.error("%d slice(s) are missing from the batch output", missing)
+
+        return failed + missing
+
+    def run(self) -> dict:
+        requests = self.build_requests()
+        if not requests:
+            # every subtitle is skipped or found in the translation memory, the files are complete already
+            logger.info("Nothing to translate")
+            for translator in self.translators:
+                translator.save_srt()
+            return None
+
+        self.write_requests(requests)
+        self.log(f"Submitting {len(requests)} requests from {len(self.translators)} file(s)")
+
+        batch_id = self.submit(self.upload())
+        self.log(f"Batch submitted: {batch_id}")
+
+        batch = self.wait(batch_id)
+        if batch.get("output_file_id"):
+            failed = self.apply_results(self.call("GET", f"/files/{batch['output_file_id']}/content").decode("utf8"))
+        else:
+            failed = len(requests)
+
+        if batch.get("error_file_id"):
+            for line in self.call("GET", f"/files/{batch['error_file_id']}/content").decode("utf8").splitlines():
+                logger.debug("Batch error: %s", line)
+
+        for translator in self.translators:
+            translator.save_srt()
+            translator.write_review()
+
+        self.log(f"Batch {batch['status']}, {len(requests) - failed} of {len(requests)} requests translated")
+        return batch
+
+    def log(self, message):
+        print(message)
@@ -0,0 +1,373 @@
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import random
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from backends import StubBackend
+from GptSrtTranslator import GptSrtTranslator
+from ratelimiter import RateLimiter
+from srtparser import format_time_range, parse_srt
+from tags import strip_tags
+
+WORDS = "the house was dark and we walked home slowly under a cold sky".split()
+# accented, cyrillic, greek, arabic and cjk words, several utf8 bytes per character
+MULTILINGUAL_WORDS = WORDS + "árvíztűrő tükörfúrógép Straße naïve привет мир γειά σου مرحبا 字幕 日本語 안녕".split()
+# formatting tags found in real subtitles
+HTML_TAGS = [("<i>", "</i>"), ("<b>", "</b>"), ("<u>", "</u>"), ('<font color="#ffff00">', "</font>")]
+
+KINDS = ["plain", "multilingual", "html"]
+STAGES = ["load", "slice", "strip_tags", "prompt", "backend", "save_translation", "save_srt", "end_to_end"]
+
+# stages faster than this are too noisy to be compared with a baseline
+MIN_COMPARED_SECONDS = 0.05
+
+# the command line tool started for every file of a scripted loop should answer within this
+MAX_STARTUP_SECONDS = 1.0
+
+
+def generate_srt(file_name:str, cues:int, seed:int=0, kind:str="plain") -> None:
+    '''
+    Writes a synthetic srt file with the given number of subtitles.
+
+    kind is "plain" for english text, "multilingual" for a mix of scripts, "html" for text with formatting tags.
+    '''
+    rnd = random.Random(seed)
+    words = MULTILINGUAL_WORDS if kind == "multilingual" else WORDS
+
+    with open(file_name, 'w', encoding="utf8") as file:
+        for index in range(1, cues + 1):
+            start = index * 3000
+            text = " ".join(rnd.choice(words) for _ in range(rnd.randint(3, 12))).capitalize()
+            text += rnd.choice([".", "?", "!", ",", ""])
+            if rnd.random() < 0.3:
+                # two line subtitle
+                text = text.replace(" ", "\n", 1)
+            if kind == "html" and rnd.random() < 0.5:
+                opening, closing = rnd.choice(HTML_TAGS)
+                text = f"{opening}{text}{closing}"
+            file.write(f"{index}\n{format_time_range(start, start + 2500)}\n{text}\n\n")
+
+
+def legacy_split(file_name:str) -> int:
+    # the regex split loader which was replaced by parse_srt
+    with open(file_name, 'r', encoding="utf8") as f:
+        parts = re.split(r'(\d+)\n(\d\d:\d\d:\d\d,\d\d\d --> \d\d:\d\d:\d\d,\d\d\d)', f.read())
+        parts = [part for part in parts if part.strip()]
+
+        srt = {}
+        for i in range(0, len(parts), 3):
+            srt[i // 3 + 1] = {"timestamp": parts[i+1].strip(), "original": parts[i+2].strip()}
+        return len(srt)
+
+
+def streaming_parse(file_name:str) -> int:
+    with open(file_name, 'r', encoding="utf8") as f:
+        return sum(1 for _ in parse_srt(f))
+
+
+def measure(function, *args, trace_memory:bool=True) -> tuple:
+    '''Returns the result, the wall time and the peak memory of a call, memory is traced in a second run.'''
+    start = time.perf_counter()
+    result = function(*args)
+    elapsed = time.perf_counter() - start
+
+    if not trace_memory:
+        return result, elapsed, None
+
+    tracemalloc.start()
+    function(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return result, elapsed, peak
+
+
+def bench_parser(cues:int) -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        file_name = os.path.join(directory, "synthetic.srt")
+        generate_srt(file_name, cues)
+        print(f"Synthetic file: {cues} subtitles, {os.path.getsize(file_name) / 1024 / 1024:.1f} MiB")
+
+        for name, function in [("regex split", legacy_split), ("streaming parser", streaming_parse)]:
+            count, elapsed, peak = measure(function, file_name)
+            print(f"{name:>20}: {elapsed:7.3f} sec, {count / elapsed:10.0f} cues/sec, peak memory {peak / 1024 / 1024:7.1f} MiB")
+
+
+def raw_texts(file_name:str) -> list:
+    with open(file_name, 'r', encoding="utf8") as f:
+        return [cue.text for cue in parse_srt(f)]
+
+
+def bs4_slices(texts:list, slice_length:int=30) -> int:
+    # the per slice BeautifulSoup parse which was replaced by strip_tags at load time
+    from bs4 import BeautifulSoup
+
+    count = 0
+    for start in range(0, len(texts), slice_length):
+        total = "".join(text.replace('\n', ' ') + "\n" for text in texts[start:start + slice_length])
+        count += BeautifulSoup(total, "html.parser").get_text().count("\n")
+    return count
+
+
+def sanitizer(texts:list) -> int:
+    return sum(1 for text in texts if strip_tags(text))
+
+
+def bench_tags(cues:int) -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        file_name = os.path.join(directory, "synthetic.html.srt")
+        generate_srt(file_name, cues, kind="html")
+        texts = raw_texts(file_name)
+        print(f"Synthetic html file: {cues} subtitles, {os.path.getsize(file_name) / 1024 / 1024:.1f} MiB")
+
+        functions = [("strip_tags", sanitizer)]
+        try:
+            import bs4  # noqa: F401
+            functions.insert(0, ("BeautifulSoup", bs4_slices))
+        except ImportError:
+            print("BeautifulSoup is not installed, only strip_tags is measured")
+
+        for name, function in functions:
+            _, elapsed, peak = measure(function, texts)
+            print(f"{name:>20}: {elapsed:7.3f} sec, {cues / elapsed:10.0f} cues/sec, peak memory {peak / 1024 / 1024:7.1f} MiB")
+
+
+def new_translator(input_file:str, output_file:str, **kwargs) -> GptSrtTranslator:
+    # the stub answers instantly and the limiter never waits, only the local work is measured
+    kwargs.setdefault("backend", StubBackend())
+    return GptSrtTranslator(input_file=input_file,
+                            output_file=output_file,
+                            rate_limiter=RateLimiter(requests_per_minute=10**9, tokens_per_minute=10**12),
+                            resume=False,
+                            **kwargs)
+
+
+def end_to_end(input_file:str, output_file:str, concurrency:int) -> int:
+    translator = new_translator(input_file, output_file, concurrency=concurrency)
+    translator.translate()
+    return len(translator.cues)
+
+
+def bench_pipeline(cues:int, kind:str, concurrency:int=4, trace_memory:bool=True) -> dict:
+    '''
+    Runs every stage of the translation of a synthetic file against the stub backend.
+
+    Returns the wall time, the peak memory and the throughput of every stage. Tracing the memory
+    runs every stage a second time, several times slower than the timed run.
+    '''
+    with tempfile.TemporaryDirectory() as directory:
+        input_file = os.path.join(directory, f"synthetic.{kind}.srt")
+        output_file = os.path.join(directory, "output.srt")
+        generate_srt(input_file, cues, kind=kind)
+
+        translator = new_translator("", output_file)
+        translator.input_file = input_file
+        backend = translator.backend
+
+        def load():
+            translator.load_srt()
+
+        def slice_text():
+            return translator.get_slices()
+
+        texts = raw_texts(input_file)
+
+        def strip():
+            return sanitizer(texts)
+
+        def prompt():
+            return [translator.build_request(current_slice.text) for current_slice in slices]
+
+        def complete():
+            return [backend.complete(request).content for request in requests]
+
+        def save_translation():
+            for response in responses:
+                translator.save_translated_text(response)
+
+        stages = {}
+
+        def run(name, function, *args):
+            result, elapsed, peak = measure(function, *args, trace_memory=trace_memory)
+            stages[name] = {
+                "seconds": round(elapsed, 6),
+                "peak_mib": round(peak / 1024 / 1024, 3) if peak is not None else None,
+                "cues_per_sec": round(cues / max(elapsed, 1e-9), 1),
+            }
+            return result
+
+        # the translator writes its progress to the console, it would distort the timings
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            run("load", load)
+            slices = run("slice", slice_text)
+            run("strip_tags", strip)
+            requests = run("prompt", prompt)
+            responses = run("backend", complete)
+            run("save_translation", save_translation)
+            run("save_srt", translator.save_srt)
+            run("end_to_end", end_to_end, input_file, output_file, concurrency)
+
+        return {
+            "cues": cues,
+            "kind": kind,
+            "slices": len(slices),
+            "file_mib": round(os.path.getsize(input_file) / 1024 / 1024, 3),
+            "stages": stages,
+        }
+
+
+def import_times(command:list, env:dict, count:int=10) -> list:
+    # the modules with the longest cumulative import time, from python -X importtime
+    process = subprocess.run([command[0], "-X", "importtime"] + command[1:], env=env, capture_output=True, text=True)
+    modules = []
+    for line in process.stderr.splitlines():
+        parts = line.split("|")
+        # only the modules imported directly by the tool, nested imports are indented
+        if len(parts) == 3 and parts[1].strip().isdigit() and not parts[2].startswith("  "):
+            modules.append((int(parts[1]) / 1e6, parts[2].strip()))
+    return sorted(modules, reverse=True)[:count]
+
+
+def bench_startup(cues:int, runs:int=5, show_imports:bool=False) -> dict:
+    '''
+    Measures the wall time of fresh processes, as a scripted loop starts the tool for every file.
+
+    Importing the translator, printing the help and the dry run of a synthetic file are measured,
+    the median of the runs is returned for each.
+    '''
+    here = os.path.dirname(os.path.abspath(__file__))
+    cli = os.path.join(here, "gpttranslator.py")
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [here, os.environ.get("PYTHONPATH")])))
+
+    with tempfile.TemporaryDirectory() as directory:
+        input_file = os.path.join(directory, "synthetic.srt")
+        generate_srt(input_file, cues)
+
+        commands = {
+            "python": [sys.executable, "-c", "pass"],
+            "import": [sys.executable, "-c", "import GptSrtTranslator"],
+            "help": [sys.executable, cli, "--help"],
+            "dry_run": [sys.executable, cli, "-a", "none", "-i", "english", "-f", input_file, "--dry-run", "--log_file", ""],
+        }
+
+        result = {}
+        for name, command in commands.items():
+            times = []
+            for _ in range(runs):
+                start = time.perf_counter()
+                subprocess.run(command, cwd=directory, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+                times.append(time.perf_counter() - start)
+            result[name] = statistics.median(times)
+            print(f"{name:>20}: {result[name]:7.3f} sec")
+
+        if show_imports:
+            print("Slowest imports of the dry run:")
+            for seconds, module in import_times(commands["dry_run"], env):
+                print(f"{module:>20}: {seconds:7.3f} sec")
+
+    return result
+
+
+def print_result(result:dict) -> None:
+    print(f"{result['kind']} file: {result['cues']} subtitles, {result['file_mib']:.1f} MiB, {result['slices']} slices")
+    for name in STAGES:
+        stage = result["stages"][name]
+        memory = f", peak memory {stage['peak_mib']:7.1f} MiB" if stage["peak_mib"] is not None else ""
+        print(f"{name:>20}: {stage['seconds']:8.3f} sec, {stage['cues_per_sec']:10.0f} cues/sec{memory}")
+
+
+def result_key(result:dict) -> str:
+    return f"{result['kind']}-{result['cues']}"
+
+
+def compare(results:list, baseline:dict, tolerance:float) -> list:
+    '''Compares the results with a baseline, returns the stages which became slower or bigger than the tolerance allows.'''
+    regressions = []
+
+    for result in results:
+        key = result_key(result)
+        if key not in baseline:
+            print(f"{key}: not in the baseline")
+            continue
+
+        for name, stage in result["stages"].items():
+            before = baseline[key]["stages"].get(name)
+            if before is None:
+                continue
+
+            for metric in ("seconds", "peak_mib"):
+                if stage[metric] is None or before[metric] is None:
+                    continue
+                if metric == "seconds" and max(stage[metric], before[metric]) < MIN_COMPARED_SECONDS:
+                    continue
+                change = stage[metric] / max(before[metric], 1e-9) - 1
+                flag = ""
+                if change > tolerance:
+                    flag = " REGRESSION"
+                    regressions.append((key, name, metric, change))
+                print(f"{key:>20} {name:>16} {metric:>8}: {before[metric]:10.3f} -> {stage[metric]:10.3f} ({change:+.0%}){flag}")
+
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmarks of the subtitle pipeline.')
+    parser.add_argument('benchmark', choices=["parser", "tags", "pipeline", "startup"], help='Benchmark to run')
+    parser.add_argument('--cues', '-n', type=int, nargs='+', default=None, help='Number of subtitles in the synthetic files, default: 100000 for the parser and the tags, 1000 10000 100000 for the pipeline, 1000 for the startup')
+    parser.add_argument('--kind', '-k', choices=KINDS, nargs='+', default=KINDS, help='Kind of synthetic files for the pipeline, default: all')
+    parser.add_argument('--concurrency', '-c', type=int, default=4, help='Parallel slices of the end to end run, default: 4')
+    parser.add_argument('--skip_memory', action='store_true', help='Measure only the wall time, much faster on big files')
+    parser.add_argument('--save_baseline', type=str, default=None, help='Save the pipeline results into a JSON baseline file')
+    parser.add_argument('--compare', type=str, default=None, help='Compare the pipeline results with a JSON baseline file, exits with 1 on regressions')
+    parser.add_argument('--runs', type=int, default=5, help='Processes started for every startup measurement, default: 5')
+    parser.add_argument('--imports', action='store_true', help='List the slowest imports of the dry run after the startup benchmark')
+    parser.add_argument('--max_startup', type=float, default=MAX_STARTUP_SECONDS, help=f'Startup time above which the startup benchmark exits with 1, default: {MAX_STARTUP_SECONDS}')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed slowdown or memory growth compared to the baseline, default: 0.25')
+    args = parser.parse_args()
+
+    # debug logging writes every prompt into the log file, measure the pipeline as it runs in production
+    logging.getLogger().setLevel(logging.WARNING)
+
+    if args.benchmark == "parser":
+        for cues in args.cues or [100000]:
+            bench_parser(cues)
+    elif args.benchmark == "tags":
+        for cues in args.cues or [100000]:
+            bench_tags(cues)
+    elif args.benchmark == "startup":
+        slow = []
+        for cues in args.cues or [1000]:
+            slow += [name for name, seconds in bench_startup(cues, args.runs, args.imports).items() if seconds > args.max_startup]
+        if slow:
+            print(f"Slower than {args.max_startup} sec: {', '.join(slow)}")
+            sys.exit(1)
+    elif args.benchmark == "pipeline":
+        results = []
+        for kind in args.kind:
+            for cues in args.cues or [1000, 10000, 100000]:
+                result = bench_pipeline(cues, kind, args.concurrency, not args.skip_memory)
+                print_result(result)
+                results.append(result)
+
+        if args.save_baseline:
+            with open(args.save_baseline, 'w', encoding="utf8") as file:
+                json.dump({result_key(result): result for result in results}, file, indent=2)
+            print(f"Baseline saved: {args.save_baseline}")
+
+        if args.compare:
+            with open(args.compare, 'r', encoding="utf8") as file:
+                regressions = compare(results, json.load(file), args.tolerance)
+            if regressions:
+                print(f"{len(regressions)} regression(s) above {args.tolerance:.0%}")
+                sys.exit(1)
+            print("No regressions")
@@ -0,0 +1,148 @@
+from array import array
+from bisect import bisect_left, bisect_right
+
+from srtparser import format_time_range
+
+# flags of a subtitle, computed once when it is added
+ENDS_SENTENCE = 1
+STARTS_UPPERCASE = 2
+MUSIC_ASTERISK = 4      # * There is a house in New Orleans *
+MUSIC_NOTE = 8          # ♪ There is a house in New Orleans ♪
+BRACKETED = 16          # [Cheering]
+
+SENTENCE_END_CHARACTERS = ".?!:\"\'"
+
+
+def cue_flags(text:str) -> int:
+    stripped = text.strip()
+    flags = 0
+
+    if stripped and stripped[-1] in SENTENCE_END_CHARACTERS:
+        flags |= ENDS_SENTENCE
+    if text and text[0].isupper():
+        flags |= STARTS_UPPERCASE
+    if stripped.startswith("*"):
+        flags |= MUSIC_ASTERISK
+    if "♪" in text:
+        flags |= MUSIC_NOTE
+    if stripped.startswith("[") and stripped.endswith("]"):
+        flags |= BRACKETED
+
+    return flags
+
+
+class CueStore():
+    '''
+    Column store of the subtitles of a file.
+
+    Start and end times and the flags are kept in arrays, texts and the formatting tags removed from
+    them in lists. Subtitles are addressed by their 1 based index like in the srt file, and can be
+    looked up by time with binary search.
+    '''
+
+    def __init__(self) -> None:
+        self.starts = array('q')
+        self.ends = array('q')
+        self.originals = []
+        self.translations = []
+        self.markups = []
+        self.cue_flags = bytearray()
+
+        # indices ordered by start time, only built when the subtitles are not in order
+        self.in_order = True
+        self.order = None
+        self.order_starts = None
+
+        # duration of the longest subtitle, limits the search for subtitles shown at a given time
+        self.longest = 0
+
+    def append(self, start:int, end:int, original:str, markup:tuple=()) -> int:
+        '''Adds a subtitle and returns its index, markup holds the (position, tag) pairs stripped from the original.'''
+        if self.starts and start < self.starts[-1]:
+            self.in_order = False
+        self.order = None
+        self.longest = max(self.longest, end - start)
+
+        self.starts.append(start)
+        self.ends.append(end)
+        self.originals.append(original)
+        self.translations.append("")
+        self.markups.append(markup)
+        self.cue_flags.append(cue_flags(original))
+        return len(self.starts)
+
+    def fork(self) -> "CueStore":
+        '''Returns a store sharing the subtitles of this one, with empty translations of its own.'''
+        fork = CueStore.__new__(CueStore)
+        fork.__dict__.update(self.__dict__)
+        fork.translations = [""] * len(self.starts)
+        return fork
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def __contains__(self, index:int) -> bool:
+        return 1 <= index <= len(self.starts)
+
+    def __iter__(self):
+        return iter(range(1, len(self.starts) + 1))
+
+    def start(self, index:int) -> int:
+        return self.starts[index - 1]
+
+    def end(self, index:int) -> int:
+        return self.ends[index - 1]
+
+    def timestamp(self, index:int) -> str:
+        return format_time_range(self.starts[index - 1], self.ends[index - 1])
+
+    def original(self, index:int) -> str:
+        return self.originals[index - 1]
+
+    def flags(self, index:int) -> int:
+        return self.cue_flags[index - 1]
+
+    def markup(self, index:int) -> tuple:
+        return self.markups[index - 1]
+
+    def translated(self, index:int) -> str:
+        return self.translations[index - 1]
+
+    def set_translated(self, index:int, text:str) -> None:
+        self.translations[index - 1] = text
+
+    def sorted_starts(self) -> tuple:
+        # start times in ascending order and the index belonging to each of them
+        if self.in_order:
+            return self.starts, None
+
+        if self.order is None:
+            self.order = sorted(range(1, len(self.starts) + 1), key=self.start)
+            self.order_starts = array('q', (self.start(index) for index in self.order))
+        return self.order_starts, self.order
+
+    def find_by_start(self, start:int) -> list:
+        '''Returns the indices of every subtitle starting at the given time.'''
+        starts, order = self.sorted_starts()
+        first = bisect_left(starts, start)
+        last = bisect_right(starts, start, lo=first)
+
+        if order is None:
+            return list(range(first + 1, last + 1))
+        return sorted(order[first:last])
+
+    def find_at(self, time:int) -> int:
+        '''Returns the index of the latest subtitle shown at the given time, or None.'''
+        starts, order = self.sorted_starts()
+        position = bisect_right(starts, time)
+
+        while position > 0:
+            position -= 1
+            index = position + 1 if order is None else order[position]
+            if self.end(index) > time:
+                return index
+            if time - starts[position] >= self.longest:
+                # earlier subtitles end before the given time
+                break
+
+        return None
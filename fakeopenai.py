@@ -0,0 +1,228 @@
+import argparse
+import itertools
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# [00:00:01,000 --> 00:00:02,000] text of the subtitle
+line_regex = re.compile(r"^(\[[^\]]*\])\s?(.*)$")
+language_regex = re.compile(r"^Target language: (.*)$", re.MULTILINE)
+languages_regex = re.compile(r"^Target languages: (.*)$", re.MULTILINE)
+
+
+def fake_translation(prompt:str) -> str:
+    '''
+    Answers a translation prompt by echoing every subtitle line marked with the target language.
+
+    When several target languages are asked, every language gets a section starting with ### and its name.
+    '''
+    match = languages_regex.search(prompt)
+    if match:
+        languages = [language.strip() for language in match.group(1).split(",")]
+    else:
+        match = language_regex.search(prompt)
+        languages = [match.group(1).strip() if match else "translated"]
+
+    subtitles = [match for match in map(line_regex.match, prompt.split("\n")) if match]
+
+    lines = []
+    for language in languages:
+        if len(languages) > 1:
+            lines.append(f"### {language}")
+        lines += [f"{match.group(1)} ({language}) {match.group(2)}" for match in subtitles]
+    return "\n".join(lines)
+
+
+def fake_completion(body:dict) -> dict:
+    prompt = "\n".join(message["content"] for message in body["messages"])
+    content = fake_translation(prompt)
+    prompt_tokens = len(prompt) // 4
+    completion_tokens = len(content) // 4
+
+    return {
+        "id": "chatcmpl-fake",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "fake"),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": "stop"
+        }],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens
+        }
+    }
+
+
+class FakeOpenAI():
+    '''
+    Local stand-in for the OpenAI API, serving chat completions, files and batches.
+
+    Translations are fake, every subtitle is echoed back with the target language in front of it.
+    Batches are completed after batch_polls status requests.
+    '''
+
+    def __init__(self, host:str="127.0.0.1", port:int=0, latency:float=0.0, batch_polls:int=1) -> None:
+        self.latency = latency
+        self.batch_polls = batch_polls
+
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.files = {}
+        self.batches = {}
+        self.polls = {}
+
+        handler = type("FakeOpenAIHandler", (FakeOpenAIHandler,), {"fake": self})
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.thread = None
+
+    @property
+    def api_base(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "FakeOpenAI":
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def new_id(self, prefix:str) -> str:
+        with self.lock:
+            return f"{prefix}-{next(self.ids)}"
+
+    def chat_completion(self, body:dict) -> dict:
+        if self.latency:
+            time.sleep(self.latency)
+        return fake_completion(body)
+
+    def upload_file(self, content:bytes, purpose:str) -> dict:
+        file_id = self.new_id("file")
+        self.files[file_id] = content
+        return {"id": file_id, "object": "file", "bytes": len(content), "purpose": purpose}
+
+    def create_batch(self, body:dict) -> dict:
+        batch_id = self.new_id("batch")
+        self.batches[batch_id] = {
+            "id": batch_id,
+            "object": "batch",
+            "endpoint": body["endpoint"],
+            "input_file_id": body["input_file_id"],
+            "completion_window": body["completion_window"],
+            "status": "validating",
+            "output_file_id": None,
+            "error_file_id": None,
+            "request_counts": {"total": 0, "completed": 0, "failed": 0}
+        }
+        self.polls[batch_id] = 0
+        return self.batches[batch_id]
+
+    def get_batch(self, batch_id:str) -> dict:
+        batch = self.batches[batch_id]
+        self.polls[batch_id] += 1
+
+        if batch["status"] != "completed":
+            if self.polls[batch_id] < self.batch_polls:
+                batch["status"] = "in_progress"
+            else:
+                self.run_batch(batch)
+        return batch
+
+    def run_batch(self, batch:dict) -> None:
+        output = []
+        for line in self.files[batch["input_file_id"]].decode("utf8").splitlines():
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            output.append(json.dumps({
+                "id": self.new_id("batch_req"),
+                "custom_id": request["custom_id"],
+                "response": {"status_code": 200, "body": fake_completion(request["body"])},
+                "error": None
+            }))
+
+        batch["output_file_id"] = self.upload_file("\n".join(output).encode("utf8"), "batch_output")["id"]
+        batch["status"] = "completed"
+        batch["request_counts"] = {"total": len(output), "completed": len(output), "failed": 0}
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+
+    # keep-alive connections like the real API
+    protocol_version = "HTTP/1.1"
+    fake = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, data:dict, status:int=200) -> None:
+        self.send_bytes(json.dumps(data).encode("utf8"), "application/json", status)
+
+    def send_bytes(self, content:bytes, content_type:str, status:int=200) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def read_body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def do_POST(self):
+        if self.path == "/v1/chat/completions":
+            self.send_json(self.fake.chat_completion(json.loads(self.read_body())))
+        elif self.path == "/v1/files":
+            fields = parse_multipart(self.read_body(), self.headers["Content-Type"])
+            self.send_json(self.fake.upload_file(fields["file"], fields["purpose"].decode("utf8")))
+        elif self.path == "/v1/batches":
+            self.send_json(self.fake.create_batch(json.loads(self.read_body())))
+        else:
+            self.send_json({"error": {"message": f"Unknown path: {self.path}"}}, 404)
+
+    def do_GET(self):
+        parts = self.path.strip("/").split("/")
+        if parts[:2] == ["v1", "batches"] and len(parts) == 3 and parts[2] in self.fake.batches:
+            self.send_json(self.fake.get_batch(parts[2]))
+        elif parts[:2] == ["v1", "files"] and len(parts) == 4 and parts[3] == "content" and parts[2] in self.fake.files:
+            self.send_bytes(self.fake.files[parts[2]], "application/jsonl")
+        else:
+            self.send_json({"error": {"message": f"Unknown path: {self.path}"}}, 404)
+
+
+def parse_multipart(body:bytes, content_type:str) -> dict:
+    # minimal multipart/form-data parser, returns the content of every field
+    boundary = content_type.split("boundary=")[1].strip('"').encode("utf8")
+    fields = {}
+
+    for part in body.split(b"--" + boundary):
+        if b"\r\n\r\n" not in part:
+            continue
+        headers, content = part.split(b"\r\n\r\n", 1)
+        match = re.search(rb'name="([^"]*)"', headers)
+        if match:
+            fields[match.group(1).decode("utf8")] = content[:-2] if content.endswith(b"\r\n") else content
+
+    return fields
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Local fake of the OpenAI API for offline testing.')
+    parser.add_argument('--port', '-p', type=int, default=8000, help='Port to listen on, default: 8000')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds to wait before answering a completion, default: 0')
+    parser.add_argument('--batch_polls', type=int, default=1, help='Status requests until a batch is completed, default: 1')
+    args = parser.parse_args()
+
+    fake = FakeOpenAI(port=args.port, latency=args.latency, batch_polls=args.batch_polls)
+    print(f"Fake OpenAI API listening on {fake.api_base}")
+    try:
+        fake.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
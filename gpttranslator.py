@@ -1,40 +1,139 @@
 import argparse
+import os
+import sys
 
-from GptSrtTranslator import GptSrtTranslator
+from pipeline import add_service_arguments
 
 parser = argparse.ArgumentParser(description='Translate SRT subtitle using OpenAI GPT API.')
 
 parser.add_argument('--openai_api_key', '-a', type=str, required=True, help='API key for OpenAI')
-parser.add_argument('--input_file', '-f', type=str, required=True, help='Input SRT file path')
+parser.add_argument('--input_file', '-f', type=str, required=True, help='Input SRT file, directory or glob pattern')
 parser.add_argument('--input_language','-i',  type=str, required=True, help='Language of input SRT file')
 
-parser.add_argument('--output_file', '-s', type=str, default="output.srt", help='Output SRT file path, default: output.srt')
+parser.add_argument('--output_file', '-s', type=str, default="output.srt", help='Output SRT file path when a single file is translated, default: output.srt')
+parser.add_argument('--output_dir', '-d', type=str, default=None, help='Directory of the translations when several files are translated, default: next to the input files')
+parser.add_argument('--parallel_files', '-p', type=int, default=2, help='Number of files translated in parallel, default: 2')
 parser.add_argument('--output_language', '-o', type=str, default="English", help='Language to translate to, default: English')
+parser.add_argument('--output_languages', type=str, nargs='+', default=None, help='Several languages to translate to at once, one srt file each named after the language, default: the output language')
+parser.add_argument('--languages_per_request', type=int, default=1, help='Languages translated in one request when the token limit allows, default: 1')
 parser.add_argument('--break_long_lines_at', '-b', type=int, default=40, help='Maximum length of output lines, default: 40')
-parser.add_argument('--slice_length', '-l', type=int, default=15, help='Number of subtitles to send together, default: 15')
+parser.add_argument('--slice_tokens', '-t', type=int, default=800, help='Number of tokens of the subtitles sent together, default: 800')
+parser.add_argument('--slice_length', '-l', type=int, default=None, help='Maximum number of subtitles to send together, default: no limit')
+parser.add_argument('--deduplicate', action='store_true', help='Send repeated subtitles only once and copy their translation')
+parser.add_argument('--context_lines', type=int, default=0, help='Number of subtitles of the previous slice sent along as context, default: 0')
+parser.add_argument('--concurrency', '-c', type=int, default=1, help='Number of slices translated in parallel, default: 1')
+add_service_arguments(parser)
+parser.add_argument('--dry-run', '--dry_run', dest='dry_run', action='store_true', help='Count the requests and tokens and estimate the cost and time without sending anything')
+parser.add_argument('--expected_latency', type=float, default=10, help='Seconds a request is expected to take, used by the dry run, default: 10')
+parser.add_argument('--batch', action='store_true', help='Translate with the cheaper, offline Batch API')
+parser.add_argument('--poll_interval', type=int, default=60, help='Seconds between batch status checks, default: 60')
 
 args = parser.parse_args()
 
+# the translator is imported once the arguments are valid, --help and argument errors return without loading it
+from GptSrtTranslator import GptSrtTranslator
+from pipeline import dry_run_report, find_srt_files, output_file_name, setup_services, summary, translate_files
+
+metrics = setup_services(args)
+output_languages = args.output_languages or [args.output_language]
+
+if os.path.isfile(args.input_file):
+    input_files = [args.input_file]
+    output_files = [args.output_file]
+else:
+    input_files = find_srt_files(args.input_file, output_languages)
+    output_files = [output_file_name(input_file, output_languages[0], args.output_dir) for input_file in input_files]
+
+if not input_files:
+    print("No srt files found:", args.input_file)
+    sys.exit(1)
+
 # Print out the parsed arguments
 print("-------------------------------------------")
 print("         OpenAI API key: ", args.openai_api_key)
 print("             Input file: ", args.input_file)
+print("            Input files: ", len(input_files))
 print("         Input language: ", args.input_language)
 print("-------------------------------------------")
-print("            Output file: ", args.output_file)
-print("        Output language: ", args.output_language)
+print("            Output file: ", args.output_file if len(input_files) == 1 else args.output_dir or "next to the input files")
+print("        Output language: ", ", ".join(output_languages))
 print("Break lines longer than: ", args.break_long_lines_at)
+print("           Slice tokens: ", args.slice_tokens)
 print("           Slice length: ", args.slice_length)
+print("          Context lines: ", args.context_lines)
+print("            Deduplicate: ", args.deduplicate)
+print("            Concurrency: ", args.concurrency)
+print("         Parallel files: ", args.parallel_files)
+print("    Requests per minute: ", args.requests_per_minute)
+print("      Tokens per minute: ", args.tokens_per_minute)
+print("     Translation memory: ", args.translation_memory)
+print("                Backend: ", args.backend)
+print("           Metrics file: ", args.metrics_file)
+print("           Metrics port: ", args.metrics_port)
+print("               Log file: ", args.log_file, args.log_level)
+print("        Trace directory: ", args.trace_dir)
+print("              Batch API: ", args.batch)
+print("                Dry run: ", args.dry_run)
 print("-------------------------------------------")
 
-GptSrtTranslator.API_KEY = args.openai_api_key
-GptSrtTranslator.MODEL_ENGINE = "gpt-3.5-turbo-0301"
+if args.output_dir:
+    os.makedirs(args.output_dir, exist_ok=True)
+
+options = dict(input_language=args.input_language,
+               subtitle_line_max_length=args.break_long_lines_at,
+               concurrency=args.concurrency,
+               requests_per_minute=args.requests_per_minute,
+               tokens_per_minute=args.tokens_per_minute,
+               api_base=args.api_base,
+               slice_tokens=args.slice_tokens,
+               slice_length=args.slice_length,
+               context_lines=args.context_lines,
+               deduplicate=args.deduplicate)
+
+subtitles = []
+multi_language = []
+for input_file, output_file in zip(input_files, output_files):
+    if len(output_languages) > 1:
+        from multilanguage import MultiLanguageTranslator
+        # the file is loaded once and translated into every language together
+        multi = MultiLanguageTranslator(output_languages,
+                                        input_file=input_file,
+                                        output_files=[output_file_name(input_file, language, args.output_dir)
+                                                      for language in output_languages],
+                                        languages_per_request=args.languages_per_request,
+                                        **options)
+        multi_language.append(multi)
+        subtitles += multi.translators
+    else:
+        subtitles.append(GptSrtTranslator(input_file=input_file,
+                                          output_file=output_file,
+                                          output_language=output_languages[0],
+                                          **options))
+
+if args.dry_run:
+    # every file has its own executor, the languages of a file share it
+    parallel_requests = args.concurrency * min(len(input_files), args.parallel_files)
+    # the languages of a file are estimated in the groups they are sent in
+    plans = ([plan for multi in multi_language for plan in multi.dry_run()] if multi_language
+             else [subtitle.dry_run() for subtitle in subtitles])
+    print(dry_run_report(plans,
+                         args.requests_per_minute, args.tokens_per_minute,
+                         parallel_requests, args.expected_latency, args.batch))
+    sys.exit(0)
 
-subtitle = GptSrtTranslator(input_file=args.input_file,
-                            output_file=args.output_file,
-                            input_language=args.input_language,
-                            output_language=args.output_language,
-                            subtitle_line_max_length=args.break_long_lines_at)
+if args.batch:
+    from batch import BatchTranslator
+    BatchTranslator(subtitles, poll_interval=args.poll_interval).run()
+elif multi_language:
+    # the files are translated in parallel like the files of a single language
+    elapsed = translate_files(multi_language, args.parallel_files)
+    print(summary(subtitles, elapsed))
+elif len(subtitles) == 1:
+    subtitles[0].translate()
+else:
+    elapsed = translate_files(subtitles, args.parallel_files)
+    print(summary(subtitles, elapsed))
 
-subtitle.slice_length = 25
-subtitle.translate()
+if not args.batch:
+    print(metrics.summary())
+metrics.close()
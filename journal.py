@@ -0,0 +1,73 @@
+import json
+import logging
+import os
+
+logger = logging.getLogger()
+
+
+class TranslationJournal():
+    '''
+    Append-only checkpoint journal of the finished slices, stored as JSON lines next to the output file.
+
+    The first line describes the translation, every following line holds the subtitle indices of a
+    finished slice and their translations. An interrupted translation can be resumed from the journal
+    without sending the finished subtitles again.
+    '''
+
+    def __init__(self, file_name:str, **header) -> None:
+        self.file_name = file_name
+        self.header = header
+        self.file = None
+
+    def load(self) -> tuple:
+        '''Returns the finished subtitle indices and the translations recorded by an earlier run.'''
+        completed = set()
+        translations = {}
+
+        if not os.path.exists(self.file_name):
+            return completed, translations
+
+        with open(self.file_name, 'r', encoding="utf8") as file:
+            for line_number, line in enumerate(file):
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # the last line is incomplete if the process died while writing it
+                    logger.warning("Ignoring damaged journal line %d in %s", line_number + 1, self.file_name)
+                    continue
+
+                if line_number == 0:
+                    if record != self.header:
+                        logger.warning("Journal %s belongs to a different translation, starting over", self.file_name)
+                        return set(), {}
+                    continue
+
+                completed.update(record["indices"])
+                translations.update({int(index): text for index, text in record["translations"].items()})
+
+        return completed, translations
+
+    def open(self, resume:bool) -> None:
+        if resume and os.path.exists(self.file_name):
+            self.file = open(self.file_name, 'a', encoding="utf8")
+        else:
+            self.file = open(self.file_name, 'w', encoding="utf8")
+            self.write(self.header)
+
+    def record(self, indices:list, translations:dict) -> None:
+        self.write({"indices": indices, "translations": translations})
+
+    def write(self, record:dict) -> None:
+        self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.file.flush()
+
+    def close(self) -> None:
+        if self.file:
+            self.file.close()
+            self.file = None
+
+    def remove(self) -> None:
+        # the translation is complete, the journal is not needed anymore
+        self.close()
+        if os.path.exists(self.file_name):
+            os.remove(self.file_name)
@@ -0,0 +1,261 @@
+import bisect
+import json
+import logging
+import random
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger()
+
+# dollars per 1000 prompt and completion tokens, the longest matching model prefix is used
+PRICES = {
+    "gpt-3.5-turbo": (0.0015, 0.002),
+    "gpt-4": (0.03, 0.06),
+    "gpt-4-turbo": (0.01, 0.03),
+    "gpt-4o": (0.0025, 0.01),
+    "gpt-4o-mini": (0.00015, 0.0006),
+}
+
+# upper bounds of the latency histogram in seconds
+LATENCY_BUCKETS = (0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120)
+
+# latencies kept for the percentiles of the summary, a long running worker keeps a random sample of them
+LATENCY_SAMPLES = 10000
+
+
+def estimate_cost(model_engine:str, prompt_tokens:int, completion_tokens:int) -> float:
+    '''Returns the estimated price of a request in dollars, 0 for unknown models.'''
+    prefixes = [prefix for prefix in PRICES if model_engine and model_engine.startswith(prefix)]
+    if not prefixes:
+        return 0.0
+
+    prompt_price, completion_price = PRICES[max(prefixes, key=len)]
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1000
+
+
+class MetricsSink():
+    '''Receives every request record of the translation, a record is a dictionary of plain values.'''
+
+    def record(self, record:dict) -> None:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class JsonlSink(MetricsSink):
+    '''Appends the records to a JSON lines file, one line per request.'''
+
+    def __init__(self, file_name:str) -> None:
+        self.file_name = file_name
+        self.lock = threading.Lock()
+        self.file = open(file_name, 'a', encoding="utf8")
+
+    def record(self, record:dict) -> None:
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self.lock:
+            self.file.write(line)
+            self.file.flush()
+
+    def close(self) -> None:
+        with self.lock:
+            self.file.close()
+
+
+class PrometheusSink(MetricsSink):
+    '''
+    Serves the totals of a Metrics collector in the Prometheus text format.
+
+    The sink keeps no totals of its own, render reads them from the collector. When a port is given the
+    metrics are served on http://host:port/metrics while the process runs.
+    '''
+
+    def __init__(self, metrics:"Metrics", port:int=None, host:str="127.0.0.1") -> None:
+        self.metrics = metrics
+
+        self.server = None
+        if port is not None:
+            handler = type("MetricsHandler", (MetricsHandler,), {"sink": self})
+            self.server = ThreadingHTTPServer((host, port), handler)
+            threading.Thread(target=self.server.serve_forever, daemon=True).start()
+            logger.info("Serving metrics on http://%s:%d/metrics", host, self.server.server_address[1])
+
+    def record(self, record:dict) -> None:
+        # the collector has counted the record already
+        pass
+
+    def render(self) -> str:
+        metrics = self.metrics
+        with metrics.lock:
+            lines = ["# TYPE gpt_srt_requests_total counter"]
+            lines += [f'gpt_srt_requests_total{{status="{status}"}} {count}' for status, count in sorted(metrics.statuses.items())]
+            lines.append("# TYPE gpt_srt_tokens_total counter")
+            lines.append(f'gpt_srt_tokens_total{{type="prompt"}} {metrics.prompt_tokens}')
+            lines.append(f'gpt_srt_tokens_total{{type="completion"}} {metrics.completion_tokens}')
+            lines.append(f'gpt_srt_tokens_total{{type="cached"}} {metrics.cached_tokens}')
+            lines.append("# TYPE gpt_srt_repeated_prefix_tokens_total counter")
+            lines.append(f"gpt_srt_repeated_prefix_tokens_total {metrics.repeated_prefix_tokens}")
+            lines.append("# TYPE gpt_srt_retries_total counter")
+            lines.append(f"gpt_srt_retries_total {metrics.retries}")
+            lines.append("# TYPE gpt_srt_aligned_lines_total counter")
+            lines.append(f"gpt_srt_aligned_lines_total {metrics.aligned_lines}")
+            lines.append("# TYPE gpt_srt_cost_dollars_total counter")
+            lines.append(f"gpt_srt_cost_dollars_total {metrics.cost:.6f}")
+            lines.append("# TYPE gpt_srt_queue_wait_seconds_total counter")
+            lines.append(f"gpt_srt_queue_wait_seconds_total {metrics.queue_wait_total:.3f}")
+            lines.append("# TYPE gpt_srt_request_latency_seconds histogram")
+            for upper_bound, count in zip(LATENCY_BUCKETS, metrics.latency_buckets):
+                lines.append(f'gpt_srt_request_latency_seconds_bucket{{le="{upper_bound}"}} {count}')
+            lines.append(f'gpt_srt_request_latency_seconds_bucket{{le="+Inf"}} {metrics.latency_count}')
+            lines.append(f"gpt_srt_request_latency_seconds_sum {metrics.latency_sum:.3f}")
+            lines.append(f"gpt_srt_request_latency_seconds_count {metrics.latency_count}")
+        return "\n".join(lines) + "\n"
+
+    def close(self) -> None:
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+
+    sink = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_response(404)
+            self.end_headers()
+            return
+
+        content = self.sink.render().encode("utf8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+
+class Metrics():
+    '''
+    Collects a record of every completion request and forwards it to the sinks.
+
+    A record holds the input file, the number of lines, the attempt, the queue wait before the rate
+    limiter let the request go, the latency, the token usage, the realigned lines and the estimated
+    cost. The totals are kept for the summary at the end of the run, the latency percentiles are
+    computed from a uniform sample of at most latency_samples requests.
+
+    cached_tokens are the prompt tokens the provider reported as served from its cache. The system
+    prompt of a request is its prefix, the tokens of a prefix sent again in the process are counted as
+    repeated_prefix_tokens. They only show how much a provider cache could serve, short prefixes are not
+    cached at all.
+    '''
+
+    _shared = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, sinks:list=None, latency_samples:int=LATENCY_SAMPLES) -> None:
+        self.sinks = list(sinks or [])
+        self.latency_samples = latency_samples
+        self.random = random.Random(0)
+
+        self.lock = threading.Lock()
+        self.statuses = {}
+        self.retries = 0
+        self.queue_wait_count = 0
+        self.queue_wait_total = 0.0
+        self.queue_wait_max = 0.0
+        # reservoir sample of the latencies, latency_count of them were recorded
+        self.latencies = []
+        self.latency_count = 0
+        self.latency_sum = 0.0
+        # cumulative histogram of the latencies
+        self.latency_buckets = [0] * len(LATENCY_BUCKETS)
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.aligned_lines = 0
+        self.cost = 0.0
+        self.prefixes = set()
+        self.repeated_prefix_tokens = 0
+        self.cached_tokens = 0
+
+    @classmethod
+    def shared(cls, key:str="default") -> "Metrics":
+        '''Returns the collector of the given key, it is created on first use and shared in the process.'''
+        with cls._shared_lock:
+            if key not in cls._shared:
+                cls._shared[key] = cls()
+            return cls._shared[key]
+
+    def add_sink(self, sink:MetricsSink) -> None:
+        with self.lock:
+            self.sinks.append(sink)
+
+    def record(self, record:dict) -> None:
+        with self.lock:
+            self.statuses[record["status"]] = self.statuses.get(record["status"], 0) + 1
+            self.retries += 1 if record["attempt"] else 0
+            self.queue_wait_count += 1
+            self.queue_wait_total += record["queue_wait"]
+            self.queue_wait_max = max(self.queue_wait_max, record["queue_wait"])
+            if record["latency"] is not None:
+                self.add_latency(record["latency"])
+            self.prompt_tokens += record["prompt_tokens"]
+            self.completion_tokens += record["completion_tokens"]
+            self.aligned_lines += record["aligned_lines"]
+            self.cost += record["cost"]
+            if record.get("prefix_id") in self.prefixes:
+                self.repeated_prefix_tokens += record["prefix_tokens"]
+            elif record.get("prefix_id"):
+                self.prefixes.add(record["prefix_id"])
+            self.cached_tokens += record.get("cached_tokens", 0)
+            sinks = list(self.sinks)
+
+        for sink in sinks:
+            try:
+                sink.record(record)
+            except Exception as e:
+                logger.warning("Metrics sink %s failed: %s", type(sink).__name__, e)
+
+    def add_latency(self, latency:float) -> None:
+        # called with the lock held
+        self.latency_count += 1
+        self.latency_sum += latency
+        # buckets are cumulative, a request is counted in every bucket above its latency
+        for bucket in range(bisect.bisect_left(LATENCY_BUCKETS, latency), len(LATENCY_BUCKETS)):
+            self.latency_buckets[bucket] += 1
+
+        # every latency stays in the sample with the same probability
+        if len(self.latencies) < self.latency_samples:
+            self.latencies.append(latency)
+        else:
+            slot = self.random.randrange(self.latency_count)
+            if slot < self.latency_samples:
+                self.latencies[slot] = latency
+
+    @staticmethod
+    def percentile(values:list, share:float) -> float:
+        if not values:
+            return 0.0
+        values = sorted(values)
+        return values[min(len(values) - 1, int(share * len(values)))]
+
+    def summary(self) -> str:
+        with self.lock:
+            requests = sum(self.statuses.values())
+            if not requests:
+                return "No requests were sent"
+
+            statuses = ", ".join(f"{count} {status}" for status, count in sorted(self.statuses.items()))
+            return (f"{requests} requests ({statuses}), {self.retries} retries, "
+                    f"latency p50 {self.percentile(self.latencies, 0.5):.2f} sec, p95 {self.percentile(self.latencies, 0.95):.2f} sec, "
+                    f"queue wait avg {self.queue_wait_total / self.queue_wait_count:.2f} sec, max {self.queue_wait_max:.2f} sec, "
+                    f"{self.prompt_tokens} prompt + {self.completion_tokens} completion tokens, "
+                    f"{self.cached_tokens} prompt tokens cached by the provider, {self.repeated_prefix_tokens} tokens of repeated system prompts, "
+                    f"{self.aligned_lines} realigned lines, estimated cost ${self.cost:.4f}")
+
+    def close(self) -> None:
+        for sink in self.sinks:
+            sink.close()
@@ -0,0 +1,247 @@
+import logging
+import re
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from backends import BackendError
+from GptSrtTranslator import GptSrtTranslator
+from pipeline import output_file_name
+
+logger = logging.getLogger()
+
+# ### German
+section_regex = re.compile(r"^\s*#{2,}\s*(.+?)\s*:?\s*$")
+
+
+def split_sections(text:str, languages:list) -> dict:
+    '''Splits a translation into several languages at the ### language lines, returns the text of every language found.'''
+    names = {language.lower(): language for language in languages}
+    sections = {}
+    current = None
+
+    for line in text.split("\n"):
+        match = section_regex.match(line)
+        if match and match.group(1).lower() in names:
+            current = names[match.group(1).lower()]
+            sections[current] = []
+        elif current is not None:
+            sections[current].append(line)
+
+    return {language: "\n".join(lines).strip() for language, lines in sections.items() if "".join(lines).strip()}
+
+
+class LanguageGroup():
+    '''
+    Languages translated together, every slice is sent once for all of them.
+
+    The translators of the group share the slices, the first translator asking for a slice sends the
+    request and every translator gets a future of its own language.
+    '''
+
+    def __init__(self, translators:list) -> None:
+        self.translators = translators
+        self.leader = translators[0]
+        self.languages = [translator.output_language for translator in translators]
+
+        self.lock = threading.Lock()
+        self.futures = {}
+
+    def submit(self, translator:GptSrtTranslator, executor, slice_number:int, current_slice) -> Future:
+        with self.lock:
+            if slice_number not in self.futures:
+                futures = {language: Future() for language in self.languages}
+                self.futures[slice_number] = futures
+                executor.submit(self.translate_slice, current_slice).add_done_callback(
+                    lambda group_future: self.resolve(group_future, futures))
+            return self.futures[slice_number][translator.output_language]
+
+    def resolve(self, group_future:Future, futures:dict) -> None:
+        # hand the result of the shared request to the future of every language
+        try:
+            results, error = group_future.result(), None
+        except BaseException as e:
+            results, error = None, e
+
+        for language, future in futures.items():
+            if not future.set_running_or_notify_cancel():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(results[language])
+
+    def translate_slice(self, current_slice) -> dict:
+        '''Returns the translated text of the slice for every language of the group, None for the failed ones.'''
+        sections = {}
+
+        for attempt in range(self.leader.max_retries + 1):
+            if attempt:
+                logger.error("Trying again (%d/%d)...", attempt, self.leader.max_retries)
+
+            record = self.leader.new_record(current_slice.text, attempt, languages=len(self.languages))
+            self.leader.log(f"Sent {record['lines']} lines in {len(self.languages)} languages")
+
+            request = self.leader.build_request(current_slice.text, current_slice.context, self.languages)
+            try:
+                response = self.leader.complete(request, record)
+            except BackendError as e:
+                # the shared request would fail again, the languages are sent alone
+                logger.error("Shared request is not sent again: %s", e)
+                break
+            if response is None:
+                continue
+
+            sections = split_sections(response, self.languages)
+            if len(sections) < len(self.languages):
+                record["status"] = "missing_languages"
+            self.leader.metrics.record(record)
+
+            if sections:
+                break
+
+        results = {}
+        for translator in self.translators:
+            results[translator.output_language] = self.finish(translator, current_slice,
+                                                              sections.get(translator.output_language))
+        return results
+
+    def finish(self, translator:GptSrtTranslator, current_slice, text:str) -> str:
+        # realign and repair the section of a language, send the slice again alone if the section is unusable
+        if text is not None:
+            text = translator.process_response(current_slice.text, text)
+            damaged = translator.find_damaged(current_slice.indices, text)
+            if len(damaged) < len(current_slice.indices):
+                return translator.repair_slice(text, damaged) if damaged else text
+
+        logger.warning("No usable %s translation in the shared answer, translating alone", translator.output_language)
+        return translator.translate_slice(current_slice)
+
+
+class MultiLanguageTranslator():
+    '''
+    Translates a subtitle file into several languages at once.
+
+    The file is loaded once and shared by a GptSrtTranslator of every language. Languages with the same
+    subtitles to translate share one slice plan, and the slices of every language are sent by one
+    executor, so the languages are translated in parallel within the concurrency limit. With
+    languages_per_request several languages are asked in one request when their translations fit
+    into max_tokens.
+
+    Like a GptSrtTranslator it can be translated by pipeline.translate_files together with other files,
+    its languages take progress_lines progress bar lines from progress_position on.
+    '''
+
+    def __init__(self, output_languages:list, **kwargs) -> None:
+        '''
+        Args:
+            output_languages: Languages to translate to.
+            **kwargs: Arguments of the GptSrtTranslator objects, and optional arguments:
+                - output_files: Output file of every language. Defaults to the input file name with the language added, next to the input file.
+                - languages_per_request: Maximum number of languages translated in one request. Defaults to 1.
+                - executor: ThreadPoolExecutor shared with other translations, the requests of every language are sent by its threads. Defaults to an own executor with concurrency threads.
+        '''
+        self.output_languages = list(output_languages)
+        self.input_file = kwargs.get("input_file")
+        self.progress_lines = len(self.output_languages)
+        kwargs.pop("output_language", None)
+        kwargs.pop("output_file", None)
+        self.languages_per_request = max(1, kwargs.pop("languages_per_request", 1))
+        output_files = kwargs.pop("output_files", None) or [
+            output_file_name(kwargs.get("input_file", ""), language) for language in self.output_languages
+        ]
+
+        self.concurrency = max(1, kwargs.get("concurrency", 1))
+        self.own_executor = kwargs.get("executor") is None
+        self.executor = kwargs.pop("executor", None) or ThreadPoolExecutor(max_workers=self.concurrency)
+
+        self.translators = []
+        for position, (language, output_file) in enumerate(zip(self.output_languages, output_files)):
+            if self.translators:
+                kwargs["cues"] = self.translators[0].cues
+            self.translators.append(GptSrtTranslator(output_language=language,
+                                                     output_file=output_file,
+                                                     executor=self.executor,
+                                                     progress_title=language[:10],
+                                                     progress_position=position,
+                                                     **kwargs))
+
+    @property
+    def cues(self):
+        return self.translators[0].cues
+
+    @property
+    def progress_position(self) -> int:
+        return self.translators[0].progress_position
+
+    @progress_position.setter
+    def progress_position(self, position:int) -> None:
+        for offset, translator in enumerate(self.translators):
+            translator.progress_position = position + offset
+
+    @property
+    def total_progress(self):
+        return self.translators[0].total_progress
+
+    @total_progress.setter
+    def total_progress(self, progress) -> None:
+        for translator in self.translators:
+            translator.total_progress = progress
+
+    def plan(self, dry_run:bool=False) -> list:
+        '''Plans the slices of every language, returns the groups of languages sharing the same plan.'''
+        plans = {}
+        for translator in self.translators:
+            translator.load_journal(restore=not dry_run)
+            first, translatable = translator.translatable_indices(dry_run)
+            key = (first, tuple(translatable))
+            if key not in plans:
+                plans[key] = (translator.plan_slices(first, translatable), [])
+            translator.planned_slices = plans[key][0]
+            plans[key][1].append(translator)
+
+        logger.info("%d language(s), %d slice plan(s)", len(self.translators), len(plans))
+        return [(slices, translators) for slices, translators in plans.values()]
+
+    def languages_per_group(self, slices:tuple, translator:GptSrtTranslator) -> int:
+        # as many languages as the longest slice allows in max_tokens
+        if self.languages_per_request == 1 or not slices:
+            return 1
+        longest = max(current_slice.tokens for current_slice in slices)
+        fit = int((translator.max_tokens - 100) / max(1, longest * translator.output_token_ratio))
+        return max(1, min(self.languages_per_request, fit))
+
+    def groups(self, slices:tuple, translators:list) -> list:
+        # the translators of a slice plan asked in one request
+        size = self.languages_per_group(slices, translators[0])
+        return [translators[start:start + size] for start in range(0, len(translators), size)]
+
+    def dry_run(self) -> list:
+        '''Plans the translation without sending anything, returns the estimate of every request group like translate sends them.'''
+        plans = []
+        for slices, translators in self.plan(dry_run=True):
+            for group in self.groups(slices, translators):
+                languages = [translator.output_language for translator in group]
+                plans.append(group[0].estimate(slices, languages if len(group) > 1 else None))
+        return plans
+
+    def translate(self) -> None:
+        for slices, translators in self.plan():
+            for group in self.groups(slices, translators):
+                if len(group) > 1:
+                    dispatcher = LanguageGroup(group)
+                    for translator in group:
+                        translator.dispatcher = dispatcher
+
+        def translate_language(translator):
+            try:
+                translator.translate()
+            except Exception as e:
+                logger.error("Translation into %s failed: %s", translator.output_language, e)
+
+        # one coordinating thread per language, the requests are sent by the shared executor
+        try:
+            with ThreadPoolExecutor(max_workers=len(self.translators)) as coordinators:
+                list(coordinators.map(translate_language, self.translators))
+        finally:
+            if self.own_executor:
+                self.executor.shutdown(wait=False, cancel_futures=True)
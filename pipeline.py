@@ -0,0 +1,193 @@
+import glob
+import logging
+import os
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from ratelimiter import projected_time
+
+logger = logging.getLogger()
+
+
+def find_srt_files(pattern:str, output_language=None) -> list:
+    '''
+    Returns the srt files matching a file name, a directory or a glob pattern.
+
+    Files which already carry the output language, or one of a list of output languages, in their name
+    are left out, so translating the same directory again does not pick up the earlier translations.
+    '''
+    if os.path.isdir(pattern):
+        files = glob.glob(os.path.join(pattern, "*.srt"))
+    else:
+        files = glob.glob(pattern)
+
+    files = [file for file in files if file.lower().endswith(".srt")]
+    if output_language:
+        languages = [output_language] if isinstance(output_language, str) else output_language
+        translated_suffixes = tuple(f".{language.lower()}.srt" for language in languages)
+        files = [file for file in files if not file.lower().endswith(translated_suffixes)]
+
+    return sorted(files)
+
+
+def output_file_name(input_file:str, output_language:str, output_dir:str=None) -> str:
+    # episode.en.srt -> episode.en.hungarian.srt
+    stem = os.path.splitext(os.path.basename(input_file))[0]
+    directory = output_dir if output_dir else os.path.dirname(input_file)
+    return os.path.join(directory, f"{stem}.{output_language.lower()}.srt")
+
+
+def translate_files(translators:list, parallel_files:int=2) -> float:
+    '''
+    Translates several files in one process, returns the elapsed time.
+
+    The translators share the rate limiter and translation memory of the process. Up to parallel_files
+    files are translated at the same time, each with its own progress bar below the total one. A
+    MultiLanguageTranslator takes a progress bar for every language of its file.
+    '''
+    from tqdm import tqdm
+
+    parallel_files = max(1, min(parallel_files, len(translators)))
+    lines = max(getattr(translator, "progress_lines", 1) for translator in translators)
+    total_progress = tqdm(total=sum(len(translator.cues) * getattr(translator, "progress_lines", 1) for translator in translators),
+                          bar_format='{l_bar}{bar:40}{r_bar}', desc="total".ljust(10), position=0)
+
+    for translator in translators:
+        translator.total_progress = total_progress
+
+    # lines of the progress bars, a file takes a free line when it starts and gives it back when it is done
+    free_positions = queue.SimpleQueue()
+    for slot in range(parallel_files):
+        free_positions.put(1 + slot * lines)
+
+    def translate_file(translator):
+        translator.progress_position = free_positions.get()
+        try:
+            translator.translate()
+        except Exception as e:
+            logger.error("Translation of %s failed: %s", translator.input_file, e)
+        finally:
+            free_positions.put(translator.progress_position)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=parallel_files) as executor:
+        list(executor.map(translate_file, translators))
+    elapsed = time.perf_counter() - start
+
+    total_progress.close()
+    return elapsed
+
+
+def summary(translators:list, elapsed:float) -> str:
+    subtitles = sum(len(translator.cues) for translator in translators)
+    requests = sum(translator.requests for translator in translators)
+    tokens = sum(translator.prompt_tokens + translator.completion_tokens for translator in translators)
+    elapsed = max(elapsed, 1e-9)
+
+    # a file translated into several languages has a translator of every language
+    files = len({translator.input_file for translator in translators})
+    languages = len({translator.output_language for translator in translators})
+    translated = f"{files} file(s) into {languages} languages" if languages > 1 else f"{files} file(s)"
+
+    return (f"{translated}, {subtitles} subtitles, {requests} requests, {tokens} tokens "
+            f"in {elapsed:.1f} sec: {subtitles / elapsed:.1f} subtitles/sec, {tokens / elapsed:.1f} tokens/sec")
+
+
+def dry_run_report(plans:list, requests_per_minute:int, tokens_per_minute:int, parallel_requests:int,
+                   latency:float, batch:bool=False) -> str:
+    '''
+    Summarizes the dry run plans of the files, with the projected wall time of the translation.
+
+    The files share the rate limits of the account. The wall time is the longer of the time the limits
+    allow and the time the parallel requests need with the given latency each. The rate limiter reserves
+    max_tokens for every request until its answer arrives, so the token budget also has to hold the
+    unused reservations of the parallel requests.
+    '''
+    lines = []
+    for plan in plans:
+        languages = f" ({', '.join(plan['languages'])})" if plan.get("languages") else ""
+        lines.append(f"{os.path.basename(plan['file'])}{languages}: {plan['to_translate']} of {plan['subtitles']} subtitles, "
+                     f"{plan['requests']} requests, {plan['prompt_tokens']} input + {plan['completion_tokens']} output tokens")
+
+    requests = sum(plan["requests"] for plan in plans)
+    prompt_tokens = sum(plan["prompt_tokens"] for plan in plans)
+    completion_tokens = sum(plan["completion_tokens"] for plan in plans)
+    cost = sum(plan["cost"] for plan in plans)
+    saved_tokens = sum(plan.get("saved_tokens", 0) for plan in plans)
+    reserved_tokens = sum(plan.get("reserved_tokens", plan["prompt_tokens"] + plan["completion_tokens"]) for plan in plans)
+
+    # unused reservations of the requests in flight
+    held_tokens = (reserved_tokens - prompt_tokens - completion_tokens) / max(1, requests) * min(requests, parallel_requests)
+    limited = projected_time(requests, prompt_tokens + completion_tokens + held_tokens, requests_per_minute, tokens_per_minute)
+    sending = requests * latency / max(1, parallel_requests)
+    wall_time = max(limited, sending)
+
+    lines.append("-------------------------------------------")
+    lines.append(f"{len({plan['file'] for plan in plans})} file(s), {requests} requests, {prompt_tokens} input tokens, {completion_tokens} output tokens")
+    if saved_tokens:
+        lines.append(f"Repeated subtitles: {sum(plan['deduplicated'] for plan in plans)} copied, {saved_tokens} subtitle tokens saved")
+    if batch:
+        # the Batch API is billed at half price and is not limited by the per minute budgets
+        lines.append(f"Estimated cost: ${cost / 2:.4f} with the Batch API")
+    else:
+        lines.append(f"Estimated cost: ${cost:.4f}")
+        lines.append(f"Projected wall time: {wall_time / 60:.1f} min "
+                     f"({'rate limited' if limited >= sending else f'{parallel_requests} parallel requests of {latency:.0f} sec'})")
+    return "\n".join(lines)
+
+
+def add_service_arguments(parser, log_file:str="app.log", log_level:str="DEBUG") -> None:
+    '''Adds the arguments of the services shared by every translator of the process, read by setup_services.'''
+    parser.add_argument('--requests_per_minute', type=int, default=3500, help='Request rate limit of the account, default: 3500')
+    parser.add_argument('--tokens_per_minute', type=int, default=90000, help='Token rate limit of the account, default: 90000')
+    parser.add_argument('--translation_memory', '-m', type=str, default=None, help='SQLite file to reuse earlier translations from, default: none')
+    parser.add_argument('--api_base', type=str, default=None, help='Base url of an OpenAI compatible API, default: OpenAI')
+    parser.add_argument('--backend', type=str, choices=["openai", "stub"], default="openai", help='Where the requests are sent, stub answers locally for load tests, default: openai')
+    parser.add_argument('--stub_latency', type=float, default=0.5, help='Seconds the stub backend waits before answering, default: 0.5')
+    parser.add_argument('--stub_error_rate', type=float, default=0.0, help='Share of the requests failed by the stub backend, default: 0')
+    parser.add_argument('--metrics_file', type=str, default=None, help='Append a JSON line with the latency and token usage of every request to this file, default: none')
+    parser.add_argument('--metrics_port', type=int, default=None, help='Serve Prometheus metrics on this port while the process runs, default: none')
+    parser.add_argument('--log_file', type=str, default=log_file, help=f'Log file of the run, written by a background thread, default: {log_file}')
+    parser.add_argument('--log_level', type=str, choices=["DEBUG", "INFO", "WARNING", "ERROR"], default=log_level, help=f'Level of the log file, default: {log_level}')
+    parser.add_argument('--trace_dir', type=str, default=None, help='Write the original and the translated text of every slice into 01-original.txt and 02-translated.txt in this directory, default: none')
+
+
+def setup_services(args):
+    '''
+    Configures the logging and the services shared by every translator of the process from the arguments.
+
+    The backend, the rate limiter, the translation memory and the trace writer become the class
+    defaults of GptSrtTranslator. Returns the metrics of the process with the requested sinks.
+    '''
+    from GptSrtTranslator import GptSrtTranslator
+    from metrics import JsonlSink, Metrics, PrometheusSink
+    from ratelimiter import RateLimiter
+    from tracing import TraceWriter, configure_logging
+
+    configure_logging(args.log_file, getattr(logging, args.log_level))
+
+    GptSrtTranslator.API_KEY = args.openai_api_key
+    GptSrtTranslator.MODEL_ENGINE = "gpt-3.5-turbo-0301"
+    GptSrtTranslator.RATE_LIMITER = RateLimiter.shared(str(args.openai_api_key),
+                                                       requests_per_minute=args.requests_per_minute,
+                                                       tokens_per_minute=args.tokens_per_minute)
+    if args.backend == "stub":
+        from backends import StubBackend
+        GptSrtTranslator.BACKEND = StubBackend(latency=args.stub_latency, error_rate=args.stub_error_rate)
+    else:
+        from backends import OpenAIBackend
+        GptSrtTranslator.BACKEND = OpenAIBackend.shared(args.openai_api_key, args.api_base)
+    if args.trace_dir:
+        os.makedirs(args.trace_dir, exist_ok=True)
+        GptSrtTranslator.TRACE_WRITER = TraceWriter.shared(args.trace_dir)
+    if args.translation_memory:
+        from translationmemory import TranslationMemory
+        GptSrtTranslator.TRANSLATION_MEMORY = TranslationMemory(args.translation_memory)
+
+    metrics = Metrics.shared()
+    if args.metrics_file:
+        metrics.add_sink(JsonlSink(args.metrics_file))
+    if args.metrics_port is not None:
+        metrics.add_sink(PrometheusSink(metrics, args.metrics_port))
+    return metrics
@@ -0,0 +1,107 @@
+import logging
+from typing import NamedTuple
+
+from cuestore import ENDS_SENTENCE, STARTS_UPPERCASE
+from tokenizer import count_tokens
+
+logger = logging.getLogger()
+
+
+class Slice(NamedTuple):
+    start: int          # first subtitle covered by the slice
+    end: int            # subtitle after the last one covered, the next slice starts here
+    text: str           # lines sent for translation
+    indices: tuple      # subtitles sent for translation, the skipped ones between start and end are left out
+    tokens: int         # tokens of the lines
+    context: str = ""   # last lines of the previous slice, sent along untranslated
+
+
+def sentence_boundaries(cues) -> bytearray:
+    '''
+    Returns a flag for every subtitle telling whether a slice may end after it.
+
+    A slice may end after a subtitle which ends a sentence, or which is followed by a subtitle
+    starting with a capital letter. Position 0 is unused, subtitles are addressed from 1.
+    '''
+    boundaries = bytearray(len(cues) + 1)
+    for index in cues:
+        if cues.flags(index) & ENDS_SENTENCE or (index + 1 in cues and cues.flags(index + 1) & STARTS_UPPERCASE):
+            boundaries[index] = 1
+    return boundaries
+
+
+class SlicePlanner():
+    '''
+    Splits the subtitles of a file into the slices sent for translation, before anything is sent.
+
+    A slice is closed when its lines reach the token budget or the maximum number of lines, then it is
+    extended up to buffer more lines to end at a sentence boundary. The slices cover every subtitle
+    from the first one to translate up to the end of the file without gaps, so the skipped subtitles
+    are finished together with the slice around them.
+
+    With context_lines the last subtitles of the previous slice are attached to every slice, so the
+    slices do not need to overlap to keep the thread of the dialog.
+    '''
+
+    def __init__(self, cues, slice_tokens:int, slice_length:int=None, buffer:int=5, model_engine:str="gpt-3.5-turbo",
+                 context_lines:int=0) -> None:
+        self.cues = cues
+        self.slice_tokens = slice_tokens
+        self.slice_length = slice_length
+        self.buffer = buffer
+        self.model_engine = model_engine
+        self.context_lines = context_lines
+
+    def context(self, indices:list) -> str:
+        # > original text, without the timestamp so it is not mistaken for a line to translate
+        if not self.context_lines:
+            return ""
+        originals = (self.cues.original(index).replace('\n', ' ') for index in indices[-self.context_lines:])
+        return "".join(f"> {original}\n" for original in originals)
+
+    def plan(self, translatable:list, line, first:int=1) -> tuple:
+        '''
+        Returns the immutable list of slices.
+
+        translatable holds the indices of the subtitles to send in ascending order, line returns the
+        text sent for a subtitle. Slices start at the first subtitle, earlier subtitles are not covered.
+        '''
+        boundaries = sentence_boundaries(self.cues)
+        end_of_file = len(self.cues) + 1
+
+        slices = []
+        start = first
+        lines = []
+        indices = []
+        tokens = 0
+        full_at = None
+        context = ""
+
+        for index in translatable:
+            text = line(index)
+            lines.append(text)
+            indices.append(index)
+            tokens += count_tokens(text, self.model_engine)
+
+            if full_at is None and (tokens >= self.slice_tokens or
+                                    (self.slice_length and len(indices) >= self.slice_length)):
+                full_at = len(indices)
+
+            # wait for the end of a sentence, but check forward only buffer lines
+            if full_at is not None and (boundaries[index] or len(indices) > full_at + self.buffer):
+                slices.append(Slice(start, index + 1, "".join(lines), tuple(indices), tokens, context))
+                context = self.context(indices)
+                start = index + 1
+                lines = []
+                indices = []
+                tokens = 0
+                full_at = None
+
+        if indices:
+            slices.append(Slice(start, end_of_file, "".join(lines), tuple(indices), tokens, context))
+        elif slices:
+            # the last slice covers the skipped subtitles at the end of the file
+            slices[-1] = slices[-1]._replace(end=end_of_file)
+
+        logger.debug("Planned %d slices for %d subtitles", len(slices), len(translatable))
+        return tuple(slices)
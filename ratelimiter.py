@@ -0,0 +1,106 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger()
+
+REQUESTS_PER_MINUTE = 3500
+TOKENS_PER_MINUTE = 90000
+
+class RateLimiter():
+    '''
+    Token bucket rate limiter for the requests per minute and tokens per minute budgets of an account.
+
+    Every request reserves its share of both budgets up front. When a budget runs out the reservation
+    still succeeds, but the caller has to wait until the bucket has been refilled, so requests go out
+    as early as the budget allows and in the order they were reserved.
+    '''
+
+    _shared = {}
+    _shared_lock = threading.Lock()
+
+    # waiting time after an error without a retry-after hint, doubled after every consecutive error
+    backoff_start = 1
+    backoff_max = 60
+
+    def __init__(self, requests_per_minute:int=REQUESTS_PER_MINUTE, tokens_per_minute:int=TOKENS_PER_MINUTE) -> None:
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+
+        self.lock = threading.Lock()
+        self.request_budget = float(requests_per_minute)
+        self.token_budget = float(tokens_per_minute)
+        self.updated = time.monotonic()
+
+        self.blocked_until = 0.0
+        self.errors = 0
+
+    @classmethod
+    def shared(cls, key:str="default", **kwargs) -> "RateLimiter":
+        '''Returns the limiter of the given account, it is created on first use and shared in the process.'''
+        with cls._shared_lock:
+            if key not in cls._shared:
+                cls._shared[key] = cls(**kwargs)
+            return cls._shared[key]
+
+    def refill(self, now:float) -> None:
+        elapsed = now - self.updated
+        self.updated = now
+
+        self.request_budget = min(self.requests_per_minute,
+                                  self.request_budget + elapsed * self.requests_per_minute / 60)
+        self.token_budget = min(self.tokens_per_minute,
+                                self.token_budget + elapsed * self.tokens_per_minute / 60)
+
+    def reserve(self, tokens:int) -> float:
+        '''Reserves budget for a request, returns the number of seconds to wait before sending it.'''
+        tokens = min(tokens, self.tokens_per_minute)
+
+        with self.lock:
+            now = time.monotonic()
+            self.refill(now)
+
+            self.request_budget -= 1
+            self.token_budget -= tokens
+
+            return max(0.0,
+                       -self.request_budget * 60 / self.requests_per_minute,
+                       -self.token_budget * 60 / self.tokens_per_minute,
+                       self.blocked_until - now)
+
+    def acquire(self, tokens:int) -> float:
+        '''Blocks until the request fits into the budget, returns the time spent waiting.'''
+        wait = self.reserve(tokens)
+        if wait > 0:
+            logger.debug("Rate limiter: waiting %.2f sec for %d tokens", wait, tokens)
+            time.sleep(wait)
+        return wait
+
+    def adjust(self, reserved:int, used:int) -> None:
+        '''Gives back the unused part of a reservation once the real token usage is known.'''
+        with self.lock:
+            self.token_budget += min(reserved, self.tokens_per_minute) - used
+
+    def success(self) -> None:
+        with self.lock:
+            self.errors = 0
+
+    def penalize(self, retry_after:float=None) -> float:
+        '''Holds back every request after an error, honours the retry-after hint of the server.'''
+        with self.lock:
+            if retry_after is None:
+                retry_after = min(self.backoff_start * 2 ** self.errors, self.backoff_max)
+            self.errors += 1
+
+            self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+
+        logger.warning("Rate limiter: holding back requests for %.1f sec", retry_after)
+        return retry_after
+
+
+def projected_time(requests:int, tokens:int, requests_per_minute:int=REQUESTS_PER_MINUTE,
+                   tokens_per_minute:int=TOKENS_PER_MINUTE) -> float:
+    '''Returns the seconds needed to send the requests and tokens, the budgets of a full minute are available at once.'''
+    return max(0.0,
+               (requests - requests_per_minute) * 60 / requests_per_minute,
+               (tokens - tokens_per_minute) * 60 / tokens_per_minute)
@@ -0,0 +1,85 @@
+import re
+from typing import Iterable, Iterator, NamedTuple
+
+# 00:01:02,345 --> 00:01:04,567, a dot is accepted instead of the comma and extra text after the end time is ignored
+timestamp_regex = re.compile(r"^\s*(\d+):(\d\d):(\d\d)[,.](\d{1,3})\s*-->\s*(\d+):(\d\d):(\d\d)[,.](\d{1,3})")
+single_timestamp_regex = re.compile(r"^\s*(\d+):(\d\d):(\d\d)[,.](\d{1,3})")
+
+
+class Cue(NamedTuple):
+    '''A single subtitle of an srt file, start and end are in milliseconds.'''
+    number: int
+    start: int
+    end: int
+    text: str
+
+
+def to_milliseconds(hours:str, minutes:str, seconds:str, milliseconds:str) -> int:
+    return ((int(hours) * 60 + int(minutes)) * 60 + int(seconds)) * 1000 + int(milliseconds.ljust(3, "0"))
+
+
+def parse_timestamp(text:str) -> int:
+    '''Converts a 00:01:02,345 timestamp to milliseconds, returns None if the text is not a timestamp.'''
+    match = single_timestamp_regex.match(text)
+    if match is None:
+        return None
+    return to_milliseconds(*match.groups())
+
+
+def format_timestamp(milliseconds:int) -> str:
+    seconds, milliseconds = divmod(milliseconds, 1000)
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d},{milliseconds:03d}"
+
+
+def format_time_range(start:int, end:int) -> str:
+    return f"{format_timestamp(start)} --> {format_timestamp(end)}"
+
+
+def parse_srt(lines:Iterable[str]) -> Iterator[Cue]:
+    '''
+    Parses an srt file line by line and yields its subtitles.
+
+    Every timestamp line starts a new subtitle, the number on the line before it is the subtitle number.
+    Missing or broken numbers, missing empty lines between subtitles, CRLF line endings and a BOM are
+    tolerated. Lines before the first timestamp are ignored.
+    '''
+    number = None
+    start = None
+    end = None
+    text = []
+
+    first_line = True
+    for line in lines:
+        if first_line:
+            line = line.lstrip("\ufeff")
+            first_line = False
+
+        if "-->" not in line:
+            text.append(line)
+            continue
+
+        match = timestamp_regex.match(line)
+        if match is None:
+            text.append(line)
+            continue
+
+        # the last non empty line before the timestamp is the number of the new subtitle
+        while text and not text[-1].strip():
+            text.pop()
+        next_number = None
+        if text and text[-1].strip().isdigit():
+            next_number = int(text.pop().strip())
+
+        if start is not None:
+            yield Cue(number, start, end, "\n".join(part.strip() for part in text if part.strip()))
+
+        groups = match.groups()
+        number = next_number
+        start = to_milliseconds(*groups[:4])
+        end = to_milliseconds(*groups[4:])
+        text = []
+
+    if start is not None:
+        yield Cue(number, start, end, "\n".join(part.strip() for part in text if part.strip()))
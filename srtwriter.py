@@ -0,0 +1,41 @@
+import os
+
+
+class SrtWriter():
+    '''
+    Writes an srt file incrementally.
+
+    Subtitles are appended to a temporary file next to the target as soon as they are completed, the
+    target is replaced atomically by the finished file when the writer is closed.
+    '''
+
+    def __init__(self, file_name:str) -> None:
+        self.file_name = file_name
+        self.temp_file_name = file_name + ".part"
+        self.file = open(self.temp_file_name, 'w', encoding="utf8")
+        self.count = 0
+
+    def write(self, index:int, timestamp:str, text:str) -> None:
+        self.file.write(f"{index}\n{timestamp}\n{text}\n\n")
+        self.count += 1
+
+    def flush(self) -> None:
+        self.file.flush()
+
+    def close(self) -> None:
+        # finish the file and move it to its final place
+        self.file.close()
+        os.replace(self.temp_file_name, self.file_name)
+
+    def abort(self) -> None:
+        # keep the partial file for inspection, leave the target untouched
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
@@ -0,0 +1,113 @@
+import html
+import re
+
+# <i>, </i>, <font color="#ffff00">, <br/>, a lonely < in the text is not a tag
+tag_regex = re.compile(r"</?[A-Za-z][^<>]*>")
+# word starts and word ends, where tags inside a subtitle can be put back
+word_start_regex = re.compile(r"(?:^|(?<=\s))\S")
+word_end_regex = re.compile(r"\S(?:$|(?=\s))")
+
+
+def strip_tags(text:str) -> tuple:
+    '''
+    Removes the formatting tags and decodes the html entities of a subtitle.
+
+    Returns the plain text and a tuple of (position, tag) pairs, positions are offsets in the plain text.
+    '''
+    if "<" not in text and "&" not in text:
+        return text, ()
+
+    parts = []
+    tags = []
+    length = 0
+    last = 0
+
+    for match in tag_regex.finditer(text):
+        part = html.unescape(text[last:match.start()])
+        parts.append(part)
+        length += len(part)
+        tags.append((length, match.group()))
+        last = match.end()
+    parts.append(html.unescape(text[last:]))
+
+    return "".join(parts), tuple(tags)
+
+
+def sub_with_tags(regex, replacement:str, text:str, tags:tuple) -> tuple:
+    '''
+    Replaces the matches of a regex in a plain text and moves the tag positions along with the text.
+
+    Tags inside a replaced part are moved to its start, returns the new text and tags.
+    '''
+    parts = []
+    spans = []
+    last = 0
+    length = 0
+    for match in regex.finditer(text):
+        parts.append(text[last:match.start()])
+        length += match.start() - last
+        parts.append(replacement)
+        spans.append((match.start(), match.end(), length, length + len(replacement)))
+        length += len(replacement)
+        last = match.end()
+    parts.append(text[last:])
+
+    def move(position):
+        shift = 0
+        for start, end, new_start, new_end in spans:
+            if position <= start:
+                break
+            if position < end:
+                return new_start
+            shift = new_end - end
+        return position + shift
+
+    return "".join(parts), tuple((move(position), tag) for position, tag in tags)
+
+
+def strip_with_tags(text:str, tags:tuple) -> tuple:
+    '''Strips the whitespace around a plain text, the tag positions are moved to the stripped text.'''
+    stripped = text.strip()
+    leading = len(text) - len(text.lstrip())
+    return stripped, tuple((min(max(position - leading, 0), len(stripped)), tag) for position, tag in tags)
+
+
+def restore_tags(text:str, tags:tuple, length:int) -> str:
+    '''
+    Puts the tags of an original subtitle of the given plain length back into its translation.
+
+    Tags at the start and at the end of the original wrap the whole translation. Tags inside the text
+    are moved to the word boundary at the same relative position of the translation, opening tags in
+    front of a word, closing tags after a word.
+    '''
+    if not tags:
+        return text
+
+    prefix = "".join(tag for position, tag in tags if position <= 0)
+    suffix = "".join(tag for position, tag in tags if position >= length)
+    inner = [(position, tag) for position, tag in tags if 0 < position < length]
+
+    if inner and text:
+        starts = [match.start() for match in word_start_regex.finditer(text)] or [0]
+        ends = [match.end() for match in word_end_regex.finditer(text)] or [len(text)]
+
+        insertions = []
+        previous = 0
+        for position, tag in inner:
+            target = position * len(text) / length
+            candidates = ends if tag.startswith("</") else starts
+            # keep the order of the tags, a closing tag never moves in front of its opening tag
+            candidates = [candidate for candidate in candidates if candidate >= previous] or [len(text)]
+            previous = min(candidates, key=lambda candidate: abs(candidate - target))
+            insertions.append((previous, tag))
+
+        parts = []
+        last = 0
+        for position, tag in insertions:
+            parts.append(text[last:position])
+            parts.append(tag)
+            last = position
+        parts.append(text[last:])
+        text = "".join(parts)
+
+    return prefix + text + suffix
@@ -0,0 +1,42 @@
+import os
+import sys
+
+import pytest
+
+# the modules live flat in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backends import StubBackend  # noqa: E402
+from GptSrtTranslator import GptSrtTranslator  # noqa: E402
+from metrics import Metrics  # noqa: E402
+from ratelimiter import RateLimiter  # noqa: E402
+from srtparser import format_time_range  # noqa: E402
+
+
+def write_srt(file_name, texts):
+    '''Writes an srt file with a subtitle of every text, three seconds apart.'''
+    with open(file_name, 'w', encoding="utf8") as file:
+        for index, text in enumerate(texts, 1):
+            file.write(f"{index}\n{format_time_range(index * 3000, index * 3000 + 2500)}\n{text}\n\n")
+    return str(file_name)
+
+
+def read_texts(file_name):
+    '''Returns the text of every subtitle of an srt file.'''
+    with open(file_name, 'r', encoding="utf8") as file:
+        blocks = file.read().strip().split("\n\n")
+    return ["\n".join(block.split("\n")[2:]) for block in blocks]
+
+
+@pytest.fixture
+def new_translator(tmp_path):
+    '''Returns a factory of translators sending to the stub backend, with their own limiter and metrics.'''
+    def factory(input_file, **kwargs):
+        kwargs.setdefault("backend", StubBackend())
+        kwargs.setdefault("output_file", str(tmp_path / "output.srt"))
+        kwargs.setdefault("output_language", "Hungarian")
+        return GptSrtTranslator(input_file=input_file,
+                                rate_limiter=RateLimiter(requests_per_minute=10**9, tokens_per_minute=10**12),
+                                metrics=Metrics(),
+                                **kwargs)
+    return factory
@@ -0,0 +1,49 @@
+from aligner import Aligner
+from backends import Completion, StubBackend
+from conftest import write_srt
+from translationmemory import TranslationMemory
+
+ORIGINAL = ["[00:00:01,000 --> 00:00:02,000] Hello.",
+            "[00:00:03,000 --> 00:00:04,000] How are you?",
+            "[00:00:05,000 --> 00:00:06,000] Fine, thanks."]
+
+
+def test_missing_line_between_anchors_is_certain():
+    aligned, confidence = Aligner(ORIGINAL, ["[00:00:01,000 --> 00:00:02,000] Szia.",
+                                             "[00:00:05,000 --> 00:00:06,000] Jól, köszönöm."]).auto_align()
+
+    assert aligned == ["[00:00:01,000 --> 00:00:02,000] Szia.", "",
+                       "[00:00:05,000 --> 00:00:06,000] Jól, köszönöm."]
+    assert confidence == 1.0
+
+
+def test_lines_without_timestamps_are_placed_by_punctuation():
+    aligned, confidence = Aligner(ORIGINAL, ["Szia.", "Hogy vagy?"]).auto_align()
+
+    assert aligned == ["[00:00:01,000 --> 00:00:02,000] Szia.",
+                       "[00:00:03,000 --> 00:00:04,000] Hogy vagy?", ""]
+    assert 0 < confidence < 1
+
+
+def test_empty_translation_has_no_confidence():
+    assert Aligner(ORIGINAL, []).auto_align() == (["", "", ""], 0.0)
+
+
+class ShiftingBackend(StubBackend):
+    # drops the first line and the timestamps, the rest can only be placed by guessing
+    def complete(self, request):
+        completion = super().complete(request)
+        lines = [line.split("] ", 1)[1] for line in completion.content.strip().split("\n")[1:]]
+        return Completion("\n".join(lines), completion.usage)
+
+
+def test_review_slices_are_not_put_into_the_translation_memory(tmp_path, new_translator):
+    input_file = write_srt(tmp_path / "input.srt", ["Yes.", "What are you doing here in the middle of the night?", "Nothing."])
+    memory = TranslationMemory(str(tmp_path / "memory.sqlite"))
+
+    translator = new_translator(input_file, backend=ShiftingBackend(), max_retries=0, translation_memory=memory)
+    translator.translate()
+
+    assert translator.review
+    assert memory.get("Nothing.", translator.input_language, translator.output_language, translator.model_engine) is None
+    assert memory.get("Yes.", translator.input_language, translator.output_language, translator.model_engine) is None
@@ -0,0 +1,117 @@
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from backends import BackendError, Completion, OpenAIBackend, StubBackend
+from conftest import write_srt
+
+REQUEST = {"model": "gpt-3.5-turbo", "messages": [{"role": "user", "content": "Target language: German"}]}
+
+
+@pytest.fixture
+def answering():
+    '''Serves the given body with status 200 for every request, returns the base url.'''
+    servers = []
+
+    def serve(body):
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers["Content-Length"]))
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=server.serve_forever, args=(0.01,), daemon=True).start()
+        servers.append(server)
+        return f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+    yield serve
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.mark.parametrize("body", [
+    b"<html>Bad gateway</html>",
+    b'{"error": "overloaded"}',
+    json.dumps({"choices": [{"message": {"content": None}, "finish_reason": "content_filter"}]}).encode(),
+])
+def test_invalid_answers_raise_backend_error(answering, body):
+    backend = OpenAIBackend("key", answering(body))
+    with pytest.raises(BackendError):
+        backend.complete(REQUEST)
+    backend.close()
+
+
+def test_invalid_answer_fails_only_the_slice(tmp_path, answering, new_translator):
+    input_file = write_srt(tmp_path / "input.srt", ["Hello.", "Bye."])
+    backend = OpenAIBackend("key", answering(b"<html>Bad gateway</html>"))
+
+    translator = new_translator(input_file, backend=backend, max_retries=1)
+    translator.rate_limiter.backoff_start = 0
+    translator.translate()
+
+    assert translator.failed_slices == 1
+    backend.close()
+
+
+class RejectingBackend(StubBackend):
+    # fails every request with the given status
+    def __init__(self, status):
+        super().__init__()
+        self.status = status
+
+    def complete(self, request):
+        self.requests += 1
+        raise BackendError(f"HTTP {self.status}: rejected", self.status)
+
+
+def test_client_errors_are_not_retried_nor_penalized(tmp_path, new_translator):
+    input_file = write_srt(tmp_path / "input.srt", ["Hello.", "Bye."])
+    backend = RejectingBackend(400)
+
+    translator = new_translator(input_file, backend=backend, max_retries=3)
+    translator.translate()
+
+    assert translator.failed_slices == 1
+    assert backend.requests == 1
+    assert translator.rate_limiter.blocked_until == 0
+
+
+def test_rate_limit_errors_are_retried(tmp_path, new_translator):
+    input_file = write_srt(tmp_path / "input.srt", ["Hello.", "Bye."])
+    backend = RejectingBackend(429)
+
+    translator = new_translator(input_file, backend=backend, max_retries=2)
+    translator.rate_limiter.backoff_start = 0
+    translator.translate()
+
+    assert backend.requests == 3
+    assert translator.rate_limiter.errors == 3
+
+
+def test_translate_batch_returns_a_result_for_every_request():
+    backend = StubBackend(latency=0.01, error_rate=0.5, seed=1)
+    requests = [{"model": "gpt-3.5-turbo", "messages": [{"role": "user", "content": f"Target language: German\n[00:00:0{number},000 --> 00:00:0{number},500] Line {number}."}]}
+                for number in range(8)]
+
+    results = asyncio.run(backend.translate_batch(requests))
+
+    assert len(results) == len(requests)
+    assert backend.errors and backend.errors < len(requests)
+    for number, result in enumerate(results):
+        if isinstance(result, BackendError):
+            assert result.status == 429
+        else:
+            assert isinstance(result, Completion)
+            assert f"Line {number}." in result.content
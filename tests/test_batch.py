@@ -0,0 +1,36 @@
+import pytest
+
+from batch import BatchTranslator
+from conftest import read_texts, write_srt
+from fakeopenai import FakeOpenAI
+from translationmemory import TranslationMemory
+
+TEXTS = ["Hello there.", "How are you?", "Fine, thanks."]
+
+
+@pytest.fixture
+def fake():
+    fake = FakeOpenAI().start()
+    yield fake
+    fake.stop()
+
+
+def test_batch_through_the_fake_api(tmp_path, fake, new_translator):
+    input_file = write_srt(tmp_path / "input.srt", TEXTS)
+    translator = new_translator(input_file, api_base=fake.api_base, slice_length=2)
+
+    batch = BatchTranslator([translator], poll_interval=0, requests_file=str(tmp_path / "requests.jsonl")).run()
+
+    assert batch["status"] == "completed"
+    assert read_texts(translator.output_file) == [f"(Hungarian) {text}" for text in TEXTS]
+
+
+def test_batch_saves_files_covered_by_the_translation_memory(tmp_path, new_translator):
+    input_file = write_srt(tmp_path / "input.srt", TEXTS)
+    memory = TranslationMemory(str(tmp_path / "memory.sqlite"))
+    translator = new_translator(input_file, translation_memory=memory)
+    for text in TEXTS:
+        memory.put(text, translator.input_language, translator.output_language, translator.model_engine, f"[{text}]")
+
+    assert BatchTranslator([translator], requests_file=str(tmp_path / "requests.jsonl")).run() is None
+    assert read_texts(translator.output_file) == [f"[{text}]" for text in TEXTS]
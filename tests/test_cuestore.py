@@ -0,0 +1,49 @@
+from cuestore import CueStore
+
+
+def new_store(times):
+    cues = CueStore()
+    for start, end in times:
+        cues.append(start, end, f"From {start} to {end}.")
+    return cues
+
+
+def test_find_by_start():
+    cues = new_store([(1000, 2000), (3000, 4000), (3000, 3500), (5000, 6000)])
+
+    assert cues.find_by_start(3000) == [2, 3]
+    assert cues.find_by_start(5000) == [4]
+    assert cues.find_by_start(2500) == []
+
+
+def test_find_by_start_out_of_order():
+    cues = new_store([(5000, 6000), (1000, 2000), (3000, 4000), (1000, 1500)])
+
+    assert cues.find_by_start(1000) == [2, 4]
+    assert cues.find_by_start(5000) == [1]
+    # a new subtitle drops the sorted order built for the lookups
+    cues.append(0, 500, "First.")
+    assert cues.find_by_start(0) == [5]
+
+
+def test_find_at():
+    # the long second subtitle is still shown when the third one starts
+    cues = new_store([(1000, 2000), (3000, 9000), (4000, 5000), (10000, 11000)])
+
+    assert cues.find_at(500) is None
+    assert cues.find_at(1000) == 1
+    assert cues.find_at(2000) is None
+    assert cues.find_at(3500) == 2
+    assert cues.find_at(4500) == 3
+    assert cues.find_at(6000) == 2
+    assert cues.find_at(9500) is None
+    assert cues.find_at(10999) == 4
+    assert cues.find_at(20000) is None
+
+
+def test_find_at_out_of_order():
+    cues = new_store([(4000, 5000), (1000, 2000), (3000, 9000)])
+
+    assert cues.find_at(4500) == 1
+    assert cues.find_at(1500) == 2
+    assert cues.find_at(6000) == 3
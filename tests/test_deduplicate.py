@@ -0,0 +1,64 @@
+from backends import StubBackend
+from conftest import read_texts, write_srt
+from test_journal import FailingBackend
+from translationmemory import TranslationMemory
+
+TEXTS = ["Yes.", "Where are you going?", "<i>Yes.</i>", "Home.", "Where are  you going?", "Yes.",
+         "Line number 7.", "Line number 8.", "Yes.", "Line number 10."]
+EXPECTED = ["(Hungarian) Yes.", "(Hungarian) Where are you going?", "<i>(Hungarian) Yes.</i>", "(Hungarian) Home.",
+            "(Hungarian) Where are you going?", "(Hungarian) Yes.", "(Hungarian) Line number 7.",
+            "(Hungarian) Line number 8.", "(Hungarian) Yes.", "(Hungarian) Line number 10."]
+
+
+class RecordingBackend(StubBackend):
+    # keeps the user prompts of the requests
+    def __init__(self):
+        super().__init__()
+        self.prompts = []
+
+    def complete(self, request):
+        self.prompts.append(request["messages"][-1]["content"])
+        return super().complete(request)
+
+
+def test_repeated_subtitles_are_sent_once_and_copied(tmp_path, new_translator):
+    backend = RecordingBackend()
+    translator = new_translator(write_srt(tmp_path / "input.srt", TEXTS), backend=backend, deduplicate=True)
+    translator.translate()
+
+    prompt = "".join(backend.prompts)
+    assert prompt.count("Yes.") == 1
+    assert prompt.count("you going?") == 1
+    assert translator.copies == {1: [3, 6, 9], 2: [5]}
+    # every copy keeps its own formatting
+    assert read_texts(translator.output_file) == EXPECTED
+
+
+def test_repeated_subtitles_from_the_translation_memory(tmp_path, new_translator):
+    memory = TranslationMemory(str(tmp_path / "memory.sqlite"))
+    backend = RecordingBackend()
+    translator = new_translator(write_srt(tmp_path / "input.srt", TEXTS), backend=backend, deduplicate=True,
+                                translation_memory=memory)
+    memory.put("Yes.", translator.input_language, translator.output_language, translator.model_engine, "(Hungarian) Yes.")
+    translator.translate()
+
+    assert "Yes." not in "".join(backend.prompts)
+    assert read_texts(translator.output_file) == EXPECTED
+    # the first occurrence of a repeated text is put into the memory once
+    assert memory.size == 6
+
+
+def test_copies_are_kept_when_resuming(tmp_path, new_translator):
+    input_file = write_srt(tmp_path / "input.srt", TEXTS)
+
+    first = new_translator(input_file, backend=FailingBackend(1), deduplicate=True, slice_length=3, max_retries=0)
+    first.translate()
+    assert first.failed_slices
+
+    backend = RecordingBackend()
+    second = new_translator(input_file, backend=backend, deduplicate=True, slice_length=3)
+    second.translate()
+
+    # the copies of the subtitles finished in the first run are not sent again
+    assert "Yes." not in "".join(backend.prompts)
+    assert read_texts(second.output_file) == EXPECTED
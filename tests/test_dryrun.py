@@ -0,0 +1,41 @@
+from backends import StubBackend
+from conftest import write_srt
+from metrics import Metrics
+from multilanguage import MultiLanguageTranslator
+from ratelimiter import RateLimiter
+from translationmemory import TranslationMemory
+
+TEXTS = [f"Line number {index}." for index in range(1, 11)]
+
+
+def test_dry_run_has_no_side_effects(tmp_path, new_translator):
+    input_file = write_srt(tmp_path / "input.srt", TEXTS)
+    memory = TranslationMemory(str(tmp_path / "memory.sqlite"))
+    translator = new_translator(input_file, slice_length=4, translation_memory=memory)
+    memory.put(TEXTS[0], translator.input_language, translator.output_language, translator.model_engine, "Első sor.")
+    used = memory.connection.execute("SELECT last_used FROM memory").fetchall()
+
+    plan = translator.dry_run()
+
+    assert plan["to_translate"] == len(TEXTS) - 1
+    assert (memory.hits, memory.misses) == (0, 0)
+    assert memory.connection.execute("SELECT last_used FROM memory").fetchall() == used
+    assert not translator.cues.translated(1)
+
+
+def test_dry_run_counts_the_languages_of_a_request_once(tmp_path):
+    input_file = write_srt(tmp_path / "input.srt", TEXTS)
+
+    def plans(languages_per_request):
+        multi = MultiLanguageTranslator(["German", "French", "Czech"], input_file=input_file,
+                                        output_files=[str(tmp_path / f"{language}.srt") for language in "abc"],
+                                        languages_per_request=languages_per_request, slice_length=4,
+                                        backend=StubBackend(), metrics=Metrics(),
+                                        rate_limiter=RateLimiter(requests_per_minute=10**9, tokens_per_minute=10**12))
+        return multi.dry_run()
+
+    alone, together = plans(1), plans(3)
+
+    assert [plan["languages"] for plan in alone] == [["German"], ["French"], ["Czech"]]
+    assert [plan["languages"] for plan in together] == [["German", "French", "Czech"]]
+    assert sum(plan["requests"] for plan in together) * 3 == sum(plan["requests"] for plan in alone)
@@ -0,0 +1,56 @@
+import random
+import threading
+import time
+
+from backends import StubBackend
+from conftest import read_texts, write_srt
+
+TEXTS = [f"Line number {index}." for index in range(1, 61)]
+
+
+class JitterBackend(StubBackend):
+    # answers after a random delay, so the slices finish out of order, and fails a share of the requests
+    def __init__(self):
+        super().__init__(error_rate=0.2, retry_after=0, seed=3)
+        self.jitter = random.Random(5)
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def complete(self, request):
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            delay = self.jitter.uniform(0, 0.03)
+        try:
+            time.sleep(delay)
+            return super().complete(request)
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+
+class CountingProgress():
+    # stands in for the total progress bar of the pipeline
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.updates = []
+
+    def update(self, count):
+        with self.lock:
+            self.updates.append(count)
+
+
+def test_concurrent_slices_are_merged_in_order(tmp_path, new_translator):
+    backend = JitterBackend()
+    translator = new_translator(write_srt(tmp_path / "input.srt", TEXTS), backend=backend,
+                                slice_length=3, concurrency=6, max_retries=10)
+    translator.total_progress = progress = CountingProgress()
+    translator.translate()
+
+    assert backend.max_in_flight > 1
+    assert backend.errors
+    assert translator.failed_slices == 0
+    assert read_texts(translator.output_file) == [f"(Hungarian) {text}" for text in TEXTS]
+    # the finished slices moved the progress to the total, nothing was left for the final update
+    assert sum(progress.updates) == len(TEXTS)
+    assert progress.updates[-1] == 0
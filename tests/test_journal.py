@@ -0,0 +1,51 @@
+from backends import BackendError, StubBackend
+from conftest import read_texts, write_srt
+from translationmemory import TranslationMemory
+
+TEXTS = [f"Line number {index}." for index in range(1, 11)]
+
+
+class FailingBackend(StubBackend):
+    # answers the first requests, fails every later one like an interrupted run
+    def __init__(self, answered):
+        super().__init__()
+        self.answered = answered
+
+    def complete(self, request):
+        if self.requests >= self.answered:
+            self.requests += 1
+            raise BackendError("HTTP 500: stub failure", 500, 0)
+        return super().complete(request)
+
+
+def test_resume_sends_only_the_unfinished_slices(tmp_path, new_translator):
+    input_file = write_srt(tmp_path / "input.srt", TEXTS)
+
+    first = new_translator(input_file, backend=FailingBackend(1), slice_length=4, max_retries=0)
+    first.translate()
+    assert first.failed_slices == 2
+
+    backend = StubBackend()
+    second = new_translator(input_file, backend=backend, slice_length=4)
+    second.translate()
+
+    assert backend.requests == 2
+    assert read_texts(second.output_file) == [f"(Hungarian) {text}" for text in TEXTS]
+
+
+def test_resume_keeps_the_subtitles_of_the_translation_memory(tmp_path, new_translator):
+    input_file = write_srt(tmp_path / "input.srt", TEXTS)
+    memory = TranslationMemory(str(tmp_path / "memory.sqlite"))
+
+    first = new_translator(input_file, backend=FailingBackend(1), slice_length=4, max_retries=0,
+                           translation_memory=memory)
+    memory.put(TEXTS[2], first.input_language, first.output_language, first.model_engine, "Harmadik sor.")
+    first.translate()
+    assert first.failed_slices
+
+    second = new_translator(input_file, slice_length=4, translation_memory=memory)
+    second.translate()
+
+    texts = read_texts(second.output_file)
+    assert texts[2] == "Harmadik sor."
+    assert all(texts)
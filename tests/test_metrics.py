@@ -0,0 +1,34 @@
+from metrics import Metrics, PrometheusSink
+
+
+def record(latency, queue_wait=0.0):
+    return {"status": "ok", "attempt": 0, "queue_wait": queue_wait, "latency": latency,
+            "prompt_tokens": 10, "completion_tokens": 5, "aligned_lines": 0, "cost": 0.0}
+
+
+def test_latencies_are_sampled_within_the_limit():
+    metrics = Metrics(latency_samples=100)
+    for number in range(10000):
+        metrics.record(record(number / 10000, queue_wait=number % 3))
+
+    assert len(metrics.latencies) == 100
+    assert metrics.latency_count == 10000
+    assert 0.35 < metrics.percentile(metrics.latencies, 0.5) < 0.65
+    assert "queue wait avg 1.00 sec, max 2.00 sec" in metrics.summary()
+
+
+def test_prometheus_sink_renders_the_totals_of_the_metrics():
+    metrics = Metrics()
+    sink = PrometheusSink(metrics)
+    metrics.add_sink(sink)
+    for latency in (0.1, 0.3, 3):
+        metrics.record({**record(latency), "prefix_id": "system", "prefix_tokens": 150, "cached_tokens": 2})
+
+    text = sink.render()
+
+    assert 'gpt_srt_requests_total{status="ok"} 3' in text
+    assert 'gpt_srt_tokens_total{type="cached"} 6' in text
+    assert "gpt_srt_repeated_prefix_tokens_total 300" in text
+    assert 'gpt_srt_request_latency_seconds_bucket{le="0.5"} 2' in text
+    assert "gpt_srt_request_latency_seconds_count 3" in text
+    assert "6 prompt tokens cached by the provider, 300 tokens of repeated system prompts" in metrics.summary()
@@ -0,0 +1,113 @@
+import threading
+
+from backends import BackendError, Completion, StubBackend
+from conftest import read_texts, write_srt
+from metrics import Metrics
+from multilanguage import MultiLanguageTranslator, split_sections
+from pipeline import summary, translate_files
+from ratelimiter import RateLimiter
+
+TEXTS = [f"Line number {index}." for index in range(1, 9)]
+LANGUAGES = ["German", "French"]
+
+
+class CountingBackend(StubBackend):
+    # remembers how many requests were sent at the same time
+    def __init__(self):
+        super().__init__(latency=0.02)
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.counter_lock = threading.Lock()
+
+    def complete(self, request):
+        with self.counter_lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            return super().complete(request)
+        finally:
+            with self.counter_lock:
+                self.in_flight -= 1
+
+
+def new_multi(tmp_path, name, backend, **kwargs):
+    input_file = write_srt(tmp_path / f"{name}.srt", TEXTS)
+    return MultiLanguageTranslator(LANGUAGES, input_file=input_file,
+                                   output_files=[str(tmp_path / f"{name}.{language.lower()}.srt") for language in LANGUAGES],
+                                   backend=backend, metrics=Metrics(), slice_length=4,
+                                   rate_limiter=RateLimiter(requests_per_minute=10**9, tokens_per_minute=10**12),
+                                   **kwargs)
+
+
+def test_files_of_several_languages_are_translated_in_parallel(tmp_path):
+    backend = CountingBackend()
+    multis = [new_multi(tmp_path, name, backend, concurrency=1) for name in ("first", "second")]
+
+    translate_files(multis, parallel_files=2)
+
+    # one request at a time within a file, the two files overlap
+    assert backend.max_in_flight == 2
+    positions = sorted(translator.progress_position for multi in multis for translator in multi.translators)
+    assert positions == [1, 2, 3, 4]
+    for name in ("first", "second"):
+        for language in LANGUAGES:
+            assert read_texts(tmp_path / f"{name}.{language.lower()}.srt") == [f"({language}) {text}" for text in TEXTS]
+
+
+def test_summary_counts_files_and_languages(tmp_path):
+    multi = new_multi(tmp_path, "first", StubBackend())
+
+    assert summary(multi.translators, 1).startswith("1 file(s) into 2 languages, 16 subtitles")
+
+
+def test_split_sections():
+    text = "### German\n[1] (German) Hi.\n\n## french:\n[1] (French) Hi.\n### Klingon\n[1] Hi.\n### Czech\n\n"
+
+    # the unknown Klingon heading belongs to the French text, the empty Czech section is left out
+    assert split_sections(text, ["German", "French", "Czech"]) == {
+        "German": "[1] (German) Hi.",
+        "French": "[1] (French) Hi.\n### Klingon\n[1] Hi.",
+    }
+    assert split_sections("[1] Hi.", ["German"]) == {}
+
+
+class SectionBackend(StubBackend):
+    # leaves the French section out of the shared answers, or fails the shared requests with a client error
+    def __init__(self, status=None):
+        super().__init__()
+        self.status = status
+        self.shared = 0
+
+    def complete(self, request):
+        if "Target languages:" not in request["messages"][0]["content"]:
+            return super().complete(request)
+
+        self.shared += 1
+        if self.status:
+            raise BackendError(f"HTTP {self.status}: stub failure", self.status)
+        completion = super().complete(request)
+        return Completion(completion.content.split("### French")[0], completion.usage)
+
+
+def test_missing_language_of_a_shared_answer_is_translated_alone(tmp_path):
+    backend = SectionBackend()
+    multi = new_multi(tmp_path, "first", backend, languages_per_request=2)
+    multi.translate()
+
+    assert backend.shared == 2
+    # the two slices of French are sent again alone
+    assert backend.requests == 4
+    for language in LANGUAGES:
+        assert read_texts(tmp_path / f"first.{language.lower()}.srt") == [f"({language}) {text}" for text in TEXTS]
+
+
+def test_failed_shared_request_is_translated_alone(tmp_path):
+    backend = SectionBackend(status=400)
+    multi = new_multi(tmp_path, "first", backend, languages_per_request=2)
+    multi.translate()
+
+    # the client error is not retried, every language is sent alone
+    assert backend.shared == 2
+    assert backend.requests == 4
+    for language in LANGUAGES:
+        assert read_texts(tmp_path / f"first.{language.lower()}.srt") == [f"({language}) {text}" for text in TEXTS]
@@ -0,0 +1,43 @@
+import threading
+import time
+
+from pipeline import dry_run_report, translate_files
+
+
+class SleepingTranslator():
+    # stands in for a translator, checks that no running file shares the line of its progress bar
+    active = set()
+    lock = threading.Lock()
+
+    def __init__(self, duration):
+        self.duration = duration
+        self.cues = []
+        self.input_file = f"{duration}.srt"
+        self.progress_position = None
+        self.clash = False
+
+    def translate(self):
+        with self.lock:
+            self.clash = self.progress_position in self.active
+            self.active.add(self.progress_position)
+        time.sleep(self.duration)
+        with self.lock:
+            self.active.discard(self.progress_position)
+
+
+def test_finished_files_give_back_their_progress_line():
+    # the first file finishes last, the third file must not take the line of the running first one
+    translators = [SleepingTranslator(duration) for duration in (0.2, 0.02, 0.02, 0.02)]
+    translate_files(translators, parallel_files=2)
+
+    assert not any(translator.clash for translator in translators)
+    assert {translator.progress_position for translator in translators} == {1, 2}
+
+
+def test_dry_run_report_counts_the_reserved_tokens():
+    plan = {"file": "input.srt", "subtitles": 100, "to_translate": 100, "requests": 10,
+            "prompt_tokens": 10000, "completion_tokens": 10000, "reserved_tokens": 60000, "cost": 0.0}
+
+    # 20000 used tokens fit into the budget of the first minute, the reservations of 4 parallel requests do not
+    assert "Projected wall time: 0.0 min" in dry_run_report([{**plan, "reserved_tokens": 20000}], 3500, 30000, 4, 0)
+    assert "Projected wall time: 0.2 min" in dry_run_report([plan], 3500, 30000, 4, 0)
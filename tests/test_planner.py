@@ -0,0 +1,30 @@
+from conftest import write_srt
+
+TEXTS = [f"Line number {index}." for index in range(1, 21)] + ["♪ la la la ♪"]
+
+
+def test_slices_cover_every_subtitle(tmp_path, new_translator):
+    translator = new_translator(write_srt(tmp_path / "input.srt", TEXTS), slice_length=4)
+    translator.load_srt()
+    first, translatable = translator.translatable_indices()
+    slices = translator.get_slices()
+
+    assert len(slices) > 1
+    assert slices[0].start == first == 1
+    for previous, current in zip(slices, slices[1:]):
+        assert previous.end == current.start
+    # the skipped music subtitle at the end is covered by the last slice
+    assert slices[-1].end == len(translator.cues) + 1
+    assert [index for current in slices for index in current.indices] == translatable
+    assert len(translatable) == len(TEXTS) - 1
+
+
+def test_slices_start_after_the_finished_subtitles(tmp_path, new_translator):
+    translator = new_translator(write_srt(tmp_path / "input.srt", TEXTS), slice_length=4)
+    translator.load_srt()
+    translator.completed.update(range(1, 6))
+
+    slices = translator.get_slices()
+
+    assert slices[0].start == 6
+    assert slices[0].indices[0] == 6
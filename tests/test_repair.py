@@ -0,0 +1,40 @@
+from backends import Completion, StubBackend
+from conftest import read_texts, write_srt
+
+TEXTS = [f"Line number {index}." for index in range(1, 7)]
+
+
+class DroppingBackend(StubBackend):
+    # leaves out the translation of a subtitle from the slices, the repair requests are answered fully
+    def __init__(self, dropped):
+        super().__init__()
+        self.dropped = dropped
+        self.prompts = []
+
+    def complete(self, request):
+        completion = super().complete(request)
+        self.prompts.append(request["messages"][-1]["content"])
+        if len(self.prompts) > 1:
+            return completion
+        lines = [line for line in completion.content.split("\n") if self.dropped not in line]
+        return Completion("\n".join(lines), completion.usage)
+
+
+def test_find_damaged(tmp_path, new_translator):
+    translator = new_translator(write_srt(tmp_path / "input.srt", TEXTS))
+    translator.load_srt()
+    text = "".join(translator.subtitle_line(index) for index in (1, 2, 2, 4))
+
+    assert translator.find_damaged([1, 2, 3, 4], text) == [2, 3]
+
+
+def test_repair_sends_only_the_missing_subtitles(tmp_path, new_translator):
+    backend = DroppingBackend("Line number 4.")
+    translator = new_translator(write_srt(tmp_path / "input.srt", TEXTS), backend=backend, repair_context=1)
+    translator.translate()
+
+    assert len(backend.prompts) == 2
+    repair = backend.prompts[1]
+    assert all(f"Line number {index}." in repair for index in (3, 4, 5))
+    assert "Line number 1." not in repair and "Line number 6." not in repair
+    assert read_texts(translator.output_file) == [f"(Hungarian) {text}" for text in TEXTS]
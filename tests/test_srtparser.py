@@ -0,0 +1,34 @@
+import pytest
+
+from srtparser import Cue, parse_srt
+
+
+def test_crlf_and_bom():
+    text = "\ufeff1\r\n00:00:01,000 --> 00:00:02,500\r\nHello.\r\n\r\n2\r\n00:00:03,000 --> 00:00:04,000\r\nHow are\r\nyou?\r\n"
+
+    assert list(parse_srt(text.splitlines(keepends=True))) == [
+        Cue(1, 1000, 2500, "Hello."),
+        Cue(2, 3000, 4000, "How are\nyou?"),
+    ]
+
+
+def test_missing_numbers_and_empty_lines():
+    lines = ["00:00:01.000 --> 00:00:02.000 X1:0\n", "Hello.\n",
+             "7\n", "00:00:03,000 --> 00:00:04,000\n", "Bye.\n"]
+
+    assert list(parse_srt(lines)) == [Cue(None, 1000, 2000, "Hello."), Cue(7, 3000, 4000, "Bye.")]
+
+
+@pytest.mark.parametrize("lines", [
+    ["garbage before the first subtitle\n", "1\n", "00:00:01,000 --> 00:00:02,000\n", "Hello.\n"],
+    ["1\n", "00:00:01,000 --> 00:00:02,000\n", "Hello.\n", "--> is not a timestamp\n"],
+])
+def test_malformed_lines_are_text_or_ignored(lines):
+    cues = list(parse_srt(lines))
+
+    assert [(cue.start, cue.end) for cue in cues] == [(1000, 2000)]
+    assert cues[0].text.startswith("Hello.")
+
+
+def test_no_subtitles():
+    assert list(parse_srt(["not an srt file\n", "\n"])) == []
@@ -0,0 +1,42 @@
+import os
+
+import pytest
+
+from srtwriter import SrtWriter
+
+TIMESTAMP = "00:00:01,000 --> 00:00:02,000"
+
+
+def test_target_is_replaced_only_when_closed(tmp_path):
+    target = tmp_path / "output.srt"
+    target.write_text("old translation\n", encoding="utf8")
+
+    with SrtWriter(str(target)) as writer:
+        writer.write(1, TIMESTAMP, "Szia.")
+        writer.flush()
+        assert target.read_text(encoding="utf8") == "old translation\n"
+        assert (tmp_path / "output.srt.part").read_text(encoding="utf8") == f"1\n{TIMESTAMP}\nSzia.\n\n"
+
+    assert target.read_text(encoding="utf8") == f"1\n{TIMESTAMP}\nSzia.\n\n"
+    assert not os.path.exists(tmp_path / "output.srt.part")
+    assert writer.count == 1
+
+
+def test_abort_keeps_the_target_and_closes_the_partial_file(tmp_path):
+    target = tmp_path / "output.srt"
+    target.write_text("old translation\n", encoding="utf8")
+
+    with pytest.raises(KeyboardInterrupt):
+        with SrtWriter(str(target)) as writer:
+            writer.write(1, TIMESTAMP, "Szia.")
+            raise KeyboardInterrupt
+
+    assert writer.file.closed
+    assert target.read_text(encoding="utf8") == "old translation\n"
+    assert (tmp_path / "output.srt.part").read_text(encoding="utf8") == f"1\n{TIMESTAMP}\nSzia.\n\n"
+
+    # the next run starts the partial file again
+    with SrtWriter(str(target)) as writer:
+        writer.write(1, TIMESTAMP, "Hello.")
+    assert target.read_text(encoding="utf8") == f"1\n{TIMESTAMP}\nHello.\n\n"
+    assert not os.path.exists(tmp_path / "output.srt.part")
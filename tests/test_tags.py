@@ -0,0 +1,30 @@
+import pytest
+
+from conftest import read_texts, write_srt
+from tags import restore_tags, strip_tags
+
+
+@pytest.mark.parametrize("text, plain", [
+    ("<i>Hello there.</i>", "Hello there."),
+    ("Hello <b>big</b> world.", "Hello big world."),
+    ("<font color=\"#ffff00\">Tom &amp; Jerry</font>", "Tom & Jerry"),
+    ("No tags at all.", "No tags at all."),
+])
+def test_strip_and_restore_round_trip(text, plain):
+    stripped, tags = strip_tags(text)
+
+    assert stripped == plain
+    assert restore_tags(stripped, tags, len(stripped)) == text.replace("&amp;", "&")
+
+
+@pytest.mark.parametrize("text, expected", [
+    (" <i>Hi there.</i>", "<i>(Hungarian) Hi there.</i>"),
+    ("<i>[music] Hello.</i>", "<i>(Hungarian) Hello.</i>"),
+    ("<i>Hello.</i> [door slams]", "<i>(Hungarian) Hello.</i>"),
+])
+def test_tags_wrap_the_translation_of_a_sanitized_subtitle(tmp_path, new_translator, text, expected):
+    translator = new_translator(write_srt(tmp_path / "input.srt", [text]))
+    translator.translate()
+
+    assert translator.cues.original(1) == expected.replace("<i>", "").replace("</i>", "").replace("(Hungarian) ", "")
+    assert read_texts(translator.output_file) == [expected]
@@ -0,0 +1,60 @@
+import atexit
+import logging
+import queue
+
+from tracing import LazyQueueHandler, TraceWriter, configure_logging, split_timestamps
+
+
+def test_trace_writer_formats_and_truncates(tmp_path):
+    (tmp_path / "01-original.txt").write_text("from an earlier run\n", encoding="utf8")
+
+    writer = TraceWriter(str(tmp_path))
+    writer.write("01-original.txt", "[00:00:01,000 --> 00:00:02,000] Hello.")
+    writer.write("01-original.txt", "[00:00:03,000 --> 00:00:04,000] Bye.")
+    writer.close()
+    # closed writers drop the texts
+    writer.write("01-original.txt", "too late")
+
+    assert (tmp_path / "01-original.txt").read_text(encoding="utf8") == (
+        split_timestamps("[00:00:01,000 --> 00:00:02,000] Hello.") +
+        split_timestamps("[00:00:03,000 --> 00:00:04,000] Bye."))
+    assert split_timestamps("[00:00:01,000 --> 00:00:02,000] Hello.") == \
+        "[00:00:01,000 --> 00:00:02,000]\nHello.\n" + "-" * 40 + "\n"
+
+
+def test_lazy_queue_handler_formats_in_the_listener():
+    log_queue = queue.SimpleQueue()
+    logger = logging.getLogger("test_lazy_queue_handler")
+    logger.propagate = False
+    logger.addHandler(LazyQueueHandler(log_queue))
+
+    lines = ["first"]
+    logger.warning("%s and %s", lines, "second")
+    record = log_queue.get_nowait()
+
+    # the record is queued unformatted, the arguments are only joined by the listener
+    assert record.msg == "%s and %s"
+    assert record.args == (lines, "second")
+    assert record.getMessage() == "['first'] and second"
+
+
+def test_configure_logging_writes_the_log_file(tmp_path):
+    root = logging.getLogger()
+    handlers, level = list(root.handlers), root.level
+    try:
+        listener = configure_logging(str(tmp_path / "app.log"), logging.INFO)
+        logging.getLogger().debug("not written")
+        logging.getLogger().info("Sent %d lines", 12)
+        # the records are written when the listener stops
+        listener.stop()
+        atexit.unregister(listener.stop)
+    finally:
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        for handler in handlers:
+            root.addHandler(handler)
+        root.setLevel(level)
+
+    text = (tmp_path / "app.log").read_text(encoding="utf8")
+    assert "INFO" in text and "Sent 12 lines" in text
+    assert "not written" not in text
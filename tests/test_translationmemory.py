@@ -0,0 +1,42 @@
+from translationmemory import TranslationMemory
+
+KEY = ("English", "Hungarian", "gpt-3.5-turbo")
+
+
+def test_hits_misses_and_normalized_keys(tmp_path):
+    memory = TranslationMemory(str(tmp_path / "memory.sqlite"))
+    memory.put("Good  morning.\n", *KEY, "Jó reggelt.")
+
+    assert memory.get("Good morning.", *KEY) == "Jó reggelt."
+    assert memory.get("Good morning.", "English", "German", "gpt-3.5-turbo") is None
+    assert memory.get("Good evening.", *KEY) is None
+    assert (memory.hits, memory.misses) == (1, 2)
+    assert memory.stats() == "Translation memory: 1 hits, 2 misses (33.3% hit rate), 1 entries"
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    memory = TranslationMemory(str(tmp_path / "memory.sqlite"), max_entries=2)
+    memory.put("One.", *KEY, "Egy.")
+    memory.put("Two.", *KEY, "Kettő.")
+    # using the first entry makes the second one the least recently used
+    memory.get("One.", *KEY)
+    memory.put("Three.", *KEY, "Három.")
+
+    assert memory.size == 2
+    assert memory.get("Two.", *KEY) is None
+    assert memory.get("One.", *KEY) == "Egy."
+    assert memory.get("Three.", *KEY) == "Három."
+
+
+def test_entries_and_eviction_survive_a_restart(tmp_path):
+    file_name = str(tmp_path / "memory.sqlite")
+    memory = TranslationMemory(file_name)
+    for number in range(5):
+        memory.put(f"Line {number}.", *KEY, f"Sor {number}.")
+    memory.close()
+
+    reopened = TranslationMemory(file_name, max_entries=3)
+
+    assert reopened.size == 3
+    assert reopened.get("Line 0.", *KEY) is None
+    assert reopened.get("Line 4.", *KEY) == "Sor 4."
@@ -0,0 +1,84 @@
+import json
+import os
+import threading
+
+import pytest
+
+from backends import StubBackend
+from conftest import read_texts, write_srt
+from GptSrtTranslator import GptSrtTranslator
+from metrics import Metrics
+from ratelimiter import RateLimiter
+from worker import PriorityExecutor, TranslationWorker, submit_job
+
+
+def run_worker(spool, monkeypatch):
+    monkeypatch.setattr(GptSrtTranslator, "BACKEND", StubBackend())
+    monkeypatch.setattr(GptSrtTranslator, "RATE_LIMITER", RateLimiter(requests_per_minute=10**9, tokens_per_minute=10**12))
+    monkeypatch.setattr(GptSrtTranslator, "METRICS", Metrics())
+    TranslationWorker(str(spool), poll_interval=0.01).run(once=True)
+
+
+def test_job_of_a_single_output_language(tmp_path, monkeypatch):
+    input_file = write_srt(tmp_path / "input.srt", ["Hello.", "Bye."])
+    spool = tmp_path / "spool"
+    name = submit_job(str(spool), input_file, input_language="english", output_language="English",
+                      output_languages=["German"])
+
+    run_worker(spool, monkeypatch)
+
+    assert os.path.exists(spool / "done" / f"{name}.json")
+    assert read_texts(tmp_path / "input.german.srt") == ["(German) Hello.", "(German) Bye."]
+
+
+def test_jobs_submitted_while_the_worker_runs_are_queued(tmp_path, monkeypatch):
+    spool = tmp_path / "spool"
+    worker = TranslationWorker(str(spool), poll_interval=0.01)
+    monkeypatch.setattr(worker, "poll", lambda: 0)
+    thread = threading.Thread(target=worker.run)
+    thread.start()
+
+    name = submit_job(str(spool), write_srt(tmp_path / "input.srt", ["Hello."]), priority=3,
+                      input_language="english", output_language="German")
+    with open(spool / "status" / f"{name}.json", encoding="utf8") as file:
+        status = json.load(file)
+    worker.stop()
+    thread.join()
+
+    assert (status["state"], status["priority"]) == ("queued", 3)
+
+
+def test_second_worker_does_not_take_over_the_spool(tmp_path):
+    spool = tmp_path / "spool"
+    first = TranslationWorker(str(spool))
+    first.lock_spool()
+    (spool / "running" / "job.json").write_text("{}")
+
+    with pytest.raises(RuntimeError):
+        TranslationWorker(str(spool)).run(once=True)
+    assert (spool / "running" / "job.json").exists()
+
+    first.unlock_spool()
+
+
+def test_slices_of_urgent_jobs_overtake_the_waiting_ones():
+    executor = PriorityExecutor(1)
+    started = threading.Event()
+    release = threading.Event()
+    order = []
+
+    def block():
+        started.set()
+        release.wait()
+
+    executor.submit(block)
+    started.wait()
+    low = [executor.for_priority(0).submit(order.append, f"low {number}") for number in range(3)]
+    high = executor.for_priority(5).submit(order.append, "high")
+    release.set()
+
+    for future in low + [high]:
+        future.result()
+    executor.shutdown()
+
+    assert order == ["high", "low 0", "low 1", "low 2"]
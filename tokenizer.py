@@ -0,0 +1,41 @@
+import logging
+import re
+from functools import lru_cache
+
+logger = logging.getLogger()
+
+# words, numbers and single punctuation characters are roughly one token each
+word_regex = re.compile(r"\w+|[^\w\s]")
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model_engine:str):
+    '''Returns the tiktoken encoding of the model, or None when tiktoken or its encoding files are not available.'''
+    # imported on the first count, it takes longer to load than the rest of the translator
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+
+    try:
+        try:
+            return tiktoken.encoding_for_model(model_engine)
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        logger.warning("tiktoken encoding is not available, estimating token counts: %s", e)
+        return None
+
+
+def estimate_tokens(text:str) -> int:
+    # long words and non latin scripts are split into several tokens, about 4 bytes of utf8 each
+    words = word_regex.findall(text)
+    return max(len(words), (len(text.encode("utf8")) + 3) // 4)
+
+
+def count_tokens(text:str, model_engine:str="gpt-3.5-turbo") -> int:
+    '''Counts the tokens of a text offline, exactly with tiktoken or with an estimate without it.'''
+    encoding = get_encoding(model_engine)
+    if encoding is None:
+        return estimate_tokens(text)
+    return len(encoding.encode(text))
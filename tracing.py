@@ -0,0 +1,143 @@
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+
+logger = logging.getLogger()
+
+LOG_FORMAT = '%(asctime)s %(levelname)s %(module)-12s %(message)s'
+
+
+class TqdmLoggingHandler(logging.Handler):
+    def __init__(self, level=logging.NOTSET):
+        super().__init__(level)
+
+    def emit(self, record):
+        from tqdm import tqdm
+
+        try:
+            msg = self.format(record)
+            tqdm.write(msg)
+            self.flush()
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except:
+            self.handleError(record)
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    '''
+    Puts the log records into a queue without formatting them.
+
+    The message is formatted by the listener thread, so a debug record of a whole prompt costs only a
+    queue put on the request thread. The arguments of a record must not be changed after logging it.
+    '''
+
+    def prepare(self, record):
+        return record
+
+
+def configure_logging(log_file:str="app.log", level:int=logging.DEBUG,
+                      console_level:int=logging.WARNING) -> logging.handlers.QueueListener:
+    '''
+    Sends the records of the root logger through a queue to a background thread writing the log file and the console.
+
+    The log file is truncated and kept open for the whole run, without a log file only the console
+    gets the records. Returns the listener, it is stopped at exit and the queued records are written.
+    '''
+    handlers = [TqdmLoggingHandler(level=console_level)]
+    if log_file:
+        file_handler = logging.FileHandler(log_file, mode='w', encoding="utf8")
+        file_handler.setLevel(level)
+        file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        handlers.append(file_handler)
+
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(LazyQueueHandler(log_queue))
+    root.setLevel(min(level, console_level) if log_file else console_level)
+    return listener
+
+
+def split_timestamps(text:str) -> str:
+    # write the timestamp and the text into separate lines for easier comparison
+    lines = []
+    for line in text.split('\n'):
+        if ']' in line:
+            idx = line.index(']') + 1
+            lines.append(line[:idx].strip())
+            line = line[idx:].strip()
+        lines.append(line)
+    return "\n".join(lines).strip() + "\n" + "-"*40 + "\n"
+
+
+class TraceWriter():
+    '''
+    Writes the trace files of the translation, like the original and the translated text of every slice, from a background thread.
+
+    Every trace file is opened once, truncated on the first write of the run, and kept open until
+    close. The texts are formatted by the writer thread, the translation threads only queue them.
+    '''
+
+    _shared = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, directory:str=".", formatter=split_timestamps) -> None:
+        self.directory = directory
+        self.formatter = formatter
+        self.files = {}
+        self.queue = queue.SimpleQueue()
+        self.closed = False
+        self.thread = threading.Thread(target=self.run, name="TraceWriter", daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    @classmethod
+    def shared(cls, directory:str=".") -> "TraceWriter":
+        '''Returns the trace writer of the directory, it is created on first use and shared in the process.'''
+        with cls._shared_lock:
+            if directory not in cls._shared:
+                cls._shared[directory] = cls(directory)
+            return cls._shared[directory]
+
+    def write(self, file_name:str, text:str) -> None:
+        if not self.closed:
+            self.queue.put((file_name, text))
+
+    def run(self) -> None:
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+
+            file_name, text = item
+            try:
+                if file_name not in self.files:
+                    self.files[file_name] = open(os.path.join(self.directory, file_name), mode='w', encoding="utf8")
+                file = self.files[file_name]
+                file.write(self.formatter(text))
+                # flush when the queue is drained, the trace can be followed while the translation runs
+                if self.queue.empty():
+                    for file in self.files.values():
+                        file.flush()
+            except Exception as e:
+                logger.warning("Trace file %s could not be written: %s", file_name, e)
+
+    def close(self) -> None:
+        '''Writes the queued texts and closes the files.'''
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.put(None)
+        self.thread.join()
+        for file in self.files.values():
+            file.close()
+        self.files = {}
@@ -0,0 +1,133 @@
+import logging
+import re
+import sqlite3
+import threading
+
+logger = logging.getLogger()
+
+MAX_ENTRIES = 100000
+
+class TranslationMemory():
+    '''
+    Persistent cache of translated subtitles, stored in an SQLite database.
+
+    Entries are keyed by the normalized original text, the languages and the model engine. When the
+    cache grows over max_entries the least recently used entries are evicted.
+    '''
+
+    whitespace_regex = re.compile(r"\s+")
+
+    def __init__(self, file_name:str="translation_memory.sqlite", max_entries:int=MAX_ENTRIES) -> None:
+        self.file_name = file_name
+        self.max_entries = max_entries
+
+        self.hits = 0
+        self.misses = 0
+
+        # the same memory is used by every translator of the process
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(file_name, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute('''
+            CREATE TABLE IF NOT EXISTS memory (
+                original TEXT NOT NULL,
+                input_language TEXT NOT NULL,
+                output_language TEXT NOT NULL,
+                model_engine TEXT NOT NULL,
+                translated TEXT NOT NULL,
+                last_used INTEGER NOT NULL,
+                PRIMARY KEY (original, input_language, output_language, model_engine)
+            )''')
+        self.connection.execute("CREATE INDEX IF NOT EXISTS memory_last_used ON memory (last_used)")
+        self.connection.commit()
+
+        self.clock = self.connection.execute("SELECT COALESCE(MAX(last_used), 0) FROM memory").fetchone()[0]
+        self.size = self.connection.execute("SELECT COUNT(*) FROM memory").fetchone()[0]
+
+        if self.size > self.max_entries:
+            self.evict(self.size - self.max_entries)
+            self.connection.commit()
+
+    def normalize(self, text:str) -> str:
+        return self.whitespace_regex.sub(" ", text).strip()
+
+    def key(self, original:str, input_language:str, output_language:str, model_engine:str) -> tuple:
+        return (self.normalize(original), input_language.lower(), output_language.lower(), model_engine)
+
+    def get(self, original:str, input_language:str, output_language:str, model_engine:str) -> str:
+        '''Returns the cached translation or None.'''
+        key = self.key(original, input_language, output_language, model_engine)
+
+        with self.lock:
+            row = self.connection.execute('''
+                SELECT translated FROM memory
+                WHERE original = ? AND input_language = ? AND output_language = ? AND model_engine = ?''',
+                key).fetchone()
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self.clock += 1
+            self.connection.execute('''
+                UPDATE memory SET last_used = ?
+                WHERE original = ? AND input_language = ? AND output_language = ? AND model_engine = ?''',
+                (self.clock, *key))
+            self.connection.commit()
+
+        return row[0]
+
+    def contains(self, original:str, input_language:str, output_language:str, model_engine:str) -> bool:
+        '''Tells whether a translation is cached, without counting a hit or a miss and without marking it used.'''
+        key = self.key(original, input_language, output_language, model_engine)
+
+        with self.lock:
+            row = self.connection.execute('''
+                SELECT 1 FROM memory
+                WHERE original = ? AND input_language = ? AND output_language = ? AND model_engine = ?''',
+                key).fetchone()
+        return row is not None
+
+    def put(self, original:str, input_language:str, output_language:str, model_engine:str, translated:str) -> None:
+        key = self.key(original, input_language, output_language, model_engine)
+        if not key[0] or not translated:
+            return
+
+        with self.lock:
+            self.clock += 1
+            cursor = self.connection.execute('''
+                UPDATE memory SET translated = ?, last_used = ?
+                WHERE original = ? AND input_language = ? AND output_language = ? AND model_engine = ?''',
+                (translated, self.clock, *key))
+            if cursor.rowcount == 0:
+                self.connection.execute('''
+                    INSERT INTO memory
+                    (original, input_language, output_language, model_engine, translated, last_used)
+                    VALUES (?, ?, ?, ?, ?, ?)''',
+                    (*key, translated, self.clock))
+                self.size += 1
+
+            if self.size > self.max_entries:
+                self.evict(self.size - self.max_entries)
+
+            self.connection.commit()
+
+    def evict(self, count:int) -> None:
+        # remove the least recently used entries, called with the lock held
+        logger.debug("Translation memory: evicting %d entries", count)
+        self.connection.execute('''
+            DELETE FROM memory WHERE rowid IN (
+                SELECT rowid FROM memory ORDER BY last_used LIMIT ?
+            )''', (count,))
+        self.size -= count
+
+    def stats(self) -> str:
+        lookups = self.hits + self.misses
+        ratio = self.hits / lookups * 100 if lookups else 0
+        return f"Translation memory: {self.hits} hits, {self.misses} misses ({ratio:.1f}% hit rate), {self.size} entries"
+
+    def close(self) -> None:
+        with self.lock:
+            self.connection.close()
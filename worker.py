@@ -0,0 +1,365 @@
+import argparse
+import itertools
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+from pipeline import add_service_arguments, output_file_name, setup_services
+
+logger = logging.getLogger()
+
+# job options handed to the translators, everything else in a job file is ignored
+JOB_OPTIONS = ("input_language", "output_language", "slice_tokens", "slice_length", "context_lines", "deduplicate",
+               "subtitle_line_max_length", "model_engine", "max_tokens", "output_token_ratio", "alignment_threshold")
+
+
+def write_json(file_name:str, data:dict) -> None:
+    '''Writes a JSON file atomically, readers see the old or the new content, never a partial one.'''
+    temp_file_name = f"{file_name}.{uuid.uuid4().hex}.tmp"
+    with open(temp_file_name, 'w', encoding="utf8") as file:
+        json.dump(data, file, ensure_ascii=False, indent=2)
+    os.replace(temp_file_name, file_name)
+
+
+def update_status(spool:str, name:str, job:dict, state:str, **fields) -> None:
+    '''Updates the status file of a job in the spool directory, the fields of the earlier states are kept.'''
+    status_file = os.path.join(spool, "status", name + ".json")
+    status = {}
+    if os.path.exists(status_file):
+        with open(status_file, 'r', encoding="utf8") as file:
+            status = json.load(file)
+    status.update(job=name, input_file=job.get("input_file"), priority=job.get("priority", 0), state=state,
+                  updated=time.time(), **fields)
+    write_json(status_file, status)
+
+
+def submit_job(spool:str, input_file:str, priority:int=0, **options) -> str:
+    '''
+    Drops a translation job into the spool directory of a worker, returns the name of the job.
+
+    Jobs with a higher priority are started first, jobs of the same priority in the order of submission.
+    options are the output_file, or output_languages and output_dir for several languages, and the
+    translator arguments listed in JOB_OPTIONS.
+    '''
+    name = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+    os.makedirs(os.path.join(spool, "queue"), exist_ok=True)
+    os.makedirs(os.path.join(spool, "status"), exist_ok=True)
+    job = dict(options, input_file=os.path.abspath(input_file), priority=priority, submitted=time.time())
+    # the status comes first, a running worker may pick the job up as soon as its file is in the queue
+    update_status(spool, name, job, "queued")
+    write_json(os.path.join(spool, "queue", name + ".json"), job)
+    return name
+
+
+class PriorityExecutor():
+    '''
+    Thread pool running the submitted calls by priority, calls of the same priority in the order of submission.
+
+    The jobs of the worker submit their slices through the view of their priority, so the slices of an
+    urgent job overtake the waiting slices of the jobs started earlier.
+    '''
+
+    def __init__(self, max_workers:int) -> None:
+        self.queue = queue.PriorityQueue()
+        self.sequence = itertools.count()
+        self.threads = [threading.Thread(target=self.run, name=f"PriorityExecutor-{number}", daemon=True)
+                        for number in range(max_workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, function, *args, priority:int=0, **kwargs) -> Future:
+        future = Future()
+        # the sequence number is unique, the futures are never compared
+        self.queue.put((-priority, next(self.sequence), future, function, args, kwargs))
+        return future
+
+    def for_priority(self, priority:int) -> "PriorityView":
+        return PriorityView(self, priority)
+
+    def run(self) -> None:
+        while True:
+            _, _, future, function, args, kwargs = self.queue.get()
+            if future is None:
+                break
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(function(*args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+
+    def shutdown(self, wait:bool=True) -> None:
+        # the stop marks are sorted after every waiting call
+        for _ in self.threads:
+            self.queue.put((float("inf"), next(self.sequence), None, None, None, None))
+        if wait:
+            for thread in self.threads:
+                thread.join()
+
+
+class PriorityView():
+    '''The submit of a PriorityExecutor with a fixed priority, handed to the translators of a job as their executor.'''
+
+    def __init__(self, executor:PriorityExecutor, priority:int) -> None:
+        self.executor = executor
+        self.priority = priority
+
+    def submit(self, function, *args, **kwargs) -> Future:
+        return self.executor.submit(function, *args, priority=self.priority, **kwargs)
+
+
+class TranslationWorker():
+    '''
+    Long running translator of the jobs dropped into a spool directory.
+
+    The worker keeps the backend, the rate limiter, the translation memory and the metrics of
+    GptSrtTranslator warm for every job, so jobs submitted by different tools share the rate limits
+    of the account. The spool directory holds:
+
+        queue/      job files waiting to be started, written by submit_job
+        running/    jobs being translated, a job is claimed by moving its file here
+        done/       finished jobs
+        failed/     jobs with errors or slices which could not be translated
+        status/     the status of every job, replaced atomically on every change
+
+    Up to parallel_jobs jobs are translated at once, their slices share concurrency request threads
+    and are sent by the priority of their job.
+    Jobs left in running/ by a stopped worker are queued again on start, the journal of the
+    translation lets them resume.
+
+    One worker runs on a spool directory, it holds the lock of worker.lock in the spool while it runs.
+    Another worker started on the same spool stops with an error instead of taking over the jobs.
+    '''
+
+    def __init__(self, spool:str, parallel_jobs:int=2, concurrency:int=4, poll_interval:float=2) -> None:
+        self.spool = spool
+        self.parallel_jobs = max(1, parallel_jobs)
+        self.concurrency = max(1, concurrency)
+        self.poll_interval = poll_interval
+
+        for directory in ("queue", "running", "done", "failed", "status"):
+            os.makedirs(os.path.join(spool, directory), exist_ok=True)
+
+        # request threads shared by the slices of every job
+        self.executor = PriorityExecutor(self.concurrency)
+        self.jobs = ThreadPoolExecutor(max_workers=self.parallel_jobs)
+        self.running = set()
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.lock_file = None
+
+    def lock_spool(self) -> None:
+        # the lock is released by the system when the worker process dies, a new worker can take over then
+        self.lock_file = open(os.path.join(self.spool, "worker.lock"), 'a+')
+        try:
+            if fcntl:
+                fcntl.flock(self.lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                self.lock_file.seek(0)
+                msvcrt.locking(self.lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+        except OSError:
+            self.lock_file.close()
+            self.lock_file = None
+            raise RuntimeError(f"Another worker is running on {self.spool}")
+
+    def unlock_spool(self) -> None:
+        if self.lock_file:
+            # closing the file releases the lock
+            self.lock_file.close()
+            self.lock_file = None
+
+    def path(self, directory:str, name:str) -> str:
+        return os.path.join(self.spool, directory, name + ".json")
+
+    def write_status(self, name:str, job:dict, state:str, **fields) -> None:
+        update_status(self.spool, name, job, state, **fields)
+
+    def recover(self) -> None:
+        # jobs of a stopped worker are started again, the journal of their translation lets them resume
+        for file_name in os.listdir(os.path.join(self.spool, "running")):
+            if file_name.endswith(".json"):
+                logger.warning("Requeueing interrupted job %s", file_name)
+                os.replace(os.path.join(self.spool, "running", file_name), os.path.join(self.spool, "queue", file_name))
+
+    def queued(self) -> list:
+        '''Returns the waiting jobs as (priority, submitted, name, job), the job to start first comes first.'''
+        jobs = []
+        for file_name in os.listdir(os.path.join(self.spool, "queue")):
+            if not file_name.endswith(".json"):
+                continue
+            name = file_name[:-len(".json")]
+            try:
+                with open(self.path("queue", name), 'r', encoding="utf8") as file:
+                    job = json.load(file)
+            except (OSError, json.JSONDecodeError) as e:
+                logger.error("Unreadable job %s: %s", file_name, e)
+                self.finish(name, "queue", "failed", {}, error=f"unreadable job file: {e}")
+                continue
+            jobs.append((-job.get("priority", 0), job.get("submitted", 0), name, job))
+
+        # names are unique, the jobs themselves are never compared
+        return sorted(jobs)
+
+    def claim(self, name:str) -> bool:
+        # moving the file is atomic, a job removed from the queue meanwhile is skipped
+        try:
+            os.replace(self.path("queue", name), self.path("running", name))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def finish(self, name:str, directory:str, state:str, job:dict, **fields) -> None:
+        self.write_status(name, job, state, finished=time.time(), **fields)
+        os.replace(self.path(directory, name), self.path(state, name))
+
+    def translators(self, job:dict) -> tuple:
+        '''Returns the translators of a job and the runner translating them.'''
+        from GptSrtTranslator import GptSrtTranslator
+
+        options = {key: job[key] for key in JOB_OPTIONS if key in job}
+        options.update(input_file=job["input_file"], executor=self.executor.for_priority(job.get("priority", 0)),
+                       concurrency=self.concurrency)
+
+        output_languages = job.get("output_languages") or [job.get("output_language", "hungarian")]
+        options["output_language"] = output_languages[0]
+        if len(output_languages) > 1:
+            from multilanguage import MultiLanguageTranslator
+
+            multi = MultiLanguageTranslator(output_languages,
+                                            output_files=[output_file_name(job["input_file"], language, job.get("output_dir"))
+                                                          for language in output_languages],
+                                            languages_per_request=job.get("languages_per_request", 1),
+                                            **options)
+            return multi.translators, multi.translate
+
+        output_file = job.get("output_file") or output_file_name(job["input_file"], output_languages[0], job.get("output_dir"))
+        translator = GptSrtTranslator(output_file=output_file, **options)
+        return [translator], translator.translate
+
+    def run_job(self, name:str, job:dict) -> None:
+        started = time.time()
+        self.write_status(name, job, "running", started=started)
+        logger.info("Job %s started: %s", name, job["input_file"])
+
+        try:
+            translators, translate = self.translators(job)
+            translate()
+        except Exception as e:
+            logger.error("Job %s failed: %s", name, e)
+            self.finish(name, "running", "failed", job, error=str(e), elapsed=round(time.time() - started, 3))
+            return
+        finally:
+            with self.lock:
+                self.running.discard(name)
+
+        failed_slices = sum(translator.failed_slices for translator in translators)
+        self.finish(name, "running", "failed" if failed_slices else "done", job,
+                    output_files=[translator.output_file for translator in translators],
+                    subtitles=sum(len(translator.cues) for translator in translators),
+                    failed_slices=failed_slices,
+                    requests=sum(translator.requests for translator in translators),
+                    prompt_tokens=sum(translator.prompt_tokens for translator in translators),
+                    completion_tokens=sum(translator.completion_tokens for translator in translators),
+                    elapsed=round(time.time() - started, 3))
+        logger.info("Job %s finished in %.1f sec", name, time.time() - started)
+
+    def poll(self) -> int:
+        '''Starts the waiting jobs with the highest priority while job slots are free, returns the number started.'''
+        started = 0
+        for _, _, name, job in self.queued():
+            with self.lock:
+                if len(self.running) >= self.parallel_jobs:
+                    break
+                if not self.claim(name):
+                    continue
+                self.running.add(name)
+
+            self.jobs.submit(self.run_job, name, job)
+            started += 1
+        return started
+
+    def run(self, once:bool=False) -> None:
+        '''Processes the jobs until stop is called, with once the worker returns when the queue is empty.'''
+        self.lock_spool()
+        self.recover()
+        # submit_job writes the queued status, the jobs requeued by recover were running
+        for _, _, name, job in self.queued():
+            self.write_status(name, job, "queued")
+        logger.info("Worker started on %s, %d parallel jobs, %d parallel requests", self.spool, self.parallel_jobs, self.concurrency)
+
+        try:
+            while not self.stopped.is_set():
+                self.poll()
+                with self.lock:
+                    idle = not self.running
+                if once and idle and not self.queued():
+                    break
+                self.stopped.wait(self.poll_interval)
+        finally:
+            self.jobs.shutdown(wait=True)
+            self.executor.shutdown(wait=True)
+            self.unlock_spool()
+            logger.info("Worker stopped")
+
+    def stop(self) -> None:
+        '''Stops taking new jobs, the running ones are finished.'''
+        self.stopped.set()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Translation worker processing the srt jobs of a spool directory.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help='Process the jobs of the spool directory')
+    run_parser.add_argument('spool', type=str, help='Spool directory of the jobs')
+    run_parser.add_argument('--openai_api_key', '-a', type=str, default=os.environ.get("OPENAI_API_KEY"), help='API key for OpenAI, default: the OPENAI_API_KEY environment variable')
+    run_parser.add_argument('--parallel_jobs', '-p', type=int, default=2, help='Number of jobs translated in parallel, default: 2')
+    run_parser.add_argument('--concurrency', '-c', type=int, default=4, help='Number of requests sent in parallel for all jobs, default: 4')
+    run_parser.add_argument('--poll_interval', type=float, default=2, help='Seconds between looks into the spool directory, default: 2')
+    run_parser.add_argument('--once', action='store_true', help='Stop when the queue is empty instead of waiting for new jobs')
+    add_service_arguments(run_parser, log_file="worker.log", log_level="INFO")
+
+    submit_parser = subparsers.add_parser('submit', help='Add a job to the spool directory')
+    submit_parser.add_argument('spool', type=str, help='Spool directory of the jobs')
+    submit_parser.add_argument('--input_file', '-f', type=str, required=True, help='Input SRT file')
+    submit_parser.add_argument('--input_language', '-i', type=str, required=True, help='Language of input SRT file')
+    submit_parser.add_argument('--output_language', '-o', type=str, default="English", help='Language to translate to, default: English')
+    submit_parser.add_argument('--output_languages', type=str, nargs='+', default=None, help='Several languages to translate to at once, default: the output language')
+    submit_parser.add_argument('--output_file', '-s', type=str, default=None, help='Output SRT file path, default: next to the input file named after the language')
+    submit_parser.add_argument('--priority', type=int, default=0, help='Jobs with a higher priority are started first, default: 0')
+
+    args = parser.parse_args()
+
+    if args.command == "submit":
+        options = {key: value for key, value in vars(args).items()
+                   if key not in ("command", "spool", "input_file", "priority") and value is not None}
+        if options.get("output_file"):
+            options["output_file"] = os.path.abspath(options["output_file"])
+        print(submit_job(args.spool, args.input_file, args.priority, **options))
+    else:
+        # one warm backend, rate limiter and translation memory for every job of the worker
+        metrics = setup_services(args)
+
+        worker = TranslationWorker(args.spool, args.parallel_jobs, args.concurrency, args.poll_interval)
+        try:
+            worker.run(once=args.once)
+        except KeyboardInterrupt:
+            # the running jobs were finished, the waiting ones stay in the queue for the next start
+            logger.warning("Worker interrupted")
+        except RuntimeError as e:
+            print(e)
+            sys.exit(1)
+        print(metrics.summary())
+        metrics.close()